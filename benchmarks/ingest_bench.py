@@ -0,0 +1,78 @@
+# benchmarks/ingest_bench.py
+# Peak memory and time of ingesting a CSV: the old upload path (download the whole
+# object, parse it with pandas, profile the frame) against the streaming one
+# (dataset_loader.ingest_dataset). Each runs in its own process against a local
+# filesystem store (S3_FAKE_ROOT).
+#   python benchmarks/ingest_bench.py --rows 5000000
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BUCKET = "bench"
+KEY = "sales/data.csv"
+
+
+def generate(root: str, rows: int):
+    import numpy as np
+    import pandas as pd
+    path = os.path.join(root, BUCKET, *KEY.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = np.random.default_rng(0)
+    chunk = 500000
+    with open(path, "w") as f:
+        for start in range(0, rows, chunk):
+            n = min(chunk, rows - start)
+            pd.DataFrame({
+                "region": rng.choice(["North", "South", "East", "West"], n),
+                "store": rng.choice([f"store-{i:04d}" for i in range(2000)], n),
+                "day": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D"),
+                "qty": rng.integers(1, 50, n),
+                "price": rng.integers(100, 100000, n) / 100,
+                "order_id": np.arange(start, start + n),
+            }).to_csv(f, index=False, header=start == 0, date_format="%Y-%m-%d")
+    return os.path.getsize(path)
+
+
+def run(mode: str):
+    import dataset_loader
+    import dtypes
+    import storage
+    start = time.perf_counter()
+    if mode == "full":
+        df = dataset_loader.read_dataframe(storage.download(storage.client, BUCKET, KEY), KEY)
+        rows, plan = len(df), dtypes.profile(df)
+    else:
+        summary = dataset_loader.ingest_dataset(storage.client, BUCKET, KEY)
+        rows, plan = summary["num_rows"], summary["dtype_plan"]
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB on Linux
+    print(json.dumps({"mode": mode, "rows": rows, "seconds": round(elapsed, 2), "peak_rss_mb": round(peak / 2 ** 20),
+                      "plan": {c: e["dtype"] for c, e in plan.items()}}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--mode", choices=["full", "stream"])
+    args = parser.parse_args()
+    if args.mode:
+        run(args.mode)
+        return
+    with tempfile.TemporaryDirectory() as root:
+        size = generate(root, args.rows)
+        print(f"{args.rows} rows, {size / 2 ** 20:.0f} MB")
+        env = {**os.environ, "S3_FAKE_ROOT": root, "SNAPSHOT_DIR": os.path.join(root, "snapshots")}
+        for mode in ("full", "stream"):
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--rows", str(args.rows)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
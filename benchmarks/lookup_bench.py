@@ -0,0 +1,104 @@
+# benchmarks/lookup_bench.py
+# Lookup latency of the hot crud paths on a seeded database, before (revision 0002) and
+# after (head) the lookup indexes.
+#   python benchmarks/lookup_bench.py --url sqlite:///bench.db --analyses 100000
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(session, models, analyses: int):
+    from sqlalchemy import insert
+    datasets = max(analyses // 100, 1)
+    sheets = max(analyses // 10, 1)
+    session.execute(insert(models.DatasetMetadata), [
+        {"id": i, "dataset_name": f"ds{i}", "s3_bucket": "bench", "s3_key": f"ds{i}/"} for i in range(1, datasets + 1)
+    ])
+    session.execute(insert(models.Report), [{"id": 1, "name": "bench"}])
+    session.execute(insert(models.Sheet), [{"id": i, "name": f"s{i}", "report_id": 1} for i in range(1, sheets + 1)])
+    batch = 20000
+    for start in range(1, analyses + 1, batch):
+        ids = range(start, min(start + batch, analyses + 1))
+        session.execute(insert(models.Analysis), [
+            {"id": i, "dataset_id": i % datasets + 1, "analysis_name": f"a{i}", "analysis_type": "pivot", "config": {}}
+            for i in ids
+        ])
+        session.execute(insert(models.FilterSelection), [
+            {"dataset_id": i % datasets + 1, "analysis_id": i, "selected_columns": ["c"]} for i in ids
+        ])
+        session.execute(insert(models.CalculatedField), [
+            {"analysis_id": i, "dataset_id": i % datasets + 1, "field_name": f"f{k}", "formula": "a + 1"}
+            for i in ids for k in range(3)
+        ])
+        session.execute(insert(models.SheetAnalysisMap), [
+            {"sheet_id": i % sheets + 1, "analysis_id": i} for i in ids
+        ])
+    session.commit()
+    return datasets, sheets
+
+
+def measure(session, crud, models, analyses, datasets, sheets, lookups):
+    rng = random.Random(0)
+    cases = {
+        "get_saved_filter": lambda: crud.get_saved_filter(session, (a := rng.randint(1, analyses)) % datasets + 1, a),
+        "calculated_fields_by_analysis": lambda: crud.get_calculated_fields_by_analysis(session, rng.randint(1, analyses)),
+        "analyses_by_dataset": lambda: crud.get_analyses_by_dataset(session, rng.randint(1, datasets)),
+        "sheet_maps_by_sheet": lambda: session.query(models.SheetAnalysisMap).filter_by(sheet_id=rng.randint(1, sheets)).all(),
+    }
+    results = {}
+    for name, fn in cases.items():
+        timings = []
+        for _ in range(lookups):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+            session.expunge_all()
+        results[name] = (statistics.median(timings) * 1000, sorted(timings)[int(len(timings) * 0.95)] * 1000)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="sqlite:///" + os.path.join(ROOT, "bench.db"))
+    parser.add_argument("--analyses", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    # the app modules read DATABASE_URL at import time
+    os.environ["DATABASE_URL"] = args.url
+
+    from alembic import command
+    from alembic.config import Config
+    import crud
+    import db
+    import models
+
+    cfg = Config(os.path.join(ROOT, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    cfg.set_main_option("sqlalchemy.url", args.url)
+    command.downgrade(cfg, "base")
+    command.upgrade(cfg, "0002")
+    session = db.SessionLocal()
+    start = time.perf_counter()
+    datasets, sheets = seed(session, models, args.analyses)
+    print(f"seeded {args.analyses} analyses, {datasets} datasets, {sheets} sheets in {time.perf_counter() - start:.1f}s")
+
+    before = measure(session, crud, models, args.analyses, datasets, sheets, args.lookups)
+    session.close()
+    command.upgrade(cfg, "head")
+    session = db.SessionLocal()
+    after = measure(session, crud, models, args.analyses, datasets, sheets, args.lookups)
+    session.close()
+
+    print(f"{'lookup':<32}{'p50 before':>12}{'p50 after':>12}{'p95 before':>12}{'p95 after':>12}  (ms)")
+    for name in before:
+        print(f"{name:<32}{before[name][0]:>12.3f}{after[name][0]:>12.3f}{before[name][1]:>12.3f}{after[name][1]:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
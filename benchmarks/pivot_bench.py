@@ -0,0 +1,74 @@
+# benchmarks/pivot_bench.py
+# Compare the pivot engine with the previous pd.pivot_table(margins=True) + row-wise
+# "Total" detection path on synthetic data.
+#   python benchmarks/pivot_bench.py --rows 1000000 10000000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pivot  # noqa: E402
+
+
+def make_frame(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "region": rng.choice(["North", "South", "East", "West"], n),
+        "product": rng.choice([f"P{i}" for i in range(50)], n),
+        "channel": rng.choice(["web", "store", "phone"], n),
+        "sales": rng.random(n) * 100,
+        "qty": rng.integers(0, 20, n),
+    })
+
+
+def legacy(df, rows, columns, agg_dict):
+    table = pd.pivot_table(df, index=rows or None, columns=columns or None, values=list(agg_dict),
+                           aggfunc=agg_dict, margins=True, margins_name="Total")
+    table = table.reset_index()
+    table.columns = [
+        "_".join([str(x) for x in col if x not in ["", None]]) if isinstance(col, tuple) else str(col)
+        for col in table.columns
+    ]
+    total_row = table[table.apply(lambda r: "Total" in " ".join(r.astype(str)), axis=1)]
+    table = table[~table.apply(lambda r: "Total" in " ".join(r.astype(str)), axis=1)]
+    return pd.concat([table, total_row], ignore_index=True)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+CASES = [
+    (["region"], ["channel"], {"sales": "sum", "qty": "mean"}),
+    (["region", "product"], ["channel"], {"sales": "sum", "qty": "max"}),
+    (["product"], [], {"sales": "mean"}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(f"{'rows':>10}  {'case':<40} {'legacy s':>9} {'engine s':>9} {'speedup':>8}")
+    for n in args.rows:
+        df = make_frame(n)
+        for rows, columns, agg_dict in CASES:
+            old = timed(lambda: legacy(df, rows, columns, agg_dict), args.repeat)
+            new = timed(lambda: pivot.pivot(df, rows, columns, agg_dict), args.repeat)
+            case = f"{'+'.join(rows)} x {'+'.join(columns) or '-'} {','.join(agg_dict.values())}"
+            print(f"{n:>10}  {case:<40} {old:>9.3f} {new:>9.3f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,70 @@
 # crud.py
-import boto3
 import pandas as pd
-from io import BytesIO
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from db import release
+from datetime import datetime
 from typing import List, Any, Optional
-import os
 from dotenv import load_dotenv
+import cube
+import dataset_loader
+import dtypes
+import filters
+import formula
+import pagination
+import snapshots
+import storage
 from models import (DatasetMetadata, Analysis, CalculatedField, FilterSelection,
-                    Report, Sheet, SheetAnalysisMap)
+                    Report, Sheet, SheetAnalysisMap, IngestJob)
 
 load_dotenv()
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
-)
+s3_client = storage.client
 
 # S3 helpers
-def get_latest_file_from_s3(bucket: str, prefix: str) -> str:
-    resp = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    if "Contents" not in resp:
-        raise Exception("No files found in S3 prefix")
-    latest_obj = max(resp["Contents"], key=lambda x: x["LastModified"])
-    return latest_obj["Key"]
-
-def fetch_dataset_from_s3(bucket: str, key: str) -> pd.DataFrame:
-    obj = s3_client.get_object(Bucket=bucket, Key=key)
-    raw = obj["Body"].read()
-    if key.endswith(".parquet"):
-        return pd.read_parquet(BytesIO(raw))
-    elif key.endswith(".csv"):
-        return pd.read_csv(BytesIO(raw))
-    elif key.endswith((".xlsx", ".xls")):
-        return pd.read_excel(BytesIO(raw))
-    else:
-        raise Exception(f"Unsupported file type: {key}")
+# Newest key under the prefix; the full listing is paginated and cached for
+# storage.LATEST_FILE_TTL seconds (S3 events keep it current in between)
+def get_latest_file_from_s3(bucket: str, prefix: str, refresh: bool = False) -> str:
+    return storage.latest_files.resolve(s3_client, bucket, prefix, refresh=refresh)
+
+# Goes through the shared DataFrame cache; the returned frame must not be mutated in place
+# With `columns`, only those columns are parsed/loaded; with `dtype_plan`, they come
+# back with the dataset's profiled dtypes (see get_dtype_plan)
+def fetch_dataset_from_s3(bucket: str, key: str, columns: Optional[List[str]] = None,
+                          dtype_plan: Optional[dict] = None) -> pd.DataFrame:
+    return dataset_loader.load_dataset(s3_client, bucket, key, columns, dtype_plan)
+
+# Same as fetch_dataset_from_s3, but Parquet row groups the saved filter rules out by
+# their statistics are never downloaded (the filter itself still has to be applied)
+def fetch_filtered_dataset_from_s3(bucket: str, key: str, saved: Any, columns: Optional[List[str]] = None,
+                                   dtype_plan: Optional[dict] = None) -> pd.DataFrame:
+    preds = filters.compile_filter(saved)
+    if not preds:
+        return fetch_dataset_from_s3(bucket, key, columns, dtype_plan)
+    return dataset_loader.load_dataset_pruned(s3_client, bucket, key,
+                                              lambda metadata: filters.prune_row_groups(metadata, preds, dtype_plan),
+                                              columns, dtype_plan)
+
+# Arrow view of the whole file (its snapshot) for batch-wise reads
+def fetch_dataset_table(bucket: str, key: str):
+    return dataset_loader.snapshot_table(s3_client, bucket, key)
+
+# Stream a file once: num_rows, num_columns, column_schema and dtype_plan, with the
+# snapshot written along the way; memory is bounded by the batch size, not the file
+def ingest_dataset(bucket: str, key: str, progress=None) -> dict:
+    return dataset_loader.ingest_dataset(s3_client, bucket, key, progress)
+
+def probe_dataset_schema(bucket: str, key: str) -> List[dict]:
+    return dataset_loader.probe_schema(s3_client, bucket, key)
+
 
 # Dataset metadata
-def create_dataset_metadata(db: Session, data, latest_file: str):
-    db_item = DatasetMetadata(**data.dict(), latest_file=latest_file)
+def create_dataset_metadata(db: Session, data, latest_file: str, num_rows: Optional[int] = None,
+                            num_columns: Optional[int] = None, column_schema: Optional[List[dict]] = None,
+                            dtype_plan: Optional[dict] = None):
+    db_item = DatasetMetadata(**data.dict(), latest_file=latest_file, num_rows=num_rows,
+                              num_columns=num_columns, column_schema=column_schema, dtype_plan=dtype_plan)
     db.add(db_item)
     db.commit()
     db.refresh(db_item)
@@ -52,6 +76,143 @@ def get_all_datasets(db: Session):
 def get_dataset_by_id(db: Session, dataset_id: int) -> Optional[DatasetMetadata]:
     return db.query(DatasetMetadata).filter(DatasetMetadata.id == dataset_id).first()
 
+# Re-resolve the newest object under the dataset prefix; when it moved on, persist the
+# new latest_file and drop the snapshot of the file it replaced.
+# force=True lists the prefix even when the cached newest key is still fresh.
+def refresh_latest_file(db: Session, metadata: DatasetMetadata, force: bool = False) -> str:
+    latest_file = get_latest_file_from_s3(metadata.s3_bucket, metadata.s3_key, refresh=force)
+    if latest_file != metadata.latest_file:
+        if metadata.latest_file:
+            snapshots.invalidate(metadata.s3_bucket, metadata.latest_file)
+        cube.invalidate(metadata.id)
+        metadata.latest_file = latest_file
+        metadata.column_schema = None
+        metadata.row_index = None
+        metadata.dtype_plan = None
+        metadata.num_rows = None
+        db.commit()
+        db.refresh(metadata)
+    return latest_file
+
+# An S3 object was created/removed: update the cached latest file of every prefix it
+# falls under and re-point the datasets reading those prefixes
+def apply_s3_event(db: Session, bucket: str, key: str, created: bool, event_time=None) -> List[DatasetMetadata]:
+    storage.latest_files.notify(bucket, key, created, event_time)
+    datasets = db.query(DatasetMetadata).filter(DatasetMetadata.s3_bucket == bucket).all()
+    updated = []
+    for metadata in datasets:
+        if not key.startswith(metadata.s3_key):
+            continue
+        previous = metadata.latest_file
+        try:
+            refresh_latest_file(db, metadata)
+        except Exception:
+            # prefix is now empty; keep the last known file
+            continue
+        if metadata.latest_file != previous:
+            updated.append(metadata)
+    return updated
+
+# One page of latest_file; total_rows and the CSV row index are cached on the row
+def fetch_dataset_page(db: Session, metadata: DatasetMetadata, start: int, limit: int):
+    release(db)
+    page, total_rows, row_index = pagination.read_page(
+        s3_client, metadata.s3_bucket, metadata.latest_file, start, limit, metadata.row_index, metadata.dtype_plan
+    )
+    if row_index is not metadata.row_index or total_rows != metadata.num_rows:
+        metadata.row_index = row_index
+        metadata.num_rows = total_rows
+        db.commit()
+    return page, total_rows
+
+# Column names + dtypes of latest_file, probed once and then served from the row
+def get_dataset_schema(db: Session, metadata: DatasetMetadata) -> List[dict]:
+    if metadata.column_schema is None:
+        release(db)
+        metadata.column_schema = probe_dataset_schema(metadata.s3_bucket, metadata.latest_file)
+        db.commit()
+        db.refresh(metadata)
+    return metadata.column_schema
+
+# Dtype plan of latest_file, profiled on first use after the file changed
+def get_dtype_plan(db: Session, metadata: DatasetMetadata) -> dict:
+    if metadata.dtype_plan is None:
+        release(db)
+        apply_ingest_summary(db, metadata, ingest_dataset(metadata.s3_bucket, metadata.latest_file))
+    return metadata.dtype_plan
+
+# Store what an ingestion pass found about latest_file
+def apply_ingest_summary(db: Session, metadata: DatasetMetadata, summary: dict):
+    metadata.dtype_plan = summary["dtype_plan"]
+    metadata.num_rows = summary["num_rows"]
+    metadata.num_columns = summary["num_columns"]
+    metadata.column_schema = summary["column_schema"]
+    db.commit()
+    db.refresh(metadata)
+
+# Ingestion jobs (run by jobs.py)
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+def create_ingest_job(db: Session, kind: str, dataset_id: int, payload: Optional[dict] = None,
+                      run_after: Optional[datetime] = None) -> IngestJob:
+    job = IngestJob(kind=kind, dataset_id=dataset_id, status="queued", progress=0, payload=payload or {},
+                    run_after=run_after or datetime.utcnow())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_ingest_job(db: Session, job_id: int) -> Optional[IngestJob]:
+    return db.get(IngestJob, job_id)
+
+def get_ingest_jobs_by_dataset(db: Session, dataset_id: int, limit: int = 20) -> List[IngestJob]:
+    return list(db.scalars(select(IngestJob).where(IngestJob.dataset_id == dataset_id)
+                           .order_by(IngestJob.id.desc()).limit(limit)))
+
+# Queued or running job of that kind for the dataset, if any
+def get_active_ingest_job(db: Session, dataset_id: int, kind: Optional[str] = None) -> Optional[IngestJob]:
+    query = select(IngestJob).where(IngestJob.dataset_id == dataset_id, IngestJob.status.in_(ACTIVE_JOB_STATUSES))
+    if kind:
+        query = query.where(IngestJob.kind == kind)
+    return db.scalars(query.order_by(IngestJob.id).limit(1)).first()
+
+# Take the next due job: the conditional UPDATE makes the claim atomic, so several
+# worker processes can share one table
+def claim_next_ingest_job(db: Session) -> Optional[int]:
+    now = datetime.utcnow()
+    candidates = db.scalars(select(IngestJob.id).where(IngestJob.status == "queued", IngestJob.run_after <= now)
+                            .order_by(IngestJob.run_after, IngestJob.id).limit(5)).all()
+    for job_id in candidates:
+        claimed = db.execute(update(IngestJob).where(IngestJob.id == job_id, IngestJob.status == "queued")
+                             .values(status="running", started_at=now, heartbeat_at=now)).rowcount
+        db.commit()
+        if claimed:
+            return job_id
+    return None
+
+def update_ingest_job_progress(db: Session, job_id: int, progress: int):
+    db.execute(update(IngestJob).where(IngestJob.id == job_id)
+               .values(progress=progress, heartbeat_at=datetime.utcnow()))
+    db.commit()
+
+# Jobs still running in this process are alive, whether or not they report progress
+def touch_ingest_jobs(db: Session, job_ids: List[int]):
+    db.execute(update(IngestJob).where(IngestJob.id.in_(job_ids), IngestJob.status == "running")
+               .values(heartbeat_at=datetime.utcnow()))
+    db.commit()
+
+def finish_ingest_job(db: Session, job_id: int, error: Optional[str] = None):
+    values = {"status": "failed", "error": error} if error else {"status": "succeeded", "progress": 100}
+    db.execute(update(IngestJob).where(IngestJob.id == job_id).values(finished_at=datetime.utcnow(), **values))
+    db.commit()
+
+# Running jobs whose worker stopped reporting (process died mid-job) go back in the queue
+def requeue_stale_ingest_jobs(db: Session, stale_before: datetime) -> int:
+    count = db.execute(update(IngestJob).where(IngestJob.status == "running", IngestJob.heartbeat_at < stale_before)
+                       .values(status="queued", progress=0)).rowcount
+    db.commit()
+    return count
+
 # Analysis
 def create_analysis(db: Session, analysis):
     db_analysis = Analysis(
@@ -79,11 +240,62 @@ def update_analysis_config(db: Session, analysis_id: int, config: dict):
         db.refresh(analysis)
     return analysis
 
+# Materialized aggregates
+def analysis_cube_signature(db: Session, metadata: DatasetMetadata, analysis_id: int) -> str:
+    version = dataset_loader.object_version(s3_client, metadata.s3_bucket, metadata.latest_file)
+    saved = get_saved_filter(db, metadata.id, analysis_id)
+    calc = {f.field_name: f.formula for f in get_calculated_fields_by_analysis(db, analysis_id)}
+    return cube.signature(version, saved, calc, dtypes.plan_tag(metadata.dtype_plan))
+
+# Group the dataset by the saved analysis's rows + columns and store the partials,
+# unless a cube for the current file, filters and calculated fields already exists
+def materialize_analysis_cube(db: Session, analysis_id: int) -> Optional[str]:
+    analysis = get_analysis(db, analysis_id)
+    if not analysis:
+        return None
+    metadata = get_dataset_by_id(db, analysis.dataset_id)
+    config = analysis.config or {}
+    rows = config.get("rows") or []
+    columns = config.get("columns") or []
+    measures = [v["column"] for v in config.get("values") or [] if v.get("column")]
+    dims = list(dict.fromkeys(rows + columns))
+    if not metadata or not dims or not measures:
+        return None
+    if metadata.dtype_plan is None and get_active_ingest_job(db, metadata.id):
+        # the ingestion job is profiling the file; the next preview schedules the cube
+        return None
+    dtype_plan = get_dtype_plan(db, metadata)
+    sig = analysis_cube_signature(db, metadata, analysis_id)
+    if cube.has_cube(metadata.id, analysis_id, sig):
+        return None
+    saved = get_saved_filter(db, metadata.id, analysis_id)
+    calc = {f.field_name: f.formula for f in get_calculated_fields_by_analysis(db, analysis_id)}
+    schema_columns = [c["name"] for c in get_dataset_schema(db, metadata)]
+    # don't hold a pooled connection through the download and the group-by
+    release(db)
+    requested = dims + measures + (list(saved) if isinstance(saved, (list, dict)) else [])
+    plan = formula.plan_fields(calc, schema_columns, requested)
+    df = fetch_filtered_dataset_from_s3(metadata.s3_bucket, metadata.latest_file, saved,
+                                        plan.input_columns(requested, schema_columns), dtype_plan).copy(deep=False)
+    for name, values in plan.evaluate(df, dtype_plan).items():
+        df[name] = values
+    df, _ = filters.apply_saved_filter(df, saved, rows, columns)
+    return cube.materialize(metadata.id, analysis_id, sig, df, dims, measures)
+
 # Calculated fields
 def create_calculated_field(db: Session, payload):
     analysis = get_analysis(db, payload.analysis_id)
     if not analysis:
         raise Exception("Analysis not found")
+    # fail now rather than at preview time: syntax, functions, column references and
+    # circular references through the analysis's other calculated fields
+    dataset = get_dataset_by_id(db, analysis.dataset_id)
+    columns = [c["name"] for c in get_dataset_schema(db, dataset)]
+    fields = {f.field_name: f.formula for f in get_calculated_fields_by_analysis(db, analysis.id)}
+    if payload.field_name in fields:
+        raise ValueError(f"Calculated field '{payload.field_name}' already exists for analysis {analysis.id}")
+    fields[payload.field_name] = payload.formula
+    formula.plan_fields(fields, columns)
     calc = CalculatedField(
         analysis_id=payload.analysis_id,
         dataset_id=analysis.dataset_id,
@@ -96,6 +308,49 @@ def create_calculated_field(db: Session, payload):
     db.refresh(calc)
     return calc
 
+# Validates every field like create_calculated_field, then inserts them all in one
+# statement and one transaction
+def create_calculated_fields(db: Session, payloads: List[Any]) -> List[dict]:
+    if not payloads:
+        return []
+    analysis_ids = {p.analysis_id for p in payloads}
+    analyses = {a.id: a for a in db.query(Analysis).filter(Analysis.id.in_(analysis_ids))}
+    missing = sorted(analysis_ids - set(analyses))
+    if missing:
+        raise Exception(f"Analysis not found: {missing}")
+    existing = {}
+    for f in db.query(CalculatedField).filter(CalculatedField.analysis_id.in_(analysis_ids)):
+        existing.setdefault(f.analysis_id, {})[f.field_name] = f.formula
+    datasets = {d.id: d for d in db.query(DatasetMetadata).filter(
+        DatasetMetadata.id.in_({a.dataset_id for a in analyses.values()}))}
+    new_fields = {}
+    for p in payloads:
+        fields = new_fields.setdefault(p.analysis_id, {})
+        if p.field_name in fields:
+            raise Exception(f"Duplicate calculated field '{p.field_name}' for analysis {p.analysis_id}")
+        if p.field_name in existing.get(p.analysis_id, {}):
+            raise ValueError(f"Calculated field '{p.field_name}' already exists for analysis {p.analysis_id}")
+        fields[p.field_name] = p.formula
+    columns = {}
+    for analysis_id, fields in new_fields.items():
+        dataset_id = analyses[analysis_id].dataset_id
+        if dataset_id not in columns:
+            columns[dataset_id] = [c["name"] for c in get_dataset_schema(db, datasets[dataset_id])]
+        formula.plan_fields({**existing.get(analysis_id, {}), **fields}, columns[dataset_id])
+    stmt = insert(CalculatedField).returning(
+        CalculatedField.id, CalculatedField.analysis_id, CalculatedField.field_name,
+        CalculatedField.formula, CalculatedField.default_agg
+    )
+    rows = db.execute(stmt, [{
+        "analysis_id": p.analysis_id,
+        "dataset_id": analyses[p.analysis_id].dataset_id,
+        "field_name": p.field_name,
+        "formula": p.formula,
+        "default_agg": p.default_agg
+    } for p in payloads]).all()
+    db.commit()
+    return [row._asdict() for row in sorted(rows, key=lambda r: r.id)]
+
 def get_calculated_fields_by_analysis(db: Session, analysis_id: int) -> List[CalculatedField]:
     return db.query(CalculatedField).filter(CalculatedField.analysis_id == analysis_id).all()
 
@@ -108,35 +363,67 @@ def delete_calculated_field(db: Session, field_id: int) -> bool:
     return True
 
 # Filters
-def save_filter(db: Session, dataset_id: int, analysis_id: int, selected_columns: Any):
-    existing = db.query(FilterSelection).filter_by(dataset_id=int(dataset_id), analysis_id=int(analysis_id)).first()
-    if existing:
-        existing.selected_columns = selected_columns
-        db.add(existing)
-        db.commit()
-        db.refresh(existing)
-        return existing
-    new_entry = FilterSelection(
+# One atomic INSERT ... ON CONFLICT (dataset_id, analysis_id) DO UPDATE ... RETURNING;
+# concurrent saves can't race into duplicate rows (uq_filters_dataset_analysis)
+def save_filter(db: Session, dataset_id: int, analysis_id: int, selected_columns: Any) -> dict:
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        return _save_filter_locked(db, dataset_id, analysis_id, selected_columns)
+    stmt = upsert(FilterSelection).values(
         dataset_id=int(dataset_id),
         analysis_id=int(analysis_id),
         selected_columns=selected_columns
     )
-    db.add(new_entry)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FilterSelection.dataset_id, FilterSelection.analysis_id],
+        set_={"selected_columns": stmt.excluded.selected_columns, "updated_at": func.now()}
+    ).returning(FilterSelection.id, FilterSelection.dataset_id, FilterSelection.analysis_id,
+                FilterSelection.selected_columns)
+    row = db.execute(stmt).one()
     db.commit()
-    db.refresh(new_entry)
-    return new_entry
+    return row._asdict()
+
+# Other dialects: update the locked row or insert one, in one transaction. A concurrent
+# insert of the same pair trips the unique constraint, and the save is retried as an update.
+def _save_filter_locked(db: Session, dataset_id: int, analysis_id: int, selected_columns: Any) -> dict:
+    for attempt in range(2):
+        rec = (db.query(FilterSelection).filter_by(dataset_id=int(dataset_id), analysis_id=int(analysis_id))
+               .with_for_update().first())
+        if rec is None:
+            rec = FilterSelection(dataset_id=int(dataset_id), analysis_id=int(analysis_id),
+                                  selected_columns=selected_columns)
+            db.add(rec)
+        else:
+            rec.selected_columns = selected_columns
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise
+            continue
+        saved = {"id": rec.id, "dataset_id": rec.dataset_id, "analysis_id": rec.analysis_id,
+                 "selected_columns": rec.selected_columns}
+        db.commit()
+        return saved
+
+def get_filter_record(db: Session, dataset_id: int, analysis_id: int) -> Optional[FilterSelection]:
+    return db.query(FilterSelection).filter_by(dataset_id=int(dataset_id), analysis_id=int(analysis_id)).first()
 
 def get_saved_filter(db: Session, dataset_id: int, analysis_id: int) -> Any:
-    rec = db.query(FilterSelection).filter_by(dataset_id=int(dataset_id), analysis_id=int(analysis_id)).first()
+    rec = get_filter_record(db, dataset_id, analysis_id)
     return rec.selected_columns if rec else None
 
 def delete_filter(db: Session, dataset_id: int, analysis_id: int) -> bool:
-    rec = db.query(FilterSelection).filter_by(dataset_id=int(dataset_id), analysis_id=int(analysis_id)).first()
-    if not rec:
-        return False
-    db.delete(rec)
+    result = db.execute(delete(FilterSelection).where(
+        FilterSelection.dataset_id == int(dataset_id), FilterSelection.analysis_id == int(analysis_id)
+    ))
     db.commit()
-    return True
+    return result.rowcount > 0
 
 # Reports & Sheets
 def create_report(db: Session, name: str):
@@ -160,6 +447,30 @@ def add_analysis_to_sheet(db: Session, sheet_id: int, analysis_id: int):
     db.refresh(mapping)
     return mapping
 
+# Bulk variants: one INSERT ... RETURNING and one commit for the whole batch; rows are
+# returned as plain dicts (in insertion order, i.e. by id) so nothing is lazily reloaded
+# after the commit
+def create_sheets(db: Session, report_id: int, names: List[str]) -> List[dict]:
+    if not names:
+        return []
+    stmt = insert(Sheet).returning(Sheet.id, Sheet.name, Sheet.report_id)
+    rows = db.execute(stmt, [{"name": name, "report_id": report_id} for name in names]).all()
+    db.commit()
+    return [row._asdict() for row in sorted(rows, key=lambda r: r.id)]
+
+def add_analyses_to_sheet(db: Session, sheet_id: int, analysis_ids: List[int]) -> List[dict]:
+    if not analysis_ids:
+        return []
+    stmt = insert(SheetAnalysisMap).returning(SheetAnalysisMap.id, SheetAnalysisMap.sheet_id,
+                                              SheetAnalysisMap.analysis_id)
+    rows = db.execute(stmt, [{"sheet_id": sheet_id, "analysis_id": a} for a in analysis_ids]).all()
+    db.commit()
+    return [row._asdict() for row in sorted(rows, key=lambda r: r.id)]
+
+def get_missing_analysis_ids(db: Session, analysis_ids: List[int]) -> List[int]:
+    found = set(db.scalars(select(Analysis.id).where(Analysis.id.in_(set(analysis_ids)))))
+    return sorted(set(analysis_ids) - found)
+
 def get_all_reports(db: Session):
     return db.query(Report).all()
 def get_sheet(db: Session, sheet_id: int):
@@ -168,6 +479,41 @@ def get_sheet(db: Session, sheet_id: int):
 def get_report(db: Session, report_id: int):
     return db.query(Report).filter(Report.id == report_id).first()
 
+# Whole report payload (sheets -> analyses -> dataset names) from one joined SELECT,
+# however many sheets and mappings it has. None when the report doesn't exist.
+def get_report_tree(db: Session, report_id: int) -> Optional[dict]:
+    mapped = (
+        select(SheetAnalysisMap.id.label("map_id"), SheetAnalysisMap.sheet_id, Analysis.id.label("analysis_id"),
+               Analysis.analysis_name, DatasetMetadata.id.label("dataset_id"), DatasetMetadata.dataset_name)
+        .join(Analysis, Analysis.id == SheetAnalysisMap.analysis_id)
+        .join(DatasetMetadata, DatasetMetadata.id == Analysis.dataset_id)
+        .subquery()
+    )
+    stmt = (
+        select(Report.id, Report.name, Sheet.id.label("sheet_id"), Sheet.name.label("sheet_name"),
+               mapped.c.analysis_id, mapped.c.analysis_name, mapped.c.dataset_id, mapped.c.dataset_name)
+        .outerjoin(Sheet, Sheet.report_id == Report.id)
+        .outerjoin(mapped, mapped.c.sheet_id == Sheet.id)
+        .where(Report.id == report_id)
+        .order_by(Sheet.id, mapped.c.map_id)
+    )
+    rows = db.execute(stmt).all()
+    if not rows:
+        return None
+    sheets = {}
+    for row in rows:
+        if row.sheet_id is None:
+            continue
+        sheet = sheets.setdefault(row.sheet_id, {"sheet_id": row.sheet_id, "name": row.sheet_name, "analyses": []})
+        if row.analysis_id is not None:
+            sheet["analyses"].append({
+                "analysis_id": row.analysis_id,
+                "analysis_name": row.analysis_name,
+                "dataset_id": row.dataset_id,
+                "dataset_name": row.dataset_name
+            })
+    return {"report_id": rows[0].id, "name": rows[0].name, "sheets": list(sheets.values())}
+
 
 # Delete Report
 def delete_report(db: Session, report_id: int):
@@ -0,0 +1,109 @@
+# cube.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+import pivot
+import snapshots
+
+CUBE_DIR = os.getenv("CUBE_DIR", os.path.join(snapshots.SNAPSHOT_DIR, "cubes"))
+
+# A cube is the dataset grouped by a saved analysis's rows + columns, keeping mergeable
+# partials (sum, non-null count, min, max) per value column. Any grouping that is a
+# roll-up of those dimensions can be answered by re-aggregating the partials instead of
+# scanning the raw rows again (see pivot.pivot_partials).
+PARTIALS = ("sum", "count", "min", "max")
+
+
+# Everything that changes the cube's content: the object version, the dtypes it was read
+# with and the filters and calculated fields applied before grouping
+def signature(version: str, saved_filter: Any, calc_fields: Dict[str, str], dtype_tag: str = "") -> str:
+    payload = json.dumps({"version": version, "filter": saved_filter, "fields": calc_fields, "dtypes": dtype_tag},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _dataset_dir(dataset_id: int) -> str:
+    return os.path.join(CUBE_DIR, str(dataset_id))
+
+
+def build(df: pd.DataFrame, dims: List[str], measures: List[str]) -> pd.DataFrame:
+    # dropna=False: rows with a null in a dimension the roll-up later drops must still count
+    return pivot.partials(df, dims, {m: PARTIALS for m in measures}, dropna=False)
+
+
+def materialize(dataset_id: int, analysis_id: int, sig: str, df: pd.DataFrame,
+                dims: List[str], measures: List[str]) -> Optional[str]:
+    data = build(df, dims, measures)
+    try:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    meta = {"signature": sig, "dims": dims, "measures": measures}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"cube": json.dumps(meta).encode()})
+    directory = _dataset_dir(dataset_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{analysis_id}.arrow")
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _open(path: str):
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    meta = json.loads((reader.schema.metadata or {}).get(b"cube", b"{}"))
+    return reader, meta
+
+
+def has_cube(dataset_id: int, analysis_id: int, sig: str) -> bool:
+    path = os.path.join(_dataset_dir(dataset_id), f"{analysis_id}.arrow")
+    if not os.path.exists(path):
+        return False
+    _, meta = _open(path)
+    return meta.get("signature") == sig
+
+
+# The smallest current cube of the dataset whose dimensions and measures cover the request
+def find(dataset_id: int, sig: str, dims: List[str], agg_dict: Dict[str, str]) -> Optional[pd.DataFrame]:
+    if not agg_dict or not pivot.is_mergeable(agg_dict):
+        return None
+    directory = _dataset_dir(dataset_id)
+    if not os.path.isdir(directory):
+        return None
+    best = None
+    for name in os.listdir(directory):
+        if not name.endswith(".arrow"):
+            continue
+        try:
+            reader, meta = _open(os.path.join(directory, name))
+        except (OSError, pa.ArrowInvalid):
+            continue
+        if meta.get("signature") != sig:
+            continue
+        if not set(dims) <= set(meta["dims"]) or not set(agg_dict) <= set(meta["measures"]):
+            continue
+        rows = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+        if best is None or rows < best[0]:
+            best = (rows, reader)
+    if best is None:
+        return None
+    return best[1].read_all().to_pandas()
+
+
+def invalidate(dataset_id: int):
+    shutil.rmtree(_dataset_dir(dataset_id), ignore_errors=True)
@@ -0,0 +1,479 @@
+# dataset_loader.py
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import dtypes
+import snapshots
+import storage
+
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# first ranged GET when probing a CSV header; doubled until a full header line fits
+SCHEMA_PROBE_BYTES = int(os.getenv("SCHEMA_PROBE_BYTES", str(64 * 1024)))
+SCHEMA_PROBE_ROWS = 200
+# bytes of CSV parsed per streamed batch at ingestion; bounds the memory an upload needs
+CSV_BLOCK_BYTES = int(os.getenv("CSV_BLOCK_BYTES", str(8 * 1024 * 1024)))
+# pandas' default NA markers, so streamed and pandas-parsed CSVs agree on nulls
+CSV_NULL_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                   "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+
+# LRU cache of parsed DataFrames, bounded by their deep memory usage in bytes
+# rather than by entry count. Cached frames are shared between requests, so
+# callers must not mutate them in place.
+class DataFrameCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple) -> Optional[pd.DataFrame]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Tuple, df: pd.DataFrame):
+        size = int(df.memory_usage(deep=True, index=True).sum())
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+            # a frame larger than the whole budget would just flush everything else
+            if size > self.max_bytes:
+                return
+            self._items[key] = (df, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    # membership without touching recency or the hit/miss counters
+    def __contains__(self, key: Tuple) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+cache = DataFrameCache(DATASET_CACHE_MAX_BYTES)
+
+
+# With `columns`, only those columns are parsed (names the file lacks are ignored)
+def read_dataframe(raw: bytes, key: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    usecols = None if columns is None else _wanted(columns)
+    if key.endswith(".csv"):
+        try:
+            return pd.read_csv(BytesIO(raw), encoding="utf-8", usecols=usecols)
+        except UnicodeDecodeError:
+            return pd.read_csv(BytesIO(raw), encoding="latin1", usecols=usecols)
+    elif key.endswith((".xlsx", ".xls")):
+        return pd.read_excel(BytesIO(raw), usecols=usecols)
+    elif key.endswith(".parquet"):
+        if columns is None:
+            return pd.read_parquet(BytesIO(raw))
+        names = pq.read_schema(BytesIO(raw)).names
+        return pd.read_parquet(BytesIO(raw), columns=[c for c in names if usecols(c)])
+    raise ValueError(f"Unsupported file type: {key}")
+
+
+# ETag changes whenever the object is rewritten; LastModified is the fallback
+# for stores that don't return one.
+def object_version(client, bucket: str, key: str) -> str:
+    return _version(client.head_object(Bucket=bucket, Key=key))
+
+
+def _version(head: Dict[str, Any]) -> str:
+    etag = (head.get("ETag") or "").strip('"')
+    if etag:
+        return etag
+    return str(head.get("LastModified", ""))
+
+
+def _wanted(columns: List[str]):
+    wanted = {str(c) for c in columns}
+    return lambda c: str(c) in wanted
+
+
+def _project(df: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+    if columns is None:
+        return df
+    wanted = _wanted(columns)
+    return df[[c for c in df.columns if wanted(c)]]
+
+
+# Lookup order: in-process cache, local Arrow snapshot, then download + parse
+# (which also writes the snapshot for the next reader).
+# With `columns`, only those columns are read: a cached full frame is projected,
+# otherwise the snapshot or file is read for just those columns and cached as such.
+# With `dtype_plan` (see dtypes.py) the frame comes back with the planned dtypes; frames
+# are cached per plan.
+def load_dataset(client, bucket: str, key: str, columns: Optional[List[str]] = None,
+                 dtype_plan: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    head = client.head_object(Bucket=bucket, Key=key)
+    version = _version(head)
+    cache_key = (bucket, key, version, dtypes.plan_tag(dtype_plan))
+    if columns is not None:
+        if cache_key in cache:
+            return _project(cache.get(cache_key), columns)
+        return _load_columns(client, bucket, key, head, version, columns, dtype_plan)
+    df = cache.get(cache_key)
+    if df is not None:
+        return df
+    df = snapshots.read_snapshot(bucket, key, version)
+    if df is None:
+        df = dtypes.apply_plan(read_dataframe(storage.download(client, bucket, key, head.get("ContentLength")), key),
+                               dtype_plan)
+        snapshots.write_snapshot(bucket, key, version, df)
+    else:
+        # no-op when the snapshot was written with this plan
+        df = dtypes.apply_plan(df, dtype_plan)
+    cache.put(cache_key, df)
+    return df
+
+
+def _load_columns(client, bucket: str, key: str, head: Dict[str, Any], version: str, columns: List[str],
+                  dtype_plan: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    cache_key = (bucket, key, version, dtypes.plan_tag(dtype_plan), tuple(sorted(str(c) for c in columns)))
+    df = cache.get(cache_key)
+    if df is not None:
+        return df
+    df = snapshots.read_snapshot(bucket, key, version, columns)
+    if df is None:
+        if key.endswith(".parquet"):
+            # only the footer and the wanted column chunks are fetched
+            with io.BufferedReader(S3RangeFile(client, bucket, key, head["ContentLength"]),
+                                   buffer_size=SCHEMA_PROBE_BYTES) as source:
+                pf = pq.ParquetFile(source)
+                wanted = _wanted(columns)
+                df = pf.read(columns=[c for c in pf.schema_arrow.names if wanted(c)]).to_pandas()
+        else:
+            df = read_dataframe(storage.download(client, bucket, key, head.get("ContentLength")), key, columns)
+    df = dtypes.apply_plan(df, dtype_plan)
+    cache.put(cache_key, df)
+    return df
+
+
+# Parse the file once, profile its columns and rewrite the snapshot and cache entry with
+# the resulting dtype plan. Returns (frame with the plan applied, plan).
+def profile_dataset(client, bucket: str, key: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    head = client.head_object(Bucket=bucket, Key=key)
+    version = _version(head)
+    df = cache.get((bucket, key, version, ""))
+    if df is None:
+        df = snapshots.read_snapshot(bucket, key, version)
+    if df is None:
+        df = read_dataframe(storage.download(client, bucket, key, head.get("ContentLength")), key)
+    plan = dtypes.profile(df)
+    df = dtypes.apply_plan(df, plan)
+    snapshots.write_snapshot(bucket, key, version, df)
+    cache.put((bucket, key, version, dtypes.plan_tag(plan)), df)
+    return df, plan
+
+
+# Stream a new file once: row/column counts, the dtype plan and the Arrow snapshot are
+# built batch by batch, so memory stays bounded by the batch size rather than the file.
+# CSV is parsed from the GET body as it arrives and Parquet row group by row group; an
+# existing snapshot is profiled from its memory map. Excel has no streaming reader and
+# is parsed whole. `progress`, if given, is called with the fraction done after each batch.
+def ingest_dataset(client, bucket: str, key: str, progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    progress = progress or (lambda fraction: None)
+    head = client.head_object(Bucket=bucket, Key=key)
+    version = _version(head)
+    table = snapshots.open_snapshot(bucket, key, version)
+    if table is not None:
+        profiler = dtypes.StreamProfiler(table.schema)
+        batches = table.to_batches()
+        for i, batch in enumerate(batches):
+            profiler.update(batch)
+            progress((i + 1) / len(batches))
+    elif key.endswith(".csv"):
+        profiler = _ingest_csv(client, bucket, key, version, head["ContentLength"], progress)
+    elif key.endswith(".parquet"):
+        profiler = _ingest_parquet(client, bucket, key, version, head["ContentLength"], progress)
+    elif key.endswith((".xlsx", ".xls")):
+        df, plan = profile_dataset(client, bucket, key)
+        return {"num_rows": len(df), "num_columns": len(df.columns),
+                "column_schema": _schema_from_frame(df), "dtype_plan": plan}
+    else:
+        raise ValueError(f"Unsupported file type: {key}")
+    plan = profiler.plan()
+    return {"num_rows": profiler.rows, "num_columns": len(profiler.schema),
+            "column_schema": dtypes.planned_schema(plan), "dtype_plan": plan}
+
+
+def _ingest_parquet(client, bucket: str, key: str, version: str, size: int,
+                    progress: Callable[[float], None]) -> "dtypes.StreamProfiler":
+    with io.BufferedReader(S3RangeFile(client, bucket, key, size), buffer_size=CSV_BLOCK_BYTES) as source:
+        pf = pq.ParquetFile(source)
+        schema = pf.schema_arrow
+        # the pandas metadata stays on the snapshot so stored indexes read back as indexes
+        index_columns = {c for c in (schema.pandas_metadata or {}).get("index_columns", []) if isinstance(c, str)}
+        profiler = dtypes.StreamProfiler(pa.schema([f for f in schema if f.name not in index_columns]))
+        writer = snapshots.SnapshotWriter(bucket, key, version, schema)
+        try:
+            for batch in pf.iter_batches():
+                batch = pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+                profiler.update(batch)
+                writer.write(batch)
+                progress(profiler.rows / max(pf.metadata.num_rows, 1))
+        except Exception:
+            writer.abort()
+            raise
+        writer.commit()
+    return profiler
+
+
+# Types are inferred from the first block only. Date columns are kept as text (the
+# profiler decides whether they parse, as for pandas-read files); a later block that
+# doesn't fit its column's type restarts the stream with that column widened
+# (null -> int64 -> float64 -> string), and undecodable UTF-8 restarts it as latin1.
+_WIDER = {"null": pa.int64(), "int64": pa.float64()}
+_CONVERSION_ERROR = re.compile(r"CSV column #(\d+).*conversion error to (\w+)")
+
+
+def _ingest_csv(client, bucket: str, key: str, version: str, size: int,
+                progress: Callable[[float], None]) -> "dtypes.StreamProfiler":
+    column_types: Dict[str, pa.DataType] = {}
+    encoding = "utf8"
+    while True:
+        body = client.get_object(Bucket=bucket, Key=key)["Body"]
+        stream = _StreamFile(body)
+        writer = None
+        names: List[str] = []
+        try:
+            reader = pacsv.open_csv(
+                stream,
+                read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES, encoding=encoding),
+                convert_options=pacsv.ConvertOptions(column_types=column_types, null_values=CSV_NULL_VALUES,
+                                                     strings_can_be_null=True),
+            )
+            names = reader.schema.names
+            if encoding == "utf8" and any(pa.types.is_binary(f.type) for f in reader.schema):
+                encoding = "latin1"
+                continue
+            temporal = {f.name: pa.string() for f in reader.schema if pa.types.is_temporal(f.type)}
+            if temporal:
+                column_types.update(temporal)
+                continue
+            profiler = dtypes.StreamProfiler(reader.schema)
+            writer = snapshots.SnapshotWriter(bucket, key, version, reader.schema)
+            for batch in reader:
+                profiler.update(batch)
+                writer.write(batch)
+                # the reader runs ahead of the batches handed out; close enough for a progress bar
+                progress(min(stream.bytes_read / max(size, 1), 1.0))
+            writer.commit()
+            return profiler
+        except pa.ArrowInvalid as e:
+            if writer is not None:
+                writer.abort()
+            message = str(e)
+            match = _CONVERSION_ERROR.search(message)
+            if encoding == "utf8" and "UTF8" in message:
+                encoding = "latin1"
+            elif match and names and match.group(2) != "string":
+                column_types[names[int(match.group(1))]] = _WIDER.get(match.group(2), pa.string())
+            else:
+                raise ValueError(f"Could not parse {key}: {message}")
+        finally:
+            body.close()
+
+
+# Read-only file object over a streaming GET body
+class _StreamFile(io.RawIOBase):
+    def __init__(self, body):
+        self.body = body
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self.body.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.bytes_read += n
+        return n
+
+
+# Memory-mapped Arrow view of the dataset; slicing it only touches the pages read.
+# None when the dataset can't be snapshotted (mixed-type columns).
+def load_table(client, bucket: str, key: str) -> Optional[pa.Table]:
+    version = object_version(client, bucket, key)
+    table = snapshots.open_snapshot(bucket, key, version)
+    if table is None:
+        df = load_dataset(client, bucket, key)
+        table = snapshots.open_snapshot(bucket, key, version)
+        # the frame came from the in-process cache after the snapshot was removed
+        if table is None and snapshots.write_snapshot(bucket, key, version, df):
+            table = snapshots.open_snapshot(bucket, key, version)
+    return table
+
+
+# Arrow table of a frame that can't be snapshotted: mixed-type object columns (Excel) as text
+def _text_table(df: pd.DataFrame) -> pa.Table:
+    mixed = {c: df[c].map(lambda v: None if pd.isna(v) else str(v)) for c in df.columns if df[c].dtype == object}
+    return pa.Table.from_pandas(df.assign(**mixed), preserve_index=False)
+
+
+# The object's snapshot, written by a streaming ingestion pass if there is none yet, so
+# callers can walk every row batch by batch at bounded memory. Files that can't have one
+# come back as an in-memory table of the parsed frame.
+def snapshot_table(client, bucket: str, key: str) -> pa.Table:
+    version = object_version(client, bucket, key)
+    table = snapshots.open_snapshot(bucket, key, version)
+    if table is None:
+        ingest_dataset(client, bucket, key)
+        table = load_table(client, bucket, key)
+    if table is None:
+        table = _text_table(load_dataset(client, bucket, key))
+    return table
+
+
+# Rows of the Parquet row groups picked by select_row_groups(file metadata), e.g. those
+# whose statistics can match a filter; only the footer and those groups are fetched.
+# Already materialized datasets and other formats go through load_dataset.
+def load_dataset_pruned(client, bucket: str, key: str, select_row_groups, columns: Optional[List[str]] = None,
+                        dtype_plan: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    if not key.endswith(".parquet"):
+        return load_dataset(client, bucket, key, columns, dtype_plan)
+    head = client.head_object(Bucket=bucket, Key=key)
+    version = _version(head)
+    if (bucket, key, version, dtypes.plan_tag(dtype_plan)) in cache or \
+            snapshots.open_snapshot(bucket, key, version) is not None:
+        return load_dataset(client, bucket, key, columns, dtype_plan)
+    source = io.BufferedReader(S3RangeFile(client, bucket, key, head["ContentLength"]), buffer_size=SCHEMA_PROBE_BYTES)
+    with source:
+        pf = pq.ParquetFile(source)
+        groups = select_row_groups(pf.metadata)
+        if len(groups) < pf.metadata.num_row_groups:
+            names = pf.schema_arrow.names
+            if columns is not None:
+                wanted = _wanted(columns)
+                names = [c for c in names if wanted(c)]
+            if not groups:
+                return dtypes.apply_plan(pf.schema_arrow.empty_table().select(names).to_pandas(), dtype_plan)
+            return dtypes.apply_plan(pf.read_row_groups(groups, columns=names).to_pandas(), dtype_plan)
+    # nothing to skip: read it whole so it gets cached and snapshotted
+    return load_dataset(client, bucket, key, columns, dtype_plan)
+
+
+# Read-only, seekable file object over an S3 object where every read is a ranged GET.
+# Wrap it in io.BufferedReader to coalesce small reads.
+class S3RangeFile(io.RawIOBase):
+    def __init__(self, client, bucket: str, key: str, size: Optional[int] = None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        if size is None:
+            size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.size = size
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self.pos = max(0, self.pos)
+        return self.pos
+
+    def read_range(self, start: int, end: int) -> bytes:
+        # end is exclusive
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        obj = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}")
+        return obj["Body"].read()
+
+    def readinto(self, b) -> int:
+        data = self.read_range(self.pos, self.pos + len(b))
+        n = len(data)
+        b[:n] = data
+        self.pos += n
+        return n
+
+
+def _schema_from_frame(df: pd.DataFrame) -> List[Dict[str, str]]:
+    return [{"name": str(col), "dtype": str(dtype)} for col, dtype in df.dtypes.items()]
+
+
+def _probe_csv(client, bucket: str, key: str) -> List[Dict[str, str]]:
+    f = S3RangeFile(client, bucket, key)
+    size = SCHEMA_PROBE_BYTES
+    while True:
+        head = f.read_range(0, size)
+        complete = size >= f.size
+        if not complete:
+            # drop the trailing partial line so the sample parses cleanly
+            cut = head.rfind(b"\n")
+            if cut == -1:
+                size *= 2
+                continue
+            head = head[:cut + 1]
+        try:
+            sample = pd.read_csv(BytesIO(head), nrows=SCHEMA_PROBE_ROWS, encoding="utf-8")
+        except UnicodeDecodeError:
+            sample = pd.read_csv(BytesIO(head), nrows=SCHEMA_PROBE_ROWS, encoding="latin1")
+        return _schema_from_frame(sample)
+
+
+# Column names + dtypes without downloading the data: a ranged GET of the first few KB
+# for CSV, the footer only for Parquet. Excel has no such layout and falls back to a load.
+def probe_schema(client, bucket: str, key: str) -> List[Dict[str, str]]:
+    if key.endswith(".csv"):
+        return _probe_csv(client, bucket, key)
+    elif key.endswith(".parquet"):
+        with io.BufferedReader(S3RangeFile(client, bucket, key), buffer_size=SCHEMA_PROBE_BYTES) as f:
+            schema = pq.read_schema(f)
+        return _schema_from_frame(schema.empty_table().to_pandas())
+    elif key.endswith((".xlsx", ".xls")):
+        return _schema_from_frame(load_dataset(client, bucket, key))
+    raise ValueError(f"Unsupported file type: {key}")
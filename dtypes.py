@@ -0,0 +1,213 @@
+# dtypes.py
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas.tseries.api import guess_datetime_format
+
+# A dtype plan is profiled once per dataset file and applied on every read:
+#   {column: {"dtype": "category", "cardinality": n}
+#            {"dtype": "datetime", "format": "%Y-%m-%d", "cardinality": n}
+#            {"dtype": "int16", "min": lo, "max": hi}
+#            {"dtype": "<unchanged dtype>", ...}}
+# Text columns with few distinct values become categories (grouped on integer codes),
+# text columns whose every value parses with one date format become datetimes, and
+# integer columns (or float columns holding only whole numbers and no nulls) are
+# narrowed to the smallest integer type that holds their range. Floats are left at
+# float64: float32 would round sums of large values.
+CATEGORY_MAX_RATIO = float(os.getenv("DTYPE_CATEGORY_MAX_RATIO", "0.5"))
+# distinct values tracked per text column while streaming; past this it stays text
+PROFILE_MAX_DISTINCT = int(os.getenv("DTYPE_PROFILE_MAX_DISTINCT", "100000"))
+INTEGER_TYPES = (np.int8, np.int16, np.int32)
+
+
+def _integer_type(lo, hi) -> Optional[str]:
+    for t in INTEGER_TYPES:
+        info = np.iinfo(t)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(t).name
+    return None
+
+
+def _guess_date_format(value: str) -> Optional[str]:
+    fmt = guess_datetime_format(value)
+    # a year and a month at least, so "Jan" or "2024" labels stay text
+    if fmt is None or not any(d in fmt for d in ("%Y", "%y")) or not any(d in fmt for d in ("%m", "%b", "%B")):
+        return None
+    return fmt
+
+
+def _parses(values, fmt: str) -> bool:
+    try:
+        parsed = pd.to_datetime(pd.Series(values, dtype=object), format=fmt, errors="coerce")
+    except (ValueError, TypeError):
+        # e.g. mixed UTC offsets
+        return False
+    return bool(parsed.notna().all())
+
+
+def _date_format(values: np.ndarray) -> Optional[str]:
+    fmt = _guess_date_format(values[0])
+    return fmt if fmt and _parses(values, fmt) else None
+
+
+def _profile_column(series: pd.Series) -> Dict[str, Any]:
+    dtype = series.dtype
+    entry: Dict[str, Any] = {"dtype": str(dtype)}
+    if pd.api.types.is_bool_dtype(dtype) or not isinstance(dtype, np.dtype):
+        return entry
+    non_null = series.dropna()
+    if dtype.kind in "iuf" and len(non_null):
+        lo, hi = non_null.min(), non_null.max()
+        entry.update(min=lo.item(), max=hi.item())
+        if dtype.kind == "f" and (len(non_null) < len(series) or not (non_null == np.floor(non_null)).all()):
+            return entry
+        narrow = _integer_type(lo, hi)
+        if narrow and narrow != str(dtype):
+            entry["dtype"] = narrow
+    elif dtype == object and len(non_null):
+        uniques = non_null.unique()
+        entry["cardinality"] = len(uniques)
+        if not all(isinstance(v, str) for v in uniques):
+            # mixed types (common in Excel sheets) stay as parsed
+            return entry
+        fmt = _date_format(uniques)
+        if fmt:
+            entry.update(dtype="datetime", format=fmt)
+        elif len(uniques) <= CATEGORY_MAX_RATIO * len(non_null):
+            entry["dtype"] = "category"
+    return entry
+
+
+def profile(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    return {str(col): _profile_column(df[col]) for col in df.columns}
+
+
+# Builds the same plan as profile() from record batches as they stream in, keeping only
+# running min/max, null counts and (bounded) distinct text values per column.
+class StreamProfiler:
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema.remove_metadata()
+        self.rows = 0
+        self._stats = {
+            field.name: {"nulls": 0, "min": None, "max": None, "whole": True, "distinct": set(), "format": None}
+            for field in schema
+        }
+
+    def update(self, batch: pa.RecordBatch):
+        self.rows += batch.num_rows
+        for field, array in zip(batch.schema, batch.columns):
+            stats = self._stats.get(field.name)
+            if stats is None:
+                continue
+            stats["nulls"] += array.null_count
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                bounds = pc.min_max(array)
+                lo, hi = bounds["min"].as_py(), bounds["max"].as_py()
+                if lo is None:
+                    continue
+                stats["min"] = lo if stats["min"] is None else min(stats["min"], lo)
+                stats["max"] = hi if stats["max"] is None else max(stats["max"], hi)
+                if pa.types.is_floating(field.type) and stats["whole"]:
+                    stats["whole"] = pc.all(pc.equal(array, pc.floor(array))).as_py() is not False
+            elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                uniques = pc.unique(array.drop_null()).to_pylist()
+                if not uniques:
+                    continue
+                if stats["distinct"] is not None:
+                    stats["distinct"].update(uniques)
+                    if len(stats["distinct"]) > PROFILE_MAX_DISTINCT:
+                        stats["distinct"] = None
+                if stats["format"] is None:
+                    stats["format"] = _guess_date_format(uniques[0]) or False
+                if stats["format"] and not _parses(uniques, stats["format"]):
+                    stats["format"] = False
+
+    def plan(self) -> Dict[str, Dict[str, Any]]:
+        base = self.schema.empty_table().to_pandas().dtypes
+        plan = {}
+        for field in self.schema:
+            stats = self._stats[field.name]
+            non_null = self.rows - stats["nulls"]
+            entry: Dict[str, Any] = {"dtype": str(base[field.name])}
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                if stats["min"] is not None:
+                    entry.update(min=stats["min"], max=stats["max"])
+                if stats["nulls"]:
+                    # nullable integers are read as float64, which stays as is
+                    entry["dtype"] = "float64"
+                elif stats["min"] is not None and stats["whole"]:
+                    narrow = _integer_type(stats["min"], stats["max"])
+                    if narrow and narrow != entry["dtype"]:
+                        entry["dtype"] = narrow
+            elif pa.types.is_boolean(field.type):
+                if stats["nulls"]:
+                    entry["dtype"] = "object"
+            elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                distinct = stats["distinct"]
+                if distinct is not None and non_null:
+                    entry["cardinality"] = len(distinct)
+                if stats["format"]:
+                    entry.update(dtype="datetime", format=stats["format"])
+                elif distinct is not None and non_null and len(distinct) <= CATEGORY_MAX_RATIO * non_null:
+                    entry["dtype"] = "category"
+            plan[field.name] = entry
+        return plan
+
+
+# pandas dtype of every column once the plan is applied
+def planned_schema(plan: Dict[str, Dict[str, Any]]) -> List[Dict[str, str]]:
+    return [{"name": name, "dtype": "datetime64[ns]" if e["dtype"] == "datetime" else e["dtype"]}
+            for name, e in plan.items()]
+
+
+# None when the column already has (or can't take) the planned dtype
+def _convert(series: pd.Series, entry: Dict[str, Any]) -> Optional[pd.Series]:
+    target = entry.get("dtype")
+    if target == "datetime":
+        if pd.api.types.is_datetime64_any_dtype(series) or series.dtype != object:
+            return None
+        return pd.to_datetime(series, format=entry.get("format"), errors="coerce")
+    if target is None or str(series.dtype) == target:
+        return None
+    if target == "category" and series.dtype == object:
+        return series.astype("category")
+    if target in ("int8", "int16", "int32") and series.dtype.kind in "iuf":
+        try:
+            return series.astype(target)
+        except (ValueError, TypeError):
+            # nulls where the profile saw none
+            return None
+    return None
+
+
+# Frame with the plan's dtypes; columns the plan doesn't know (or already has right) are
+# passed through untouched. The input frame is not modified.
+def apply_plan(df: pd.DataFrame, plan: Optional[Dict[str, Dict[str, Any]]]) -> pd.DataFrame:
+    if not plan:
+        return df
+    converted = {}
+    for col in df.columns:
+        entry = plan.get(str(col))
+        series = _convert(df[col], entry) if entry else None
+        if series is not None:
+            converted[col] = series
+    if not converted:
+        return df
+    out = df.copy(deep=False)
+    for col, series in converted.items():
+        out[col] = series
+    return out
+
+
+# Short stable tag of a plan, for cache keys and signatures
+def plan_tag(plan: Optional[Dict[str, Dict[str, Any]]]) -> str:
+    if not plan:
+        return ""
+    payload = json.dumps({c: e.get("dtype") for c, e in plan.items()}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,118 @@
+# exports.py
+import csv
+import io
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import dtypes
+import filters
+import snapshots
+
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+# Exports walk the dataset's snapshot one record batch at a time and hand each encoded
+# chunk to the response as soon as it is written, so memory stays bounded by the batch
+# size however large the dataset is. Filters are evaluated on the batch with the dtype
+# plan applied (as previews see the data); the rows go out as stored.
+
+
+class _Chunks(io.RawIOBase):
+    # write-only sink whose buffered bytes are taken after every batch
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+
+# The dataset's own columns: index columns pandas stored alongside Parquet data are dropped
+def _data_table(table: pa.Table) -> pa.Table:
+    # a RangeIndex is described by a dict, not stored as a column
+    index = {c for c in (table.schema.pandas_metadata or {}).get("index_columns", []) if isinstance(c, str)}
+    return table.select([name for name in table.column_names if name not in index]).replace_schema_metadata(None)
+
+
+def _mask(batch, preds: List[filters.Predicate], dtype_plan: Optional[Dict[str, Any]]) -> pa.Array:
+    needed = list(dict.fromkeys(p.column for p in preds))
+    frame = dtypes.apply_plan(batch.select(needed).to_pandas(), dtype_plan)
+    return pa.array(np.asarray(filters.filter_mask(frame, preds), dtype=bool))
+
+
+def _batches(table: pa.Table, preds: List[filters.Predicate],
+             dtype_plan: Optional[Dict[str, Any]]) -> Iterator[pa.RecordBatch]:
+    for batch in table.to_batches(max_chunksize=snapshots.SNAPSHOT_BATCH_ROWS):
+        if preds:
+            batch = batch.filter(_mask(batch, preds, dtype_plan))
+        if batch.num_rows:
+            yield batch
+
+
+# Timestamps go out the way they were written when the dtype plan parsed them from text
+def _csv_batch(batch: pa.RecordBatch, dtype_plan: Optional[Dict[str, Any]]) -> pa.RecordBatch:
+    arrays = []
+    for field, array in zip(batch.schema, batch.columns):
+        if pa.types.is_timestamp(field.type):
+            fmt = (dtype_plan or {}).get(field.name, {}).get("format") or "%Y-%m-%d %H:%M:%S"
+            array = pc.strftime(array, format=fmt)
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def _csv(schema: pa.Schema, batches: Iterator[pa.RecordBatch],
+         dtype_plan: Optional[Dict[str, Any]]) -> Iterator[bytes]:
+    # header as pandas writes it (Arrow quotes every name)
+    header = io.StringIO()
+    csv.writer(header, lineterminator="\n").writerow(schema.names)
+    yield header.getvalue().encode("utf-8")
+    sink = _Chunks()
+    options = pacsv.WriteOptions(include_header=False, quoting_style="needed")
+    writer = None
+    for batch in batches:
+        batch = _csv_batch(batch, dtype_plan)
+        if writer is None:
+            writer = pacsv.CSVWriter(sink, batch.schema, write_options=options)
+        writer.write_batch(batch)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+
+def _parquet(schema: pa.Schema, batches: Iterator[pa.RecordBatch]) -> Iterator[bytes]:
+    sink = _Chunks()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.take()
+    # footer
+    yield sink.take()
+
+
+def stream(table: pa.Table, fmt: str, saved_filter: Any = None,
+           dtype_plan: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    table = _data_table(table)
+    preds = [p for p in filters.compile_filter(saved_filter) if p.column in table.column_names]
+    # once streaming starts the status is sent, so the filter is tried on the first batch
+    # here: a malformed filter or a value the column can't be compared with raises now
+    if preds:
+        _mask(table.slice(0, snapshots.SNAPSHOT_BATCH_ROWS), preds, dtype_plan)
+    batches = _batches(table, preds, dtype_plan)
+    if fmt == "csv":
+        return _csv(table.schema, batches, dtype_plan)
+    return _parquet(table.schema, batches)
@@ -0,0 +1,265 @@
+# filters.py
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Saved filters are either a list of columns (kept first, in that order) or a dict
+# column -> condition. A condition is a list of allowed values (as before) or a dict of
+# operators, all of which must hold:
+#   {"in": [..]}, {"not_in": [..]}, {"eq": v}, {"ne": v},
+#   {"gt": v}, {"gte": v}, {"lt": v}, {"lte": v}, {"between": [lo, hi]},
+#   {"null": true|false}, {"prefix": s}, {"suffix": s}, {"contains": s}
+# plus the modifiers "as": "date"|"number" (compare as that type) and "ignore_case".
+OPERATORS = ("in", "not_in", "eq", "ne", "gt", "gte", "lt", "lte", "between", "null",
+             "prefix", "suffix", "contains")
+MODIFIERS = ("as", "ignore_case")
+# highest code point: every string starting with p sorts before p + _MAX_CHAR
+_MAX_CHAR = "\U0010ffff"
+
+
+class FilterError(ValueError):
+    pass
+
+
+class Predicate:
+    def __init__(self, column: str, op: str, value: Any, as_type: Optional[str] = None, ignore_case: bool = False):
+        self.column = column
+        self.op = op
+        self.value = value
+        self.as_type = as_type
+        self.ignore_case = ignore_case
+
+    def __repr__(self):
+        return f"Predicate({self.column!r}, {self.op!r}, {self.value!r})"
+
+    def _coerce(self, series: pd.Series) -> Tuple[pd.Series, Any]:
+        value = self.value
+        if self.as_type == "date" or pd.api.types.is_datetime64_any_dtype(series):
+            series = pd.to_datetime(series, errors="coerce")
+            if isinstance(value, list):
+                return series, [pd.Timestamp(v) for v in value]
+            return series, pd.Timestamp(value)
+        if self.as_type == "number" or (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)):
+            series = pd.to_numeric(series, errors="coerce")
+            if isinstance(value, list):
+                return series, [pd.to_numeric(v, errors="coerce") for v in value]
+            return series, pd.to_numeric(value, errors="coerce")
+        if isinstance(value, str) or (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            return series.astype("string"), value
+        return series, value
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        series = df[self.column]
+        op = self.op
+        if op == "null":
+            result = series.isna() if self.value else series.notna()
+        elif op in ("in", "not_in"):
+            # plain isin for untyped lists, exactly as the old list filters; date columns
+            # (parsed by the dataset's dtype plan) still match the values as written
+            if self.as_type or pd.api.types.is_datetime64_any_dtype(series):
+                try:
+                    series, values = self._coerce(series)
+                except ValueError as e:
+                    raise FilterError(f"Cannot compare column '{self.column}' with {self.value!r}: {e}")
+            else:
+                values = self.value
+            result = series.isin(values)
+            if op == "not_in":
+                result = ~result
+        elif op in ("prefix", "suffix", "contains"):
+            text = series.astype("string")
+            value = str(self.value)
+            if self.ignore_case:
+                text = text.str.lower()
+                value = value.lower()
+            if op == "prefix":
+                result = text.str.startswith(value)
+            elif op == "suffix":
+                result = text.str.endswith(value)
+            else:
+                result = text.str.contains(value, regex=False)
+        else:
+            try:
+                series, value = self._coerce(series)
+                if op == "eq":
+                    result = series == value
+                elif op == "ne":
+                    result = series != value
+                elif op == "gt":
+                    result = series > value
+                elif op == "gte":
+                    result = series >= value
+                elif op == "lt":
+                    result = series < value
+                else:
+                    result = series <= value
+            except (TypeError, ValueError) as e:
+                raise FilterError(f"Cannot compare column '{self.column}' with {self.value!r}: {e}")
+        return pd.Series(result, index=df.index).fillna(False).to_numpy(dtype=bool)
+
+    # Whether a Parquet row group with these column statistics can hold a matching row
+    def may_match(self, minimum: Any, maximum: Any, null_count: Optional[int], num_values: int) -> bool:
+        if self.op == "null":
+            if null_count is None:
+                return True
+            return null_count > 0 if self.value else null_count < num_values
+        # "as" compares in another type than the stored one (numbers or dates kept as text)
+        if self.as_type:
+            return True
+        if minimum is None or maximum is None or self.op not in ("in", "eq", "gt", "gte", "lt", "lte", "prefix"):
+            return True
+        try:
+            if self.op == "prefix":
+                if self.ignore_case or not isinstance(minimum, str):
+                    return True
+                return maximum >= self.value and minimum < self.value + _MAX_CHAR
+            values = self.value if isinstance(self.value, list) else [self.value]
+            values = [_stat_value(v, minimum) for v in values]
+            if self.op in ("in", "eq"):
+                return any(minimum <= v <= maximum for v in values)
+            value = values[0]
+            if self.op == "gt":
+                return maximum > value
+            if self.op == "gte":
+                return maximum >= value
+            if self.op == "lt":
+                return minimum < value
+            return minimum <= value
+        except (TypeError, ValueError):
+            return True
+
+
+def _stat_value(value: Any, like: Any) -> Any:
+    # bring a filter value to the type of the row-group statistics
+    if isinstance(like, datetime):
+        ts = pd.Timestamp(value)
+        if like.tzinfo is None and ts.tzinfo is not None:
+            ts = ts.tz_convert(None)
+        return ts.to_pydatetime()
+    if isinstance(like, date):
+        return pd.Timestamp(value).date()
+    if isinstance(like, (int, float)) and not isinstance(like, bool) and isinstance(value, str):
+        return float(value)
+    return value
+
+
+# Values compared "as" a type must convert to it; caught when the filter is compiled
+def _check_typed(column: str, op: str, value: Any, as_type: Optional[str]):
+    if as_type is None or op in ("null", "prefix", "suffix", "contains"):
+        return
+    for v in value if isinstance(value, list) else [value]:
+        if v is None:
+            continue
+        try:
+            pd.Timestamp(v) if as_type == "date" else float(v)
+        except (TypeError, ValueError):
+            raise FilterError(f"'{op}' for column '{column}' needs {as_type} values, got {v!r}")
+
+
+def _condition(column: str, condition: Any) -> List[Predicate]:
+    if isinstance(condition, (list, tuple)):
+        return [Predicate(column, "in", list(condition))] if condition else []
+    if not isinstance(condition, dict):
+        raise FilterError(f"Unsupported filter for column '{column}': {condition!r}")
+    unknown = [k for k in condition if k not in OPERATORS and k not in MODIFIERS]
+    if unknown:
+        raise FilterError(f"Unsupported filter operator for column '{column}': {', '.join(unknown)}")
+    as_type = condition.get("as")
+    if as_type not in (None, "date", "number"):
+        raise FilterError(f"Unsupported filter type for column '{column}': {as_type}")
+    ignore_case = bool(condition.get("ignore_case", False))
+    preds = []
+    for op in OPERATORS:
+        if op not in condition:
+            continue
+        value = condition[op]
+        if op == "between":
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise FilterError(f"'between' for column '{column}' needs [low, high]")
+            low, high = value
+            if low is not None:
+                preds.append(Predicate(column, "gte", low, as_type, ignore_case))
+            if high is not None:
+                preds.append(Predicate(column, "lte", high, as_type, ignore_case))
+        elif op in ("in", "not_in"):
+            if not isinstance(value, (list, tuple)):
+                raise FilterError(f"'{op}' for column '{column}' needs a list")
+            if value:
+                preds.append(Predicate(column, op, list(value), as_type, ignore_case))
+        else:
+            preds.append(Predicate(column, op, value, as_type, ignore_case))
+    for pred in preds:
+        _check_typed(column, pred.op, pred.value, as_type)
+    return preds
+
+
+# Predicates of a saved filter (empty for column lists and empty conditions)
+def compile_filter(saved: Any) -> List[Predicate]:
+    if not isinstance(saved, dict):
+        return []
+    preds = []
+    for column, condition in saved.items():
+        preds.extend(_condition(column, condition))
+    return preds
+
+
+# One boolean mask for all predicates, then a single take
+def filter_mask(df: pd.DataFrame, preds: List[Predicate]) -> np.ndarray:
+    mask = np.ones(len(df), dtype=bool)
+    for pred in preds:
+        mask &= pred.mask(df)
+    return mask
+
+
+# Row groups of a Parquet file that can hold matching rows, from the column statistics.
+# Columns the dtype plan parses into dates are compared as dates, not as the stored text,
+# so their statistics say nothing.
+def prune_row_groups(metadata, preds: List[Predicate], dtype_plan: Optional[Dict[str, Any]] = None) -> List[int]:
+    names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    retyped = {c for c, entry in (dtype_plan or {}).items() if entry.get("dtype") == "datetime"}
+    pushable = [(p, names.index(p.column)) for p in preds if p.column in names and p.column not in retyped]
+    groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        keep = True
+        for pred, col in pushable:
+            stats = row_group.column(col).statistics
+            if stats is None:
+                continue
+            has_min_max = stats.has_min_max
+            null_count = stats.null_count if stats.has_null_count else None
+            if not pred.may_match(stats.min if has_min_max else None, stats.max if has_min_max else None,
+                                  null_count, row_group.num_rows):
+                keep = False
+                break
+        if keep:
+            groups.append(i)
+    return groups
+
+
+# Column lists reorder columns; condition dicts filter rows. Returns the frame and the
+# columns used.
+def apply_saved_filter(df: pd.DataFrame, saved: Any, rows: List[str], columns: List[str]) -> Tuple[pd.DataFrame, List[str]]:
+    filtered_columns = []
+    if saved:
+        # if saved is a list -> keep those columns
+        if isinstance(saved, list):
+            for col in saved:
+                if col in df.columns:
+                    filtered_columns.append(col)
+            # Keep columns: rows + cols + filtered_columns + rest
+            keep_cols = list(dict.fromkeys(rows + columns + filtered_columns))
+            # ensure existing columns are preserved
+            keep_cols = [c for c in keep_cols if c in df.columns]
+            df = df[keep_cols + [c for c in df.columns if c not in keep_cols]]
+        elif isinstance(saved, dict):
+            preds = [p for p in compile_filter(saved) if p.column in df.columns]
+            if preds:
+                df = df[filter_mask(df, preds)]
+                filtered_columns = list(dict.fromkeys(p.column for p in preds))
+        else:
+            # unsupported format -> ignore
+            pass
+    return df, filtered_columns
@@ -0,0 +1,502 @@
+# formula.py
+import ast
+import keyword
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Calculated-field formulas are parsed with Python's own grammar and compiled into a tree
+# of vectorized pandas/NumPy operations. Only the node types and functions below are
+# accepted, so there is no eval() and no access to attributes, builtins or imports.
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def _is_series(x) -> bool:
+    return isinstance(x, pd.Series)
+
+
+# Formulas see columns as the file has them, whatever the dtype plan (see dtypes.py) made of
+# them: `text_dates` maps the columns the plan parsed from text to their format
+def _column(frame: pd.DataFrame, name: str, text_dates: Dict[str, str]) -> pd.Series:
+    series = frame[name]
+    # integer columns may be stored narrowed; compute at full width so arithmetic can't wrap around
+    if series.dtype.kind in "iu" and series.dtype.itemsize < 8:
+        return series.astype("int64")
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+    if name in text_dates and pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime(text_dates[name])
+    return series
+
+
+def _where(cond, a, b):
+    if _is_series(cond):
+        cond = cond.fillna(False).astype(bool)
+        index = cond.index
+    else:
+        index = next((x.index for x in (a, b) if _is_series(x)), None)
+        if index is None:
+            return a if cond else b
+    return pd.Series(np.where(cond, a, b), index=index)
+
+
+def _and(a, b):
+    return np.logical_and(a, b) if _is_series(a) or _is_series(b) else (a and b)
+
+
+def _or(a, b):
+    return np.logical_or(a, b) if _is_series(a) or _is_series(b) else (a or b)
+
+
+def _not(a):
+    return np.logical_not(a) if _is_series(a) else (not a)
+
+
+def _isnull(x):
+    return x.isna() if _is_series(x) else pd.isna(x)
+
+
+def _notnull(x):
+    return x.notna() if _is_series(x) else not pd.isna(x)
+
+
+def _coalesce(*args):
+    result = args[0]
+    for other in args[1:]:
+        if _is_series(result):
+            result = result.fillna(other) if not _is_series(other) else result.combine_first(other)
+        elif pd.isna(result):
+            result = other
+    return result
+
+
+def _nullif(a, b):
+    if _is_series(a):
+        return a.mask(a == b)
+    return None if a == b else a
+
+
+def _str(x):
+    return x.astype("string").str if _is_series(x) else None
+
+
+def _string_fn(series_fn: Callable, scalar_fn: Callable) -> Callable:
+    def fn(x, *args):
+        accessor = _str(x)
+        if accessor is not None:
+            return series_fn(accessor, *args)
+        return None if pd.isna(x) else scalar_fn(str(x), *args)
+    return fn
+
+
+def _concat(*args):
+    result = ""
+    for a in args:
+        part = a.astype("string") if _is_series(a) else ("" if a is None else str(a))
+        result = result + part
+    return result
+
+
+def _substr(x, start, length=None):
+    start = int(start) - 1  # 1-based like SQL SUBSTR
+    stop = None if length is None else start + int(length)
+    accessor = _str(x)
+    if accessor is not None:
+        return accessor.slice(start, stop)
+    return None if pd.isna(x) else str(x)[start:stop]
+
+
+def _round(x, digits=0):
+    return x.round(int(digits)) if _is_series(x) else round(x, int(digits))
+
+
+def _to_number(x):
+    return pd.to_numeric(x, errors="coerce")
+
+
+def _to_date(x):
+    return pd.to_datetime(x, errors="coerce")
+
+
+def _date_part(attr: str) -> Callable:
+    def fn(x):
+        if _is_series(x):
+            return getattr(pd.to_datetime(x, errors="coerce").dt, attr)
+        return getattr(pd.Timestamp(x), attr)
+    return fn
+
+
+_strip = _string_fn(lambda s: s.strip(), str.strip)
+
+# name -> (implementation, min args, max args)
+FUNCTIONS: Dict[str, Tuple[Callable, int, int]] = {
+    "ifelse": (_where, 3, 3),
+    "where": (_where, 3, 3),
+    "isnull": (_isnull, 1, 1),
+    "isna": (_isnull, 1, 1),
+    "notnull": (_notnull, 1, 1),
+    "coalesce": (_coalesce, 2, 16),
+    "fillna": (_coalesce, 2, 2),
+    "nullif": (_nullif, 2, 2),
+    "abs": (np.abs, 1, 1),
+    "round": (_round, 1, 2),
+    "floor": (np.floor, 1, 1),
+    "ceil": (np.ceil, 1, 1),
+    "sqrt": (np.sqrt, 1, 1),
+    "log": (np.log, 1, 1),
+    "log10": (np.log10, 1, 1),
+    "exp": (np.exp, 1, 1),
+    "min": (np.fmin, 2, 2),
+    "max": (np.fmax, 2, 2),
+    "to_number": (_to_number, 1, 1),
+    "to_date": (_to_date, 1, 1),
+    "year": (_date_part("year"), 1, 1),
+    "month": (_date_part("month"), 1, 1),
+    "day": (_date_part("day"), 1, 1),
+    "upper": (_string_fn(lambda s: s.upper(), str.upper), 1, 1),
+    "lower": (_string_fn(lambda s: s.lower(), str.lower), 1, 1),
+    "strip": (_strip, 1, 1),
+    "trim": (_strip, 1, 1),
+    "len": (_string_fn(lambda s: s.len(), len), 1, 1),
+    "contains": (_string_fn(lambda s, p: s.contains(str(p), regex=False), lambda v, p: str(p) in v), 2, 2),
+    "startswith": (_string_fn(lambda s, p: s.startswith(str(p)), lambda v, p: v.startswith(str(p))), 2, 2),
+    "endswith": (_string_fn(lambda s, p: s.endswith(str(p)), lambda v, p: v.endswith(str(p))), 2, 2),
+    "replace": (_string_fn(lambda s, a, b: s.replace(str(a), str(b), regex=False),
+                           lambda v, a, b: v.replace(str(a), str(b))), 3, 3),
+    "substr": (_substr, 2, 3),
+    "concat": (_concat, 1, 32),
+}
+
+# aliases (ifelse/where, isnull/isna, ...) share one canonical name in memo keys
+_CANONICAL = {}
+for _name, (_impl, _, _) in FUNCTIONS.items():
+    _CANONICAL[_name] = next(n for n, (i, _, _) in FUNCTIONS.items() if i is _impl)
+
+# np.where(...) / np.log(...) etc. were valid under the old eval-based engine
+MODULE_ALIASES = {"np": {"where": "where", "log": "log", "log10": "log10", "sqrt": "sqrt", "exp": "exp",
+                         "abs": "abs", "round": "round", "floor": "floor", "ceil": "ceil",
+                         "isnan": "isnull", "fmin": "min", "fmax": "max"},
+                  "pd": {"isna": "isnull", "isnull": "isnull", "notna": "notnull", "notnull": "notnull",
+                         "to_numeric": "to_number", "to_datetime": "to_date"}}
+
+CONSTANTS = {"null": None, "NULL": None, "nan": np.nan, "NaN": np.nan, "true": True, "false": False}
+
+BINARY_OPS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+    ast.BitAnd: _and,
+    ast.BitOr: _or,
+}
+
+COMPARE_OPS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+    ast.In: lambda a, b: a.isin(b) if _is_series(a) else a in b,
+    ast.NotIn: lambda a, b: ~a.isin(b) if _is_series(a) else a not in b,
+}
+
+UNARY_OPS = {
+    ast.USub: lambda a: -a,
+    ast.UAdd: lambda a: a,
+    ast.Not: _not,
+    ast.Invert: _not,
+}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_STRING_LITERAL = re.compile(r"\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*'")
+
+
+# Evaluation state shared by every formula of one plan: the source frame, the calculated
+# fields evaluated so far, and a memo of subexpression results keyed by their canonical form.
+class _Scope:
+    def __init__(self, frame: pd.DataFrame, dtype_plan: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.frame = frame
+        self.text_dates = {c: e["format"] for c, e in (dtype_plan or {}).items()
+                           if e.get("dtype") == "datetime" and e.get("format")}
+        self.fields: Dict[str, pd.Series] = {}
+        self.memo: Dict[str, Any] = {}
+
+
+class CompiledFormula:
+    def __init__(self, formula: str, fn: Callable, columns: FrozenSet[str], fields: FrozenSet[str]):
+        self.formula = formula
+        # dataset columns and calculated fields the formula reads
+        self.columns = columns
+        self.fields = fields
+        self._fn = fn
+
+    def evaluate(self, df: pd.DataFrame, dtype_plan: Optional[Dict[str, Dict[str, Any]]] = None) -> pd.Series:
+        return self._evaluate(_Scope(df, dtype_plan))
+
+    def _evaluate(self, scope: _Scope) -> pd.Series:
+        try:
+            result = self._fn(scope)
+        except Exception as e:
+            raise FormulaError(f"Invalid formula: {self.formula} | Error: {e}")
+        if not _is_series(result):
+            result = pd.Series(result, index=scope.frame.index)
+        if result.dtype == object:
+            # keep the old behaviour of coercing to numeric where every value allows it
+            try:
+                result = pd.to_numeric(result)
+            except (ValueError, TypeError):
+                pass
+        return result
+
+
+@lru_cache(maxsize=64)
+def _quoting_pattern(names: Tuple[str, ...]):
+    # column names that aren't identifiers ("Sales Amount") may be written bare, as before,
+    # or in backticks; either way they are swapped for placeholders in a single pass
+    odd = sorted((n for n in names if not _IDENTIFIER.match(n) or keyword.iskeyword(n)), key=len, reverse=True)
+    alternatives = [r"`([^`]+)`"] + [rf"(?<![\w`]){re.escape(n)}(?![\w`])" for n in odd]
+    return re.compile("|".join(f"(?:{a})" for a in alternatives))
+
+
+def _substitute_columns(formula: str, names: Tuple[str, ...]) -> Tuple[str, Dict[str, str]]:
+    pattern = _quoting_pattern(names)
+    placeholders: Dict[str, str] = {}
+
+    def swap(match: re.Match) -> str:
+        name = match.group(1) if match.group(1) is not None else match.group(0)
+        placeholder = f"__col{len(placeholders)}"
+        placeholders[placeholder] = name
+        return placeholder
+
+    # leave string literals untouched
+    out, pos = [], 0
+    for lit in _STRING_LITERAL.finditer(formula):
+        out.append(pattern.sub(swap, formula[pos:lit.start()]))
+        out.append(lit.group(0))
+        pos = lit.end()
+    out.append(pattern.sub(swap, formula[pos:]))
+    return "".join(out), placeholders
+
+
+# Node types whose results are memoized per scope, so a subexpression shared by several
+# fields (or repeated inside one) is computed once
+_MEMOIZED = (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call)
+
+
+class _Compiler:
+    def __init__(self, names: FrozenSet[str], fields: FrozenSet[str], placeholders: Dict[str, str]):
+        self.names = names
+        self.field_names = fields
+        self.placeholders = placeholders
+        self.columns = set()
+        self.fields = set()
+
+    def compile(self, node: ast.AST) -> Callable:
+        method = getattr(self, f"visit_{type(node).__name__}", None)
+        if method is None:
+            raise FormulaError(f"Unsupported syntax: {type(node).__name__}")
+        fn = method(node)
+        if not isinstance(node, _MEMOIZED):
+            return fn
+        # children have already been rewritten to resolved names, so the dump is canonical
+        key = ast.dump(node)
+
+        def memoized(scope):
+            if key not in scope.memo:
+                scope.memo[key] = fn(scope)
+            return scope.memo[key]
+        return memoized
+
+    def visit_Expression(self, node):
+        return self.compile(node.body)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str, bool, type(None))):
+            raise FormulaError(f"Unsupported literal: {node.value!r}")
+        value = node.value
+        return lambda scope: value
+
+    def visit_Name(self, node):
+        name = self.placeholders.get(node.id, node.id)
+        if name in self.field_names:
+            self.fields.add(name)
+            node.id = f"field:{name}"
+            return lambda scope: scope.fields[name]
+        if name in self.names:
+            self.columns.add(name)
+            node.id = f"column:{name}"
+            return lambda scope: _column(scope.frame, name, scope.text_dates)
+        if name in CONSTANTS:
+            value = CONSTANTS[name]
+            return lambda scope: value
+        raise FormulaError(f"Unknown column '{name}'")
+
+    def visit_Tuple(self, node):
+        items = [self.compile(e) for e in node.elts]
+        return lambda scope: [item(scope) for item in items]
+
+    visit_List = visit_Tuple
+
+    def visit_BinOp(self, node):
+        op = BINARY_OPS.get(type(node.op))
+        if op is None:
+            raise FormulaError(f"Unsupported operator: {type(node.op).__name__}")
+        left, right = self.compile(node.left), self.compile(node.right)
+        return lambda scope: op(left(scope), right(scope))
+
+    def visit_UnaryOp(self, node):
+        op = UNARY_OPS.get(type(node.op))
+        if op is None:
+            raise FormulaError(f"Unsupported operator: {type(node.op).__name__}")
+        operand = self.compile(node.operand)
+        return lambda scope: op(operand(scope))
+
+    def visit_BoolOp(self, node):
+        combine = _and if isinstance(node.op, ast.And) else _or
+        values = [self.compile(v) for v in node.values]
+
+        def fn(scope):
+            result = values[0](scope)
+            for v in values[1:]:
+                result = combine(result, v(scope))
+            return result
+        return fn
+
+    def visit_Compare(self, node):
+        ops = []
+        for op in node.ops:
+            impl = COMPARE_OPS.get(type(op))
+            if impl is None:
+                raise FormulaError(f"Unsupported comparison: {type(op).__name__}")
+            ops.append(impl)
+        operands = [self.compile(node.left)] + [self.compile(c) for c in node.comparators]
+
+        def fn(scope):
+            values = [o(scope) for o in operands]
+            result = None
+            for i, op in enumerate(ops):
+                step = op(values[i], values[i + 1])
+                result = step if result is None else _and(result, step)
+            return result
+        return fn
+
+    def visit_IfExp(self, node):
+        cond, a, b = self.compile(node.test), self.compile(node.body), self.compile(node.orelse)
+        return lambda scope: _where(cond(scope), a(scope), b(scope))
+
+    def visit_Call(self, node):
+        if node.keywords:
+            raise FormulaError("Keyword arguments are not supported")
+        name = self._function_name(node.func)
+        impl, min_args, max_args = FUNCTIONS[name]
+        if not min_args <= len(node.args) <= max_args:
+            raise FormulaError(f"{name}() takes {min_args}-{max_args} arguments, got {len(node.args)}")
+        args = [self.compile(a) for a in node.args]
+        # normalise np.where(...) / ifelse(...) to one spelling for the memo key
+        node.func = ast.Name(id=_CANONICAL[name])
+        return lambda scope: impl(*[a(scope) for a in args])
+
+    def _function_name(self, func: ast.AST) -> str:
+        if isinstance(func, ast.Name) and func.id.lower() in FUNCTIONS:
+            return func.id.lower()
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            alias = MODULE_ALIASES.get(func.value.id, {}).get(func.attr)
+            if alias:
+                return alias
+        raise FormulaError(f"Unknown function: {ast.unparse(func)}")
+
+
+@lru_cache(maxsize=1024)
+def _compile(formula: str, names: Tuple[str, ...], fields: FrozenSet[str]) -> CompiledFormula:
+    source, placeholders = _substitute_columns(formula, names + tuple(sorted(fields)))
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"Invalid formula: {formula} | Error: {e.msg}")
+    compiler = _Compiler(frozenset(names), fields, placeholders)
+    fn = compiler.compile(tree)
+    return CompiledFormula(formula, fn, frozenset(compiler.columns), frozenset(compiler.fields))
+
+
+# Compiled once per (formula, schema); `columns` are the dataset columns the formula may
+# reference and `fields` the other calculated fields it may reference
+def compile_formula(formula: str, columns: Iterable[Any], fields: Iterable[str] = ()) -> CompiledFormula:
+    return _compile(formula, tuple(str(c) for c in columns), frozenset(fields))
+
+
+class FieldPlan:
+    def __init__(self, order: List[Tuple[str, CompiledFormula]]):
+        self.order = order
+
+    @property
+    def names(self) -> List[str]:
+        return [name for name, _ in self.order]
+
+    # dataset columns the planned fields read, directly or through other fields
+    @property
+    def source_columns(self) -> List[str]:
+        return list(dict.fromkeys(c for _, compiled in self.order for c in sorted(compiled.columns)))
+
+    # dataset columns needed to produce `requested` (dataset columns or planned fields)
+    def input_columns(self, requested: Iterable[str], columns: Iterable[Any]) -> List[str]:
+        planned = set(self.names)
+        available = {str(c) for c in columns}
+        direct = [c for c in requested if c not in planned and c in available]
+        return list(dict.fromkeys(direct + self.source_columns))
+
+    # Evaluate every planned field in dependency order, sharing one subexpression memo.
+    # `dtype_plan` is the plan `df` was loaded with.
+    def evaluate(self, df: pd.DataFrame, dtype_plan: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, pd.Series]:
+        scope = _Scope(df, dtype_plan)
+        for name, compiled in self.order:
+            try:
+                scope.fields[name] = compiled._evaluate(scope)
+            except FormulaError as e:
+                raise FormulaError(f"{name}: {e}")
+        return scope.fields
+
+
+# Build the evaluation order for an analysis's calculated fields. Fields may reference
+# dataset columns and each other regardless of creation order; a field that refers to its
+# own name reads the dataset column it shadows. Cycles raise FormulaError. With `required`,
+# only the fields it names and their transitive dependencies are planned.
+def plan_fields(fields: Dict[str, str], columns: Iterable[Any],
+                required: Optional[Iterable[str]] = None) -> FieldPlan:
+    columns = tuple(str(c) for c in columns)
+    compiled = {
+        name: compile_formula(text, columns, frozenset(fields) - {name})
+        for name, text in fields.items()
+    }
+    wanted = list(fields) if required is None else [n for n in required if n in fields]
+
+    order: List[Tuple[str, CompiledFormula]] = []
+    state: Dict[str, str] = {}
+    path: List[str] = []
+
+    def visit(name: str):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "active":
+            cycle = path[path.index(name):] + [name]
+            raise FormulaError(f"Circular reference between calculated fields: {' -> '.join(cycle)}")
+        state[name] = "active"
+        path.append(name)
+        for dep in sorted(compiled[name].fields):
+            visit(dep)
+        path.pop()
+        state[name] = "done"
+        order.append((name, compiled[name]))
+
+    for name in wanted:
+        visit(name)
+    return FieldPlan(order)
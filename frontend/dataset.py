@@ -1,51 +1,148 @@
 import dash
-from dash import html, dcc, Input, Output, State, ctx, no_update, dash_table
+from dash import html, dcc, Input, Output, State, ctx, no_update, dash_table, DiskcacheManager
+import diskcache
 import dash_bootstrap_components as dbc
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import plotly.express as px
 import plotly.io as pio
+import pyarrow as pa
 from datetime import datetime
 import json
-import base64
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future
 
 # ----------------- Config -----------------
 API_BASE = "http://127.0.0.1:8000"
+# rows per preview grid page; only one page is ever sent to the browser
+PREVIEW_PAGE_SIZE = 20
+# how often a running preview is polled for progress
+PREVIEW_POLL_SECONDS = 0.5
 pio.templates.default = "plotly_white"
 
 # ----------------- App init -----------------
+# background callbacks (long previews) run in separate processes, tracked in a disk cache
+background_callback_manager = DiskcacheManager(
+    diskcache.Cache(os.getenv("DASH_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dash-cache")))
+)
 app = dash.Dash(
     __name__,
     external_stylesheets=[dbc.themes.BOOTSTRAP],
-    suppress_callback_exceptions=True
+    suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager
 )
 server = app.server
 app.title = "Quick-ish Suite (Dash)"
 
 # ----------------- Helpers (API wrappers) -----------------
-def api_get(path, params=None, timeout=10):
+# One keep-alive session for every callback, so requests reuse pooled connections to the API
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "16"))
+# GET responses are reused for this long; a burst of callbacks asking for the same
+# resource (and concurrent identical GETs) costs one backend call
+API_CACHE_SECONDS = float(os.getenv("API_CACHE_SECONDS", "2"))
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+_get_lock = threading.Lock()
+_get_cache = {}     # (path, params) -> (expires_at, payload)
+_get_inflight = {}  # (path, params) -> Future of (payload, err)
+_get_generation = 0
+
+def _get_key(path, params):
+    return path, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in (params or {}).items()))
+
+# Writes drop every cached GET: a report or dataset change shows up in the next read
+def invalidate_api_cache():
+    global _get_generation
+    with _get_lock:
+        _get_cache.clear()
+        _get_generation += 1
+
+def _fetch(path, params, timeout):
+    try:
+        r = session.get(f"{API_BASE}{path}", params=params, timeout=timeout)
+        r.raise_for_status()
+        return r.json(), None
+    except Exception as e:
+        return None, str(e)
+
+def api_get(path, params=None, timeout=10, cache=True):
+    if not cache:
+        return _fetch(path, params, timeout)
+    key = _get_key(path, params)
+    with _get_lock:
+        hit = _get_cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1], None
+        pending = _get_inflight.get(key)
+        if pending is None:
+            future = _get_inflight[key] = Future()
+            generation = _get_generation
+    if pending is not None:
+        return pending.result()
+    result = (None, "request failed")
+    try:
+        result = _fetch(path, params, timeout)
+    finally:
+        with _get_lock:
+            del _get_inflight[key]
+            # errors aren't cached, nor responses that raced with a write
+            if result[1] is None and generation == _get_generation:
+                _get_cache[key] = (time.monotonic() + API_CACHE_SECONDS, result[0])
+        future.set_result(result)
+    return result
+
+def api_post(path, json_payload=None, timeout=15, invalidate=True):
     try:
-        r = requests.get(f"{API_BASE}{path}", params=params, timeout=timeout)
+        r = session.post(f"{API_BASE}{path}", json=json_payload, timeout=timeout)
         r.raise_for_status()
         return r.json(), None
     except Exception as e:
         return None, str(e)
+    finally:
+        if invalidate:
+            invalidate_api_cache()
 
-def api_post(path, json_payload=None, timeout=15):
+# Frame endpoints answer with an Arrow stream when asked: (DataFrame, rest of the payload, err)
+def api_get_frame(path, params=None, timeout=15):
     try:
-        r = requests.post(f"{API_BASE}{path}", json=json_payload, timeout=timeout)
+        r = session.get(f"{API_BASE}{path}", params=params, timeout=timeout, headers={"Accept": ARROW_STREAM})
+        r.raise_for_status()
+        table = pa.ipc.open_stream(r.content).read_all()
+        meta = json.loads((table.schema.metadata or {}).get(b"meta", b"{}"))
+        return table.to_pandas(), meta, None
+    except Exception as e:
+        return None, None, str(e)
+
+def api_delete(path, timeout=15, invalidate=True):
+    try:
+        r = session.delete(f"{API_BASE}{path}", timeout=timeout)
         r.raise_for_status()
         return r.json(), None
     except Exception as e:
         return None, str(e)
+    finally:
+        if invalidate:
+            invalidate_api_cache()
 
 def api_patch(path, json_payload=None, timeout=15):
     try:
-        r = requests.patch(f"{API_BASE}{path}", json=json_payload, timeout=timeout)
+        r = session.patch(f"{API_BASE}{path}", json=json_payload, timeout=timeout)
         r.raise_for_status()
         return r.json(), None
     except Exception as e:
         return None, str(e)
+    finally:
+        invalidate_api_cache()
 
 # ----------------- Small UI pieces -----------------
 def dataset_card(ds):
@@ -53,7 +150,7 @@ def dataset_card(ds):
         dbc.CardBody(
             [
                 html.H5(ds.get("dataset_name", "Unnamed"), className="fw-bold"),
-                html.Small(f"Rows: {ds.get('num_rows','N/A')} • Cols: {ds.get('num_columns','N/A')}", className="text-muted d-block"),
+                html.Small(f"Rows: {ds.get('num_rows') or 'N/A'} • Cols: {ds.get('num_columns') or 'N/A'}", className="text-muted d-block"),
                 dbc.Button("Open", id={"type":"open-ds","id":ds["id"]}, color="primary", size="sm", className="me-2 mt-2"),
                 dbc.Button("Analyses", id={"type":"analyses-ds","id":ds["id"]}, color="success", size="sm", className="mt-2"),
             ]
@@ -174,7 +271,9 @@ app.layout = dbc.Container(
                                             ], value="table", clearable=False),
                                             html.Br(),
                                             dbc.Button("Preview", id="analysis-preview-btn", color="primary"),
+                                            dbc.Button("Cancel", id="preview-cancel-btn", color="secondary", className="ms-2", style={"display":"none"}),
                                             dbc.Button("Save Analysis", id="save-analysis-btn", color="success", className="ms-2"),
+                                            dbc.Progress(id="preview-progress", value=0, label="", className="mt-2", style={"display":"none"}),
                                             html.Hr(),
                                             html.Div(id="analysis-preview-output", style={"minHeight":"200px","border":"1px solid #eee","padding":"8px"})
                                         ], width=8)
@@ -207,6 +306,8 @@ app.layout = dbc.Container(
                         dcc.Store(id="current-dataset-store", data={"dataset_id":None,"page":1,"limit":50}),
                         dcc.Store(id="analysis-columns-store"),
                         dcc.Store(id="last-preview-store"),
+                        dcc.Store(id="preview-task-store"),
+                        dcc.Store(id="session-id-store", storage_type="session"),
                         dcc.Store(id="main-view-store", data="home"),
                         dcc.Store(id="reports-store"),
                         dcc.Store(id="current-report-store", data={"report_id": None}),
@@ -232,6 +333,50 @@ def get_triggered_json_id():
     except Exception:
         return None
 
+# DataTable filter_query ("{region} contains "No" && {sales} > 100") -> backend saved filter
+# dict; expressions it can't express are left out
+TABLE_FILTER_OPS = {"=": "eq", "eq": "eq", "!=": "ne", "ne": "ne", ">": "gt", "gt": "gt", ">=": "gte", "ge": "gte",
+                    "<": "lt", "lt": "lt", "<=": "lte", "le": "lte", "contains": "contains", "datestartswith": "prefix"}
+TABLE_FILTER_PART = re.compile(r'^\{(.+?)\}\s+(\S+)\s+(.+)$')
+
+def table_filter(filter_query):
+    saved = {}
+    for part in (filter_query or "").split(" && "):
+        m = TABLE_FILTER_PART.match(part.strip())
+        if not m:
+            continue
+        column, op, value = m.groups()
+        # "i"/"s" prefixes pick case-insensitive/sensitive matching
+        ignore_case = op.startswith("i") and op[1:] in TABLE_FILTER_OPS
+        op = TABLE_FILTER_OPS.get(op[1:] if op[:1] in ("i", "s") and op[1:] in TABLE_FILTER_OPS else op)
+        if not op:
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+            value = value[1:-1]
+        condition = saved.setdefault(column, {})
+        condition[op] = value
+        if ignore_case:
+            condition["ignore_case"] = True
+    return saved
+
+def preview_table(df, meta):
+    return dash_table.DataTable(
+        id="preview-table",
+        columns=[{"name": c, "id": c} for c in df.columns],
+        data=df.astype(object).where(df.notna(), None).to_dict("records"),
+        page_current=0,
+        page_size=PREVIEW_PAGE_SIZE,
+        page_count=meta.get("page_count", 1),
+        page_action="custom",
+        sort_action="custom",
+        sort_mode="multi",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        style_table={"overflowX": "auto"},
+    )
+
 # ----------------- Load datasets list -----------------
 @app.callback(
     Output("datasets-grid", "children"),
@@ -622,6 +767,18 @@ def handle_rename_modal(open_btn, save_btn, cancel_btn, new_name, current_report
     return no_update, no_update, no_update, no_update
 
 # ----------------- Preview & Save Analysis -----------------
+# One id per browser tab: the API cancels a tab's running preview when it starts a newer one
+@app.callback(
+    Output("session-id-store", "data"),
+    Input("url", "pathname"),
+    State("session-id-store", "data"),
+)
+def ensure_session_id(pathname, session_id):
+    return session_id or uuid.uuid4().hex
+
+# Previews run as API tasks: this background callback submits one, polls its progress and
+# fetches the result when it is done. Clicking Preview again replaces the running job
+# (and the API cancels its task); Cancel stops both.
 @app.callback(
     Output("analysis-preview-output", "children"),
     Output("last-preview-store", "data"),
@@ -631,20 +788,41 @@ def handle_rename_modal(open_btn, save_btn, cancel_btn, new_name, current_report
     State("builder-values", "value"),
     State("builder-chart-type", "value"),
     State("analysis-dataset-select", "value"),
+    State("session-id-store", "data"),
+    background=True,
+    running=[
+        (Output("preview-cancel-btn", "style"), {"display":"inline-block"}, {"display":"none"}),
+        (Output("preview-progress", "style"), {"display":"flex"}, {"display":"none"}),
+    ],
+    progress=[Output("preview-progress", "value"), Output("preview-progress", "label"), Output("preview-task-store", "data")],
+    cancel=[Input("preview-cancel-btn", "n_clicks")],
     prevent_initial_call=True
 )
-def run_preview(n, rows, cols, values, chart_type, dataset_id):
+def run_preview(set_progress, n, rows, cols, values, chart_type, dataset_id, session_id):
     if not dataset_id:
         return html.Div("Select a dataset first", className="text-warning"), no_update
-    payload = {"dataset_id": dataset_id, "analysis_id": 1, "type": "pivot", "rows": rows or [], "columns": cols or [], "values": [{"column":v,"agg":"sum"} for v in (values or [])]}
-    res, err = api_post("/analysis/preview", json_payload=payload)
+    payload = {"dataset_id": dataset_id, "analysis_id": 1, "type": "pivot", "rows": rows or [], "columns": cols or [], "values": [{"column":v,"agg":"sum"} for v in (values or [])], "session_id": session_id}
+    # tables get one page now and the rest on demand; charts need every row
+    if chart_type == "table":
+        payload["page_size"] = PREVIEW_PAGE_SIZE
+    # preview tasks don't change anything the cached reads return
+    task, err = api_post("/analysis/preview/tasks", json_payload=payload, invalidate=False)
+    if err:
+        return html.Div(f"Preview error: {err}", className="text-danger"), no_update
+    preview_id = task["preview_id"]
+    while task["status"] in ("queued", "running"):
+        set_progress((task["progress"], task["stage"], {"preview_id": preview_id}))
+        time.sleep(PREVIEW_POLL_SECONDS)
+        task, err = api_get(f"/analysis/preview/tasks/{preview_id}", cache=False)
+        if err:
+            return html.Div(f"Preview error: {err}", className="text-danger"), no_update
+    if task["status"] != "succeeded":
+        return html.Div(f"Preview {task['status']}: {task.get('error') or ''}", className="text-danger"), no_update
+    df, meta, err = api_get_frame(f"/analysis/preview/tasks/{preview_id}/result")
     if err:
         return html.Div(f"Preview error: {err}", className="text-danger"), no_update
-    table = res.get("table", [])
-    df = pd.DataFrame(table)
     if chart_type == "table" or df.empty:
-        dt = dash_table.DataTable(columns=[{"name":c,"id":c} for c in df.columns], data=df.to_dict("records"), page_size=10, style_table={"overflowX":"auto"})
-        return dt, {"last_preview": {"rows": len(df), "type":"table"}}
+        return preview_table(df, meta), {"last_preview": {"rows": meta.get("count", 0), "type": "table", "result_id": meta.get("result_id")}}
     try:
         if chart_type == "bar" and len(rows)>0 and len(values)>0:
             fig = px.bar(df, x=rows[0], y=values[0], title="Bar chart")
@@ -660,6 +838,48 @@ def run_preview(n, rows, cols, values, chart_type, dataset_id):
     except Exception as e:
         return html.Div(f"Chart render error: {str(e)}", className="text-danger"), no_update
 
+@app.callback(
+    Output("preview-task-store", "data", allow_duplicate=True),
+    Input("preview-cancel-btn", "n_clicks"),
+    State("preview-task-store", "data"),
+    prevent_initial_call=True
+)
+def cancel_preview(n, task_store):
+    preview_id = (task_store or {}).get("preview_id")
+    if preview_id:
+        api_delete(f"/analysis/preview/tasks/{preview_id}", invalidate=False)
+    return None
+
+# Page, sort and filter the preview grid on the server: one page per request
+@app.callback(
+    Output("preview-table", "data"),
+    Output("preview-table", "page_count"),
+    Output("preview-table", "page_current"),
+    Input("preview-table", "page_current"),
+    Input("preview-table", "sort_by"),
+    Input("preview-table", "filter_query"),
+    State("last-preview-store", "data"),
+    prevent_initial_call=True
+)
+def page_preview_table(page_current, sort_by, filter_query, last_preview):
+    result_id = ((last_preview or {}).get("last_preview") or {}).get("result_id")
+    if not result_id:
+        return no_update, no_update, no_update
+    # a new sort or filter starts again from the first page
+    if "preview-table.page_current" in ctx.triggered_prop_ids:
+        page = (page_current or 0) + 1
+    else:
+        page = 1
+    params = {"page": page, "page_size": PREVIEW_PAGE_SIZE,
+              "sort": [f"{s['column_id']}:{s['direction']}" for s in (sort_by or [])]}
+    saved = table_filter(filter_query)
+    if saved:
+        params["filter"] = json.dumps(saved)
+    res, err = api_get(f"/analysis/results/{result_id}", params=params)
+    if err:
+        return [], 1, 0
+    return res.get("table", []), res.get("page_count", 1), res.get("page", 1) - 1
+
 @app.callback(
     Output("analysis-preview-output", "children", allow_duplicate=True),
     Input("save-analysis-btn", "n_clicks"),
@@ -683,6 +903,8 @@ def save_analysis(n, name, rows, cols, values, chart_type, dataset_id):
     return html.Div("Saved analysis successfully ✅", className="text-success"), no_update
 
 # ----------------- Export dataset CSV -----------------
+# Links straight to the API's streaming export, so the whole dataset downloads without
+# passing through the Dash server or the page
 @app.callback(
     Output("dataset-preview-body", "children", allow_duplicate=True),
     Input("export-ds-csv", "n_clicks"),
@@ -693,17 +915,11 @@ def export_dataset_csv(n, dataset_store):
     if not dataset_store or not dataset_store.get("dataset_id"):
         return no_update
     ds_id = dataset_store["dataset_id"]
-    page = dataset_store.get("page",1)
-    limit = dataset_store.get("limit",50)
-    res, err = api_get(f"/datasets/{ds_id}/data", params={"page":page, "limit":limit})
-    if err:
-        return html.Div(f"Export error: {err}", className="text-danger")
-    df = pd.DataFrame(res.get("data",[]))
-    csv_string = df.to_csv(index=False, encoding='utf-8')
-    csv_b64 = base64.b64encode(csv_string.encode()).decode()
-    csv_string_b64 = "data:text/csv;base64," + csv_b64
-    download_link = html.A("📥 Download CSV", href=csv_string_b64, download=f"{dataset_store.get('dataset_name','dataset')}_page{page}.csv", className="btn btn-success mt-2")
-    return html.Div([download_link], className="mt-3")
+    links = [
+        html.A("📥 Download CSV", href=f"{API_BASE}/datasets/{ds_id}/export?format=csv", className="btn btn-success mt-2 me-2"),
+        html.A("📥 Download Parquet", href=f"{API_BASE}/datasets/{ds_id}/export?format=parquet", className="btn btn-outline-success mt-2"),
+    ]
+    return html.Div(links, className="mt-3")
 
 # ----------------- Run server -----------------
 if __name__ == "__main__":
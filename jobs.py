@@ -0,0 +1,172 @@
+# jobs.py
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+import crud
+from db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# how often the dispatcher looks for due jobs (scheduled refreshes, other processes' jobs)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# running jobs without a heartbeat for this long are assumed dead and re-queued
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# the dispatcher refreshes the heartbeat of this process's running jobs this often, so
+# steps that report no progress (e.g. parsing an Excel file) don't look dead
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", str(JOB_STALE_SECONDS / 5)))
+# progress is written at most this often per job (and on every 5% step)
+JOB_PROGRESS_SECONDS = 1.0
+
+# The queue is the ingest_jobs table: requests insert a row and return its id, and a
+# dispatcher thread in every API process claims due rows and runs them on a small
+# thread pool. Works the same on SQLite locally and on Postgres with several workers.
+
+
+class JobRunner:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._running = set()
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest-job")
+            self._dispatcher = threading.Thread(target=self._dispatch, name="ingest-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def stop(self):
+        with self._lock:
+            dispatcher, executor = self._dispatcher, self._executor
+            self._dispatcher = self._executor = None
+        if dispatcher is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        dispatcher.join()
+        executor.shutdown(wait=True)
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _dispatch(self):
+        last_sweep = last_beat = 0.0
+        while not self._stop.is_set():
+            try:
+                db = SessionLocal()
+                try:
+                    with self._lock:
+                        running = list(self._running)
+                    if running and time.monotonic() - last_beat >= JOB_HEARTBEAT_SECONDS:
+                        crud.touch_ingest_jobs(db, running)
+                        last_beat = time.monotonic()
+                    if time.monotonic() - last_sweep > JOB_STALE_SECONDS / 2:
+                        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+                        crud.requeue_stale_ingest_jobs(db, stale_before)
+                        last_sweep = time.monotonic()
+                    while self._free_slot():
+                        try:
+                            job_id = crud.claim_next_ingest_job(db)
+                        except Exception:
+                            self._release_slot()
+                            raise
+                        if job_id is None:
+                            self._release_slot()
+                            break
+                        self._executor.submit(self._run, job_id)
+                finally:
+                    db.close()
+            except Exception:
+                logger.exception("ingest job dispatch failed")
+            self._wake.wait(JOB_POLL_SECONDS)
+            self._wake.clear()
+
+    def _free_slot(self) -> bool:
+        with self._lock:
+            if self._active >= self.workers:
+                return False
+            self._active += 1
+            return True
+
+    def _release_slot(self):
+        with self._lock:
+            self._active -= 1
+
+    def _run(self, job_id: int):
+        with self._lock:
+            self._running.add(job_id)
+        db = SessionLocal()
+        try:
+            job = crud.get_ingest_job(db, job_id)
+            try:
+                run_job(db, job)
+            except Exception as e:
+                logger.exception("ingest job %s failed", job_id)
+                db.rollback()
+                crud.finish_ingest_job(db, job_id, error=str(e) or type(e).__name__)
+            else:
+                crud.finish_ingest_job(db, job_id)
+                every = (job.payload or {}).get("every_seconds")
+                if job.kind == "refresh" and every and not crud.get_active_ingest_job(db, job.dataset_id, "refresh"):
+                    crud.create_ingest_job(db, "refresh", job.dataset_id, job.payload,
+                                           run_after=datetime.utcnow() + timedelta(seconds=every))
+        finally:
+            db.close()
+            with self._lock:
+                self._running.discard(job_id)
+            self._release_slot()
+            # a slot is free: look for the next job now rather than at the next poll
+            self._wake.set()
+
+
+runner = JobRunner(JOB_WORKERS)
+
+
+def _progress_reporter(db, job_id: int):
+    last = {"at": 0.0, "percent": 0}
+
+    def report(fraction: float):
+        # 99 at most: 100 means the results are stored
+        percent = min(int(fraction * 100), 99)
+        now = time.monotonic()
+        if percent >= last["percent"] + 5 or now - last["at"] >= JOB_PROGRESS_SECONDS:
+            crud.update_ingest_job_progress(db, job_id, percent)
+            last.update(at=now, percent=percent)
+    return report
+
+
+# register: stream latest_file once (counts, dtype plan, snapshot)
+# refresh: re-list the prefix and, when latest_file moved on, ingest the new file
+def run_job(db, job):
+    metadata = crud.get_dataset_by_id(db, job.dataset_id)
+    if metadata is None:
+        raise ValueError(f"Dataset {job.dataset_id} not found")
+    if job.kind == "refresh":
+        crud.refresh_latest_file(db, metadata, force=True)
+        if metadata.dtype_plan is not None:
+            return
+    elif job.kind != "register":
+        raise ValueError(f"Unknown job kind: {job.kind}")
+    summary = crud.ingest_dataset(metadata.s3_bucket, metadata.latest_file, _progress_reporter(db, job.id))
+    crud.apply_ingest_summary(db, metadata, summary)
+
+
+def enqueue(db, kind: str, dataset_id: int, payload: Optional[dict] = None, delay_seconds: float = 0):
+    run_after = datetime.utcnow() + timedelta(seconds=delay_seconds)
+    job = crud.create_ingest_job(db, kind, dataset_id, payload, run_after)
+    runner.wake()
+    return job
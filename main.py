@@ -1,32 +1,41 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import crud, schemas, models
-from db import get_db, Base, engine
-import boto3, io
+from db import get_db, Base, engine, SessionLocal, release, pool_stats
+import cube
+import dataset_loader
+import exports
+import filters
+import formula
+import jobs
+import previews
+import results
+import serialize
+import storage
+import os
+import re
+import threading
+import json
 import numpy as np
 from datetime import datetime
 from typing import List, Optional, Any
 import pandas as pd
-import re
 
 # create DB tables (run once; if you change models use migrations)
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Pivot/Sheets/Reports API")
 
-def apply_formula(df: pd.DataFrame, formula: str):
-    expr = formula
-    # Replace column names with df["col"]
-    for col in df.columns:
-        expr = re.sub(rf'\b{re.escape(col)}\b', f'df["{col}"]', expr)
-    # simple ifelse -> np.where conversion
-    expr = re.sub(r'ifelse\s*\((.*?),(.*?),(.*)\)', r'np.where(\1, \2, \3)', expr)
-    try:
-        result = eval(expr, {"df": df, "np": np, "pd": pd})
-    except Exception as e:
-        raise ValueError(f"Invalid formula: {formula} | Error: {e}")
-    return result
+@app.on_event("startup")
+def start_job_runner():
+    jobs.runner.start()
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    jobs.runner.stop()
+    previews.runner.stop()
 
 # ---------------- Reports & Sheets ----------------
 @app.post("/reports/", response_model=schemas.ReportResponse)
@@ -60,81 +69,140 @@ def add_analysis_to_sheet(sheet_id: int, req: schemas.SheetAnalysisMapIn, db: Se
     mapping = crud.add_analysis_to_sheet(db, sheet_id, req.analysis_id)
     return mapping
 
-@app.get("/reports/{report_id}")
-def get_report(report_id: int, db: Session = Depends(get_db)):
+# Bulk provisioning: each call is a single INSERT ... RETURNING in one transaction
+@app.post("/reports/{report_id}/sheets:batch", response_model=List[schemas.SheetResponse])
+def create_sheets_batch(report_id: int, req: schemas.SheetBatchCreate, db: Session = Depends(get_db)):
     rep = crud.get_report(db, report_id)
     if not rep:
         raise HTTPException(404, "Report not found")
-    sheets = []
-    for s in rep.sheets:
-        s_maps = s.sheet_maps
-        analyses = []
-        for m in s_maps:
-            a = crud.get_analysis(db, m.analysis_id)
-            ds = crud.get_dataset_by_id(db, a.dataset_id)
-            analyses.append({
-                "analysis_id": a.id,
-                "analysis_name": a.analysis_name,
-                "dataset_id": ds.id,
-                "dataset_name": ds.dataset_name
-            })
-        sheets.append({"sheet_id": s.id, "name": s.name, "analyses": analyses})
-    return {"report_id": rep.id, "name": rep.name, "sheets": sheets}
+    return crud.create_sheets(db, report_id, req.names)
+
+@app.post("/sheets/{sheet_id}/add-analyses", response_model=List[schemas.SheetAnalysisMapOut])
+def add_analyses_to_sheet(sheet_id: int, req: schemas.SheetAnalysisMapBatchIn, db: Session = Depends(get_db)):
+    sheet = crud.get_sheet(db, sheet_id)
+    if not sheet:
+        raise HTTPException(404, "Sheet not found")
+    missing = crud.get_missing_analysis_ids(db, req.analysis_ids)
+    if missing:
+        raise HTTPException(404, f"Analysis not found: {missing}")
+    return crud.add_analyses_to_sheet(db, sheet_id, req.analysis_ids)
+
+@app.get("/reports/{report_id}")
+def get_report(report_id: int, db: Session = Depends(get_db)):
+    tree = crud.get_report_tree(db, report_id)
+    if not tree:
+        raise HTTPException(404, "Report not found")
+    return tree
 
 # ---------------- Dataset endpoints ----------------
-@app.post("/datasets/", response_model=schemas.DatasetMetadataResponse)
+@app.post("/datasets/", response_model=schemas.DatasetRegistrationResponse)
 def upload_dataset(dataset: schemas.DatasetMetadataCreate, db: Session = Depends(get_db)):
     try:
         latest_file = crud.get_latest_file_from_s3(dataset.s3_bucket, dataset.s3_key)
-        df = crud.fetch_dataset_from_s3(dataset.s3_bucket, latest_file)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"S3 Error: {e}")
-    dataset.num_rows = len(df)
-    dataset.num_columns = len(df.columns)
-    return crud.create_dataset_metadata(db, dataset, latest_file)
+    metadata = crud.create_dataset_metadata(db, dataset, latest_file)
+    # the download and parse run off the request path; poll GET /jobs/{job_id}
+    job = jobs.enqueue(db, "register", metadata.id)
+    return {**schemas.DatasetMetadataResponse.model_validate(metadata).model_dump(), "job_id": job.id}
+
+# Re-list the prefix and ingest a new latest_file in the background, optionally delayed
+# and/or repeated every `every_seconds`
+@app.post("/datasets/{dataset_id}/refresh", response_model=schemas.IngestJobResponse)
+def schedule_dataset_refresh(dataset_id: int, req: Optional[schemas.DatasetRefreshRequest] = None,
+                             db: Session = Depends(get_db)):
+    req = req or schemas.DatasetRefreshRequest()
+    if not crud.get_dataset_by_id(db, dataset_id):
+        raise HTTPException(404, "Dataset not found")
+    active = crud.get_active_ingest_job(db, dataset_id, "refresh")
+    if active:
+        return active
+    payload = {"every_seconds": req.every_seconds} if req.every_seconds else {}
+    return jobs.enqueue(db, "refresh", dataset_id, payload, delay_seconds=req.delay_seconds)
+
+@app.get("/datasets/{dataset_id}/jobs", response_model=List[schemas.IngestJobResponse])
+def list_dataset_jobs(dataset_id: int, db: Session = Depends(get_db)):
+    return crud.get_ingest_jobs_by_dataset(db, dataset_id)
+
+@app.get("/jobs/{job_id}", response_model=schemas.IngestJobResponse)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = crud.get_ingest_job(db, job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
 
 @app.get("/datasets/", response_model=List[schemas.DatasetMetadataResponse])
 def list_datasets(db: Session = Depends(get_db)):
     return crud.get_all_datasets(db)
 
 @app.get("/datasets/{dataset_id}/data")
-def get_dataset_data(dataset_id: int, db: Session = Depends(get_db), page: int = 1, limit: int = 500):
+def get_dataset_data(dataset_id: int, db: Session = Depends(get_db), page: int = Query(1, ge=1),
+                     limit: int = Query(500, ge=1), accept: Optional[str] = Header(None)):
     metadata = crud.get_dataset_by_id(db, dataset_id)
     if not metadata:
         raise HTTPException(status_code=404, detail="Dataset not found")
-    bucket = metadata.s3_bucket
-    prefix = metadata.s3_key
     try:
-        latest_file = crud.get_latest_file_from_s3(bucket, prefix)
-        obj = boto3.client("s3").get_object(Bucket=bucket, Key=latest_file)
-        raw = obj["Body"].read()
-        if latest_file.endswith(".csv"):
-            try:
-                df = pd.read_csv(io.BytesIO(raw), encoding="utf-8")
-            except UnicodeDecodeError:
-                df = pd.read_csv(io.BytesIO(raw), encoding="latin1")
-        elif latest_file.endswith((".xlsx", ".xls")):
-            df = pd.read_excel(io.BytesIO(raw))
-        elif latest_file.endswith(".parquet"):
-            df = pd.read_parquet(io.BytesIO(raw))
-        else:
-            raise HTTPException(400, detail="Unsupported file type")
-        total_rows = len(df)
+        latest_file = crud.refresh_latest_file(db, metadata)
         start = (page - 1) * limit
-        end = start + limit
-        df_page = df.iloc[start:end].replace({np.nan: None})
-        return {
+        df_page, total_rows = crud.fetch_dataset_page(db, metadata, start, limit)
+        # dates parsed by the dtype plan go out as written ("2024-01-31"), not as timestamps
+        for col in df_page.select_dtypes("datetime").columns:
+            dates = df_page[col].dropna()
+            if (dates == dates.dt.normalize()).all():
+                df_page = df_page.assign(**{col: df_page[col].dt.strftime("%Y-%m-%d")})
+        # rows as records, columns or Arrow (Accept); NaN/NaT go out as null
+        return serialize.frame_response(df_page, {
             "dataset_name": metadata.dataset_name,
             "latest_file": latest_file,
             "page": page,
             "limit": limit,
             "total_rows": total_rows,
             "total_pages": (total_rows + limit - 1) // limit,
-            "data": df_page.to_dict(orient="records")
-        }
+        }, accept, "data")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Whole dataset as CSV or Parquet, streamed batch by batch from its snapshot. Optional
+# row filters: an analysis's saved filter and/or `filter`, a saved-filter dict as JSON.
+@app.get("/datasets/{dataset_id}/export")
+def export_dataset(dataset_id: int, format: str = "csv", analysis_id: Optional[int] = None,
+                   filter: Optional[str] = None, db: Session = Depends(get_db)):
+    if format not in exports.FORMATS:
+        raise HTTPException(400, f"format must be one of: {', '.join(exports.FORMATS)}")
+    metadata = crud.get_dataset_by_id(db, dataset_id)
+    if not metadata:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    conditions = {}
+    saved = crud.get_saved_filter(db, dataset_id, analysis_id) if analysis_id else None
+    if isinstance(saved, dict):
+        conditions.update(saved)
+    try:
+        extra = json.loads(filter) if filter else {}
+    except ValueError:
+        raise HTTPException(400, "filter must be JSON")
+    if not isinstance(extra, dict):
+        raise HTTPException(400, "filter must be a JSON object")
+    # both apply: a column in both keeps every operator of each
+    for column, condition in extra.items():
+        if isinstance(conditions.get(column), dict) and isinstance(condition, dict):
+            conditions[column] = {**conditions[column], **condition}
+        else:
+            conditions[column] = condition
+    if metadata.dtype_plan is None and crud.get_active_ingest_job(db, dataset_id):
+        raise HTTPException(409, "Dataset is still being ingested")
+    try:
+        dtype_plan = crud.get_dtype_plan(db, metadata)
+        release(db)
+        table = crud.fetch_dataset_table(metadata.s3_bucket, metadata.latest_file)
+        body = exports.stream(table, format, conditions, dtype_plan)
+    except filters.FilterError as e:
+        raise HTTPException(400, f"Filter Error: {e}")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    name = re.sub(r"[^\w.-]+", "_", metadata.dataset_name or f"dataset_{dataset_id}")
+    return StreamingResponse(body, media_type=exports.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'})
+
 # ---------------- Get dataset columns ----------------
 @app.get("/datasets/{dataset_id}/columns")
 def get_dataset_columns(dataset_id: int, db: Session = Depends(get_db)):
@@ -142,40 +210,28 @@ def get_dataset_columns(dataset_id: int, db: Session = Depends(get_db)):
     if not metadata:
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    bucket = metadata.s3_bucket
-    prefix = metadata.s3_key
-
-    latest_file = crud.get_latest_file_from_s3(bucket, prefix)
+    latest_file = crud.refresh_latest_file(db, metadata)
     if not latest_file:
         raise HTTPException(404, "No files found in S3 folder")
 
-    s3 = boto3.client("s3")
-    obj = s3.get_object(Bucket=bucket, Key=latest_file)
-    raw = obj["Body"].read()
-
-    # Read header only
-    if latest_file.endswith(".csv"):
-        try:
-            df = pd.read_csv(io.BytesIO(raw), nrows=0, encoding="utf-8")
-        except UnicodeDecodeError:
-            df = pd.read_csv(io.BytesIO(raw), nrows=0, encoding="latin1")
-    elif latest_file.endswith((".xlsx", ".xls")):
-        df = pd.read_excel(io.BytesIO(raw), nrows=0)
-    elif latest_file.endswith(".parquet"):
-        df = pd.read_parquet(io.BytesIO(raw)).head(0)
-    else:
-        raise HTTPException(400, "Unsupported file type")
-
-    dataset_columns = list(df.columns)
-    return {"columns": dataset_columns}
+    try:
+        schema = crud.get_dataset_schema(db, metadata)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    dataset_columns = [c["name"] for c in schema]
+    return {"columns": dataset_columns, "schema": schema}
 
 # ---------------- Analysis endpoints ----------------
 @app.post("/analyses/", response_model=schemas.AnalysisResponse)
-def create_analysis(analysis: schemas.AnalysisCreate, db: Session = Depends(get_db)):
+def create_analysis(analysis: schemas.AnalysisCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     ds = crud.get_dataset_by_id(db, analysis.dataset_id)
     if not ds:
         raise HTTPException(404, "Dataset not found")
-    return crud.create_analysis(db, analysis)
+    created = crud.create_analysis(db, analysis)
+    # pre-aggregate the saved rows/columns/values so previews of it skip the raw scan
+    background_tasks.add_task(materialize_cube_task, created.id)
+    return created
 
 @app.get("/datasets/{dataset_id}/analyses", response_model=List[schemas.AnalysisResponse])
 def get_dataset_analyses(dataset_id: int, db: Session = Depends(get_db)):
@@ -190,21 +246,12 @@ def get_all_columns_for_analysis(analysis_id: int, db: Session = Depends(get_db)
     metadata = crud.get_dataset_by_id(db, dataset_id)
     if not metadata:
         raise HTTPException(404, "Dataset not found")
-    latest_file = crud.get_latest_file_from_s3(metadata.s3_bucket, metadata.s3_key)
-    obj = boto3.client("s3").get_object(Bucket=metadata.s3_bucket, Key=latest_file)
-    raw = obj["Body"].read()
-    if latest_file.endswith(".csv"):
-        try:
-            df = pd.read_csv(io.BytesIO(raw), nrows=0, encoding="utf-8")
-        except UnicodeDecodeError:
-            df = pd.read_csv(io.BytesIO(raw), nrows=0, encoding="latin1")
-    elif latest_file.endswith((".xlsx", ".xls")):
-        df = pd.read_excel(io.BytesIO(raw), nrows=0)
-    elif latest_file.endswith(".parquet"):
-        df = pd.read_parquet(io.BytesIO(raw)).head(0)
-    else:
-        raise HTTPException(400, "Unsupported file type")
-    dataset_columns = list(df.columns)
+    crud.refresh_latest_file(db, metadata)
+    try:
+        schema = crud.get_dataset_schema(db, metadata)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    dataset_columns = [c["name"] for c in schema]
     calc_fields = crud.get_calculated_fields_by_analysis(db, analysis_id)
     calc_field_names = [f.field_name for f in calc_fields]
     return {"columns": dataset_columns + calc_field_names}
@@ -217,6 +264,14 @@ def create_calc_field(payload: schemas.CalculatedFieldCreate, db: Session = Depe
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/calculated-fields:batch", response_model=List[schemas.CalculatedFieldOut])
+def create_calc_fields_batch(payload: schemas.CalculatedFieldBatchCreate, db: Session = Depends(get_db)):
+    try:
+        return crud.create_calculated_fields(db, payload.fields)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/analysis/{analysis_id}/calculated-fields", response_model=List[schemas.CalculatedFieldOut])
 def list_calc_fields(analysis_id: int, db: Session = Depends(get_db)):
     return crud.get_calculated_fields_by_analysis(db, analysis_id)
@@ -236,16 +291,18 @@ def save_filter(req: schemas.FilterSaveRequest, db: Session = Depends(get_db)):
         raise HTTPException(404, "Analysis not found")
     if int(analysis.dataset_id) != int(req.dataset_id):
         raise HTTPException(400, "Dataset ID does not match the analysis")
+    try:
+        filters.compile_filter(req.selected_columns)
+    except filters.FilterError as e:
+        raise HTTPException(400, f"Filter Error: {e}")
     filt = crud.save_filter(db, req.dataset_id, req.analysis_id, req.selected_columns)
     return filt
 
 @app.get("/filters/saved", response_model=schemas.FilterResponse)
 def get_saved_filter(dataset_id: int = Query(...), analysis_id: int = Query(...), db: Session = Depends(get_db)):
-    obj = crud.get_saved_filter(db, dataset_id, analysis_id)
-    if obj is None:
+    rec = crud.get_filter_record(db, dataset_id, analysis_id)
+    if rec is None:
         raise HTTPException(404, "No saved filter found")
-    # return DB model instance - fetch the full object to include id
-    rec = db.query(models.FilterSelection).filter_by(dataset_id=dataset_id, analysis_id=analysis_id).first()
     return rec
 
 @app.delete("/filters")
@@ -256,8 +313,20 @@ def delete_filter(dataset_id: int = Query(...), analysis_id: int = Query(...), d
     return {"message": "Filter deleted"}
 
 # ---------------- Analysis Preview (Pivot) ----------------
-@app.post("/analysis/preview")
-def analysis_preview(payload: schemas.AnalysisPreviewRequest, db: Session = Depends(get_db)):
+def materialize_cube_task(analysis_id: int):
+    db = SessionLocal()
+    try:
+        crud.materialize_analysis_cube(db, analysis_id)
+    except Exception:
+        # best effort: previews fall back to the raw rows without a cube
+        pass
+    finally:
+        db.close()
+
+# Everything a preview needs from the database, checked up front; the pivot itself is then
+# computed from the spec alone (previews.compute), here or in a preview worker. None for
+# analysis types without a preview yet.
+def _preview_spec(db: Session, payload: schemas.AnalysisPreviewRequest) -> Optional[dict]:
     dataset_id = payload.dataset_id
     analysis_id = payload.analysis_id
     analysis_type = payload.type.lower()
@@ -269,102 +338,203 @@ def analysis_preview(payload: schemas.AnalysisPreviewRequest, db: Session = Depe
         raise HTTPException(400, "dataset_id is required")
     if not analysis_id:
         raise HTTPException(400, "analysis_id is required")
+    if payload.page_size is not None and not 1 <= payload.page_size <= results.PAGE_SIZE_MAX:
+        raise HTTPException(400, f"page_size must be between 1 and {results.PAGE_SIZE_MAX}")
 
     metadata = crud.get_dataset_by_id(db, dataset_id)
     if not metadata:
         raise HTTPException(404, "Dataset not found")
 
-    obj = boto3.client("s3").get_object(Bucket=metadata.s3_bucket, Key=metadata.latest_file)
-    raw = obj["Body"].read()
-    if metadata.latest_file.endswith(".csv"):
-        df = pd.read_csv(io.BytesIO(raw))
-    elif metadata.latest_file.endswith((".xlsx", ".xls")):
-        df = pd.read_excel(io.BytesIO(raw))
-    elif metadata.latest_file.endswith(".parquet"):
-        df = pd.read_parquet(io.BytesIO(raw))
-    else:
-        raise HTTPException(400, "Unsupported file type")
-
-    # Apply calculated fields
+    # Plan calculated fields: only those the preview uses (and their dependencies) are
+    # evaluated, in dependency order; without explicit values every field is a value, as before
     calc_fields = crud.get_calculated_fields_by_analysis(db, analysis_id)
-    for f in calc_fields:
-        try:
-            df[f.field_name] = apply_formula(df, f.formula)
-            # try coerce to numeric where possible
-            df[f.field_name] = pd.to_numeric(df[f.field_name], errors="ignore")
-        except Exception as e:
-            raise HTTPException(400, f"Formula Error in {f.field_name}: {e}")
-
-    # Apply saved filters (can be list of cols or dict col->values)
+    formulas = {f.field_name: f.formula for f in calc_fields}
     saved = crud.get_saved_filter(db, dataset_id, analysis_id)
-    filtered_columns = []
-    if saved:
-        # if saved is a list -> keep those columns
-        if isinstance(saved, list):
-            for col in saved:
-                if col in df.columns:
-                    filtered_columns.append(col)
-            # Keep columns: rows + cols + filtered_columns + rest
-            keep_cols = list(dict.fromkeys(rows + columns + filtered_columns))
-            # ensure existing columns are preserved
-            keep_cols = [c for c in keep_cols if c in df.columns]
-            df = df[keep_cols + [c for c in df.columns if c not in keep_cols]]
-        elif isinstance(saved, dict):
-            # saved dict maps column -> allowed values: apply row filtering
-            for col, vals in saved.items():
-                if col in df.columns and vals:
-                    df = df[df[col].isin(vals)]
-                    filtered_columns.append(col)
-        else:
-            # unsupported format -> ignore
-            pass
+    requested = rows + columns + [v.column for v in values_config]
+    if isinstance(saved, (list, dict)):
+        requested += list(saved)
+    if not values_config:
+        requested += [f.field_name for f in calc_fields]
+    if metadata.dtype_plan is None and crud.get_active_ingest_job(db, dataset_id):
+        raise HTTPException(409, "Dataset is still being ingested")
+    try:
+        schema_columns = [c["name"] for c in crud.get_dataset_schema(db, metadata)]
+        dtype_plan = crud.get_dtype_plan(db, metadata)
+        plan = formula.plan_fields(formulas, schema_columns, requested)
+    except formula.FormulaError as e:
+        raise HTTPException(400, f"Formula Error in {e}")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    if analysis_type != "pivot":
+        return None
 
-    # Pivot
-    if analysis_type == "pivot":
-        agg_dict = {v.column: v.agg for v in values_config} if values_config else {}
-        value_cols = [v.column for v in values_config] if values_config else []
+    agg_dict = {v.column: v.agg for v in values_config} if values_config else {}
 
-        # add calculated fields automatically
+    # add calculated fields automatically when no values were picked
+    if not values_config:
         for f in calc_fields:
             if f.field_name not in agg_dict:
                 agg_dict[f.field_name] = f.default_agg or "sum"
-            if f.field_name not in value_cols:
-                value_cols.append(f.field_name)
-
-        try:
-            pivot = pd.pivot_table(
-                df,
-                index=rows if rows else None,
-                columns=columns if columns else None,
-                values=value_cols if value_cols else None,
-                aggfunc=agg_dict if agg_dict else "sum",
-                margins=True,
-                margins_name="Total"
-            )
-        except Exception as e:
-            raise HTTPException(400, f"Pivot Error: {e}")
-
-        pivot = pivot.reset_index()
-        # flatten columns
-        pivot.columns = [
-            "_".join([str(x) for x in col if x not in ["", None]])
-            if isinstance(col, tuple) else str(col)
-            for col in pivot.columns
-        ]
-        # keep 'Total' row at bottom
-        total_row = pivot[pivot.apply(lambda r: "Total" in " ".join(r.astype(str)), axis=1)]
-        pivot = pivot[~pivot.apply(lambda r: "Total" in " ".join(r.astype(str)), axis=1)]
-        pivot = pd.concat([pivot, total_row], ignore_index=True)
-
-        return {
-            "columns": pivot.columns.tolist(),
-            "count": len(pivot),
-            "table": pivot.to_dict(orient="records"),
-            "calculated_fields_used": [f.field_name for f in calc_fields],
-            "filtered_columns": filtered_columns
-        }
-
-    return {"message": "Other analysis types coming soon"}
+
+    try:
+        filters.compile_filter(saved)
+    except filters.FilterError as e:
+        raise HTTPException(400, f"Filter Error: {e}")
+    analysis = crud.get_analysis(db, analysis_id)
+    spec = {
+        "dataset_id": dataset_id,
+        "analysis_id": analysis_id,
+        "rows": rows,
+        "columns": columns,
+        "agg_dict": agg_dict,
+        "subtotals": payload.subtotals,
+        "page_size": payload.page_size,
+        "bucket": metadata.s3_bucket,
+        "key": metadata.latest_file,
+        "saved": saved,
+        "dtype_plan": dtype_plan,
+        "formulas": formulas,
+        "schema_columns": schema_columns,
+        "requested": requested,
+        "calculated_fields_used": plan.names,
+        # read only the columns the pivot, the filter and the planned fields use; with no
+        # values at all every numeric column is summed, so everything is needed
+        "needed": plan.input_columns(requested, schema_columns) if agg_dict else None,
+        "sig": crud.analysis_cube_signature(db, metadata, analysis_id),
+        # previews of the analysis's own dataset keep its cube current
+        "cube": bool(analysis and analysis.dataset_id == dataset_id),
+    }
+    # the connection goes back to the pool for the download and the pivot
+    release(db)
+    return spec
+
+# Store a computed preview for paging; `schedule(fn, *args)` runs the cube refresh later
+def _store_preview(spec: dict, result, filtered_columns, from_cube: bool, schedule) -> dict:
+    # refresh this analysis's cube (new file, filters or fields) for the next preview
+    if not from_cube and spec["cube"] and not cube.has_cube(spec["dataset_id"], spec["analysis_id"], spec["sig"]):
+        schedule(materialize_cube_task, spec["analysis_id"])
+    return {
+        "result_id": results.put(results.frame(result)),
+        "count": len(result.frame),
+        "calculated_fields_used": spec["calculated_fields_used"],
+        "filtered_columns": filtered_columns,
+    }
+
+def _preview_response(stored, page_size: Optional[int], info: dict, accept: Optional[str]):
+    if page_size:
+        # just the first page; the grid pages, sorts and filters through /analysis/results
+        cells, page_info = results.page(stored, 1, page_size)
+        return serialize.frame_response(cells, {**page_info, **info}, accept, "table")
+    # columns come back flattened, with the grand total as the last row
+    table = stored.drop(columns=results.ROW_TYPE)
+    return serialize.frame_response(table, {
+        **info,
+        "columns": table.columns.tolist(),
+        "row_types": stored[results.ROW_TYPE].tolist(),
+    }, accept, "table")
+
+@app.post("/analysis/preview")
+def analysis_preview(payload: schemas.AnalysisPreviewRequest, background_tasks: BackgroundTasks,
+                     db: Session = Depends(get_db), accept: Optional[str] = Header(None)):
+    spec = _preview_spec(db, payload)
+    if spec is None:
+        return {"message": "Other analysis types coming soon"}
+    try:
+        result, filtered_columns, from_cube = previews.compute(spec)
+    except previews.PreviewError as e:
+        raise HTTPException(400, str(e))
+    info = _store_preview(spec, result, filtered_columns, from_cube, background_tasks.add_task)
+    return _preview_response(results.frame(result), payload.page_size, info, accept)
+
+# ---------------- Preview tasks ----------------
+# The same preview computed by a bounded pool of worker processes: returns a preview_id
+# at once; poll GET /analysis/preview/tasks/{id} and fetch .../result when it succeeded.
+# A new task for the same session_id and analysis cancels the previous one.
+def _schedule_thread(fn, *args):
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+@app.post("/analysis/preview/tasks", response_model=schemas.PreviewTaskResponse)
+def create_preview_task(payload: schemas.AnalysisPreviewTaskRequest, db: Session = Depends(get_db)):
+    spec = _preview_spec(db, payload)
+    if spec is None:
+        raise HTTPException(400, "Only pivot previews can run as tasks")
+    def finish(result, filtered_columns, from_cube):
+        return _store_preview(spec, result, filtered_columns, from_cube, _schedule_thread)
+    return previews.runner.submit(spec, payload.session_id, finish).to_dict()
+
+@app.get("/analysis/preview/tasks/{preview_id}", response_model=schemas.PreviewTaskResponse)
+def get_preview_task(preview_id: str):
+    task = previews.runner.get(preview_id)
+    if task is None:
+        raise HTTPException(404, "Preview not found")
+    return task.to_dict()
+
+@app.delete("/analysis/preview/tasks/{preview_id}", response_model=schemas.PreviewTaskResponse)
+def cancel_preview_task(preview_id: str):
+    task = previews.runner.cancel(preview_id)
+    if task is None:
+        raise HTTPException(404, "Preview not found")
+    return task.to_dict()
+
+@app.get("/analysis/preview/tasks/{preview_id}/result")
+def get_preview_task_result(preview_id: str, accept: Optional[str] = Header(None)):
+    task = previews.runner.get(preview_id)
+    if task is None:
+        raise HTTPException(404, "Preview not found")
+    if task.status != "succeeded":
+        raise HTTPException(409, f"Preview is {task.status}")
+    stored = results.get(task.outcome["result_id"])
+    if stored is None:
+        raise HTTPException(404, "Result expired, run the preview again")
+    return _preview_response(stored, task.spec["page_size"], task.outcome, accept)
+
+# One page of a previewed result. sort: "column:asc|desc", repeatable; filter: a saved
+# filter dict as JSON (only the data rows are filtered, the grand total stays last)
+@app.get("/analysis/results/{result_id}")
+def analysis_result_page(result_id: str, page: int = Query(1, ge=1),
+                         page_size: int = Query(50, ge=1, le=results.PAGE_SIZE_MAX),
+                         sort: List[str] = Query([]), filter: Optional[str] = None,
+                         accept: Optional[str] = Header(None)):
+    stored = results.get(result_id)
+    if stored is None:
+        raise HTTPException(404, "Result expired, run the preview again")
+    try:
+        saved = json.loads(filter) if filter else None
+    except ValueError:
+        raise HTTPException(400, "filter must be JSON")
+    try:
+        cells, info = results.page(stored, page, page_size, sort, saved)
+    except filters.FilterError as e:
+        raise HTTPException(400, f"Filter Error: {e}")
+    return serialize.frame_response(cells, {"result_id": result_id, **info}, accept, "table")
+
+
+# ---------------- S3 event notifications ----------------
+# Target for S3 bucket notifications (via SNS/EventBridge/webhook): keeps each dataset's
+# latest file current without listing the prefix. Set S3_EVENTS_TOKEN to require it
+# in the X-Events-Token header.
+@app.post("/s3/events")
+def s3_events(payload: dict, db: Session = Depends(get_db), x_events_token: Optional[str] = Header(None)):
+    token = os.getenv("S3_EVENTS_TOKEN")
+    if token and x_events_token != token:
+        raise HTTPException(403, "Invalid events token")
+    updated = []
+    events = storage.parse_s3_events(payload)
+    for bucket, key, created, event_time in events:
+        for metadata in crud.apply_s3_event(db, bucket, key, created, event_time):
+            updated.append({"dataset_id": metadata.id, "latest_file": metadata.latest_file})
+    return {"events": len(events), "updated": updated}
+
+
+# ---------------- Metrics ----------------
+@app.get("/metrics/dataset-cache")
+def dataset_cache_stats():
+    return dataset_loader.cache.stats()
+
+@app.get("/metrics/db-pool")
+def db_pool_stats():
+    return pool_stats()
 
 
 # DELETE REPORT
@@ -397,21 +567,5 @@ def rename_report(report_id: int, payload: schemas.ReportRename, db: Session = D
     rep.name = new_name
     db.add(rep)
     db.commit()
-    db.refresh(rep)
-    # return new representation consistent with your /reports/{id} response
-    # For compatibility, return same structure as get_report()
-    sheets = []
-    for s in rep.sheets:
-        s_maps = s.sheet_maps
-        analyses = []
-        for m in s_maps:
-            a = crud.get_analysis(db, m.analysis_id)
-            ds = crud.get_dataset_by_id(db, a.dataset_id)
-            analyses.append({
-                "analysis_id": a.id,
-                "analysis_name": a.analysis_name,
-                "dataset_id": ds.id,
-                "dataset_name": ds.dataset_name
-            })
-        sheets.append({"sheet_id": s.id, "name": s.name, "analyses": analyses})
-    return {"report_id": rep.id, "name": rep.name, "sheets": sheets}
+    # same structure as get_report()
+    return crud.get_report_tree(db, report_id)
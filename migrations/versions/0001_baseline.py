@@ -0,0 +1,99 @@
+"""baseline: schema as created by Base.metadata.create_all before migrations
+
+Databases created before migrations existed: `alembic stamp 0001`, then `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dataset_metadata",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("dataset_name", sa.String()),
+        sa.Column("s3_bucket", sa.String(), nullable=False),
+        sa.Column("s3_key", sa.String(), nullable=False),
+        sa.Column("latest_file", sa.String(), nullable=True),
+        sa.Column("num_rows", sa.Integer()),
+        sa.Column("num_columns", sa.Integer()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.create_index("ix_dataset_metadata_id", "dataset_metadata", ["id"])
+    op.create_index("ix_dataset_metadata_dataset_name", "dataset_metadata", ["dataset_name"])
+
+    op.create_table(
+        "reports",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_index("ix_reports_id", "reports", ["id"])
+    op.create_index("ix_reports_name", "reports", ["name"], unique=True)
+
+    op.create_table(
+        "sheets",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("report_id", sa.Integer(), sa.ForeignKey("reports.id"), nullable=False),
+    )
+    op.create_index("ix_sheets_id", "sheets", ["id"])
+    op.create_index("ix_sheets_name", "sheets", ["name"])
+
+    op.create_table(
+        "analyses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("dataset_id", sa.Integer(), sa.ForeignKey("dataset_metadata.id"), nullable=False),
+        sa.Column("analysis_name", sa.String(), nullable=False),
+        sa.Column("analysis_type", sa.String(), nullable=False),
+        sa.Column("config", sa.JSON()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_analyses_id", "analyses", ["id"])
+
+    op.create_table(
+        "sheet_analysis_map",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("sheet_id", sa.Integer(), sa.ForeignKey("sheets.id"), nullable=False),
+        sa.Column("analysis_id", sa.Integer(), sa.ForeignKey("analyses.id"), nullable=False),
+    )
+    op.create_index("ix_sheet_analysis_map_id", "sheet_analysis_map", ["id"])
+
+    op.create_table(
+        "calculated_fields",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("analysis_id", sa.Integer(), sa.ForeignKey("analyses.id"), nullable=False),
+        sa.Column("dataset_id", sa.Integer(), sa.ForeignKey("dataset_metadata.id"), nullable=False),
+        sa.Column("field_name", sa.String(), nullable=False),
+        sa.Column("formula", sa.String(), nullable=False),
+        sa.Column("default_agg", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_calculated_fields_id", "calculated_fields", ["id"])
+
+    op.create_table(
+        "filters",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("analysis_id", sa.Integer(), sa.ForeignKey("analyses.id"), nullable=False),
+        sa.Column("dataset_id", sa.Integer(), sa.ForeignKey("dataset_metadata.id"), nullable=False),
+        sa.Column("selected_columns", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_filters_id", "filters", ["id"])
+
+
+def downgrade():
+    for table in ("filters", "calculated_fields", "sheet_analysis_map", "analyses", "sheets", "reports",
+                  "dataset_metadata"):
+        op.drop_table(table)
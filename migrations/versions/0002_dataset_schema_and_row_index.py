@@ -0,0 +1,25 @@
+"""dataset_metadata.column_schema and row_index
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("dataset_metadata") as batch:
+        batch.add_column(sa.Column("column_schema", sa.JSON(), nullable=True))
+        batch.add_column(sa.Column("row_index", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("dataset_metadata") as batch:
+        batch.drop_column("row_index")
+        batch.drop_column("column_schema")
@@ -0,0 +1,41 @@
+"""indexes for foreign-key lookups and one saved filter per (dataset, analysis)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_analyses_dataset_id", "analyses", ["dataset_id"]),
+    ("ix_sheets_report_id", "sheets", ["report_id"]),
+    ("ix_sheet_analysis_map_sheet_id", "sheet_analysis_map", ["sheet_id"]),
+    ("ix_sheet_analysis_map_analysis_id", "sheet_analysis_map", ["analysis_id"]),
+    ("ix_calculated_fields_analysis_id", "calculated_fields", ["analysis_id"]),
+    ("ix_filters_analysis_id", "filters", ["analysis_id"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+    # save_filter used to be able to race into duplicates; keep the newest row of each pair
+    op.execute(
+        "DELETE FROM filters WHERE id NOT IN "
+        "(SELECT max_id FROM (SELECT MAX(id) AS max_id FROM filters GROUP BY dataset_id, analysis_id) AS newest)"
+    )
+    with op.batch_alter_table("filters") as batch:
+        batch.create_unique_constraint("uq_filters_dataset_analysis", ["dataset_id", "analysis_id"])
+
+
+def downgrade():
+    with op.batch_alter_table("filters") as batch:
+        batch.drop_constraint("uq_filters_dataset_analysis", type_="unique")
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,23 @@
+"""dataset_metadata.dtype_plan
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("dataset_metadata") as batch:
+        batch.add_column(sa.Column("dtype_plan", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("dataset_metadata") as batch:
+        batch.drop_column("dtype_plan")
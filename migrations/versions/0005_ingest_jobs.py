@@ -0,0 +1,41 @@
+"""ingest_jobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ingest_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("dataset_id", sa.Integer(), sa.ForeignKey("dataset_metadata.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("progress", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_ingest_jobs_id", "ingest_jobs", ["id"])
+    op.create_index("ix_ingest_jobs_dataset_id", "ingest_jobs", ["dataset_id"])
+    op.create_index("ix_ingest_jobs_status", "ingest_jobs", ["status"])
+
+
+def downgrade():
+    op.drop_index("ix_ingest_jobs_status", table_name="ingest_jobs")
+    op.drop_index("ix_ingest_jobs_dataset_id", table_name="ingest_jobs")
+    op.drop_index("ix_ingest_jobs_id", table_name="ingest_jobs")
+    op.drop_table("ingest_jobs")
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -14,6 +14,12 @@ class DatasetMetadata(Base):
     latest_file = Column(String, nullable=True)
     num_rows = Column(Integer)
     num_columns = Column(Integer)
+    # [{"name": ..., "dtype": ...}] of latest_file, probed without reading the data
+    column_schema = Column(JSON, nullable=True)
+    # sparse byte-offset index of latest_file's CSV rows (see pagination.build_csv_row_index)
+    row_index = Column(JSON, nullable=True)
+    # per-column dtype plan of latest_file, profiled once and applied on every read (see dtypes.py)
+    dtype_plan = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -35,7 +41,7 @@ class Sheet(Base):
     __tablename__ = "sheets"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False, index=True)
-    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False)
+    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False, index=True)
 
     report = relationship("Report", back_populates="sheets")
     sheet_maps = relationship("SheetAnalysisMap", back_populates="sheet", cascade="all, delete")
@@ -45,8 +51,8 @@ class Sheet(Base):
 class SheetAnalysisMap(Base):
     __tablename__ = "sheet_analysis_map"
     id = Column(Integer, primary_key=True, index=True)
-    sheet_id = Column(Integer, ForeignKey("sheets.id"), nullable=False)
-    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False)
+    sheet_id = Column(Integer, ForeignKey("sheets.id"), nullable=False, index=True)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False, index=True)
 
     sheet = relationship("Sheet", back_populates="sheet_maps")
     analysis = relationship("Analysis", back_populates="sheet_links")
@@ -56,7 +62,7 @@ class SheetAnalysisMap(Base):
 class Analysis(Base):
     __tablename__ = "analyses"
     id = Column(Integer, primary_key=True, index=True)
-    dataset_id = Column(Integer, ForeignKey("dataset_metadata.id"), nullable=False)
+    dataset_id = Column(Integer, ForeignKey("dataset_metadata.id"), nullable=False, index=True)
     analysis_name = Column(String, nullable=False)
     analysis_type = Column(String, nullable=False)  # e.g., "pivot", "bar"
     config = Column(JSON, default={})
@@ -73,7 +79,7 @@ class Analysis(Base):
 class CalculatedField(Base):
     __tablename__ = "calculated_fields"
     id = Column(Integer, primary_key=True, index=True)
-    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False, index=True)
     dataset_id = Column(Integer, ForeignKey("dataset_metadata.id"), nullable=False)
     field_name = Column(String, nullable=False)
     formula = Column(String, nullable=False)
@@ -87,11 +93,33 @@ class CalculatedField(Base):
 # or a dict mapping column->list-of-values ({"col1":["a","b"], "col2":[..]})
 class FilterSelection(Base):
     __tablename__ = "filters"
+    # one saved filter per (dataset, analysis); also the index for looking it up
+    __table_args__ = (UniqueConstraint("dataset_id", "analysis_id", name="uq_filters_dataset_analysis"),)
     id = Column(Integer, primary_key=True, index=True)
-    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=False, index=True)
     dataset_id = Column(Integer, ForeignKey("dataset_metadata.id"), nullable=False)
     selected_columns = Column(JSON, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     analysis = relationship("Analysis", back_populates="filters")
+
+
+# Background ingestion jobs (see jobs.py): registering a dataset and refreshing its
+# latest_file run here instead of inside the request
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # "register" or "refresh"
+    dataset_id = Column(Integer, ForeignKey("dataset_metadata.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, succeeded, failed
+    progress = Column(Integer, nullable=False, default=0)  # percent
+    # {"every_seconds": n} re-queues a refresh that many seconds after each run
+    payload = Column(JSON, default={})
+    error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    # last sign of life of a running job (progress or the dispatcher); stale ones are re-queued
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
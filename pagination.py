@@ -0,0 +1,161 @@
+# pagination.py
+import io
+import os
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import dataset_loader
+import dtypes
+import snapshots
+
+# one byte offset is kept for every CSV_INDEX_STRIDE data rows
+CSV_INDEX_STRIDE = int(os.getenv("CSV_INDEX_STRIDE", "10000"))
+CSV_INDEX_CHUNK_BYTES = 8 * 1024 * 1024
+PARQUET_FOOTER_BUFFER = 64 * 1024
+
+
+# Serve rows [start, start + limit) without materializing the dataset, with the dataset's
+# dtype plan applied whichever source the page came from.
+# Returns (page, total_rows, row_index); row_index is only set for CSV sources and
+# should be persisted by the caller and handed back on the next call.
+def read_page(client, bucket: str, key: str, start: int, limit: int,
+              row_index: Optional[Dict[str, Any]] = None,
+              dtype_plan: Optional[Dict[str, Any]] = None) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    page, total, row_index = _read_page(client, bucket, key, start, limit, row_index)
+    return dtypes.apply_plan(page, dtype_plan), total, row_index
+
+
+def _read_page(client, bucket: str, key: str, start: int, limit: int,
+               row_index: Optional[Dict[str, Any]]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    version = dataset_loader.object_version(client, bucket, key)
+    table = snapshots.open_snapshot(bucket, key, version)
+    if table is not None:
+        return table.slice(start, limit).to_pandas(), table.num_rows, row_index
+    if key.endswith(".parquet"):
+        page, total = _parquet_page(client, bucket, key, start, limit)
+        return page, total, row_index
+    if key.endswith(".csv"):
+        if not row_index or row_index.get("version") != version:
+            row_index = build_csv_row_index(client, bucket, key, version)
+        return _csv_page(client, bucket, key, start, limit, row_index), row_index["total_rows"], row_index
+    # Excel has no seekable layout: parse once, every later page comes from the snapshot
+    table = dataset_loader.load_table(client, bucket, key)
+    if table is not None:
+        return table.slice(start, limit).to_pandas(), table.num_rows, row_index
+    df = dataset_loader.load_dataset(client, bucket, key)
+    return df.iloc[start:start + limit], len(df), row_index
+
+
+# Only the footer and the row groups overlapping the page are fetched
+def _parquet_page(client, bucket: str, key: str, start: int, limit: int) -> Tuple[pd.DataFrame, int]:
+    source = io.BufferedReader(dataset_loader.S3RangeFile(client, bucket, key), buffer_size=PARQUET_FOOTER_BUFFER)
+    with source:
+        pf = pq.ParquetFile(source)
+        total = pf.metadata.num_rows
+        groups = []
+        group_start = 0
+        first_row = 0
+        for i in range(pf.metadata.num_row_groups):
+            n = pf.metadata.row_group(i).num_rows
+            if group_start + n > start and group_start < start + limit:
+                if not groups:
+                    first_row = group_start
+                groups.append(i)
+            group_start += n
+        if not groups:
+            return pf.schema_arrow.empty_table().to_pandas(), total
+        table = pf.read_row_groups(groups)
+    return table.slice(start - first_row, limit).to_pandas(), total
+
+
+# Scan the CSV once and record the byte offset of every CSV_INDEX_STRIDE-th data row.
+# Newlines inside quoted fields and blank lines are not row boundaries.
+def build_csv_row_index(client, bucket: str, key: str, version: str) -> Dict[str, Any]:
+    body = client.get_object(Bucket=bucket, Key=key)["Body"]
+    offsets: List[int] = []
+    header_end = None
+    rows = 0
+    in_quotes = False
+    base = 0
+    line_start = 0
+    tail = b""
+    head = b""
+    for chunk in body.iter_chunks(CSV_INDEX_CHUNK_BYTES):
+        if header_end is None:
+            head += chunk
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        quotes = np.flatnonzero(buf == 34)
+        if len(quotes):
+            # a newline ends a row only when an even number of quotes precede it
+            before = np.searchsorted(quotes, newlines) + int(in_quotes)
+            newlines = newlines[before % 2 == 0]
+            in_quotes = (len(quotes) + int(in_quotes)) % 2 == 1
+        elif in_quotes:
+            newlines = newlines[:0]
+        for pos in (newlines + base).tolist():
+            if header_end is None:
+                header_end = pos + 1
+            elif not _is_blank(chunk, tail, base, line_start, pos):
+                if rows % CSV_INDEX_STRIDE == 0:
+                    offsets.append(line_start)
+                rows += 1
+            line_start = pos + 1
+        base += len(chunk)
+        tail = chunk[-2:]
+    size = base
+    # last row without a trailing newline
+    if header_end is not None and line_start < size and not (size - line_start == 1 and tail[-1:] == b"\r"):
+        if rows % CSV_INDEX_STRIDE == 0:
+            offsets.append(line_start)
+        rows += 1
+    head = head[:header_end or size]
+    try:
+        header = pd.read_csv(BytesIO(head), nrows=0, encoding="utf-8")
+    except UnicodeDecodeError:
+        header = pd.read_csv(BytesIO(head), nrows=0, encoding="latin1")
+    return {
+        "version": version,
+        "stride": CSV_INDEX_STRIDE,
+        "size": size,
+        "total_rows": rows,
+        "columns": [str(c) for c in header.columns],
+        "offsets": offsets,
+    }
+
+
+def _is_blank(chunk: bytes, tail: bytes, base: int, line_start: int, pos: int) -> bool:
+    length = pos - line_start
+    if length == 0:
+        return True
+    if length == 1:
+        rel = line_start - base
+        prev = chunk[rel:rel + 1] if rel >= 0 else tail[rel:][:1]
+        return prev == b"\r"
+    return False
+
+
+def _csv_page(client, bucket: str, key: str, start: int, limit: int, row_index: Dict[str, Any]) -> pd.DataFrame:
+    columns = row_index["columns"]
+    total = row_index["total_rows"]
+    if start >= total or limit <= 0:
+        return pd.DataFrame(columns=columns)
+    stride = row_index["stride"]
+    offsets = row_index["offsets"]
+    first = start // stride
+    last = (min(start + limit, total) - 1) // stride + 1
+    begin = offsets[first]
+    end = offsets[last] if last < len(offsets) else row_index["size"]
+    raw = dataset_loader.S3RangeFile(client, bucket, key, row_index["size"]).read_range(begin, end)
+    # skip inside the parsed rows rather than with skiprows, which counts raw lines
+    skip = start - first * stride
+    kwargs = dict(header=None, names=columns, nrows=skip + limit)
+    try:
+        rows = pd.read_csv(BytesIO(raw), encoding="utf-8", **kwargs)
+    except UnicodeDecodeError:
+        rows = pd.read_csv(BytesIO(raw), encoding="latin1", **kwargs)
+    return rows.iloc[skip:].reset_index(drop=True)
@@ -0,0 +1,254 @@
+# pivot.py
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MARGINS_NAME = "Total"
+SUBTOTAL_NAME = "Subtotal"
+
+# Aggregations computed from mergeable partials: one groupby pass over the raw rows
+# produces the partials at the finest grain (rows + columns); every margin is then a
+# re-aggregation of those partials instead of another scan.
+# requested agg -> partial kinds it needs
+NEEDS = {
+    "sum": ("sum",),
+    "count": ("count",),
+    "min": ("min",),
+    "max": ("max",),
+    "mean": ("sum", "count"),
+}
+# how partials of each kind combine; "size" (rows per group) is always kept so that a
+# grouping exists even when every value needs the raw rows
+MERGE = {"sum": "sum", "count": "sum", "min": "min", "max": "max", "size": "sum"}
+GROUP_SIZE = "\x1fsize"
+
+
+def partial_name(column: str, kind: str) -> str:
+    return f"{column}\x1f{kind}"
+
+
+def is_mergeable(agg_dict: Dict[str, str]) -> bool:
+    return all(agg in NEEDS for agg in agg_dict.values())
+
+
+# Partials of `measures` grouped by `dims`, as a flat frame (dims as columns)
+def partials(df: pd.DataFrame, dims: List[str], measures: Dict[str, Tuple[str, ...]], dropna: bool = True) -> pd.DataFrame:
+    named = {
+        partial_name(column, kind): pd.NamedAgg(column=column, aggfunc=kind)
+        for column, kinds in measures.items() for kind in kinds
+    }
+    grouped = df.groupby(dims, sort=False, dropna=dropna, observed=True)
+    out = grouped.agg(**named) if named else pd.DataFrame(index=grouped.size().index)
+    out[GROUP_SIZE] = grouped.size()
+    return out.reset_index()
+
+
+class PivotResult:
+    def __init__(self, frame: pd.DataFrame, row_types: List[str]):
+        # flattened columns: row dimensions, then "<value>[_<column values>]" cells
+        self.frame = frame
+        # "data", "subtotal" or "total" per row, so totals never need to be guessed from labels
+        self.row_types = row_types
+
+
+class _Levels:
+    # Aggregated values per grouping level, from partials (mergeable aggs) and, for
+    # anything else, directly from the raw rows.
+    def __init__(self, finest: pd.DataFrame, dims: List[str], agg_dict: Dict[str, str], raw: Optional[pd.DataFrame]):
+        self.finest = finest
+        self.dims = dims
+        self.agg_dict = agg_dict
+        self.raw = raw
+
+    def at(self, level: List[str]) -> pd.DataFrame:
+        out = {}
+        merged = self._merge(level)
+        for column, agg in self.agg_dict.items():
+            if agg in NEEDS:
+                if agg == "mean":
+                    out[column] = merged[partial_name(column, "sum")] / merged[partial_name(column, "count")]
+                else:
+                    out[column] = merged[partial_name(column, agg)]
+            else:
+                out[column] = self._direct(level, column, agg)
+        if level:
+            return pd.DataFrame(out)
+        return pd.DataFrame({k: [v.iloc[0] if isinstance(v, pd.Series) else v] for k, v in out.items()})
+
+    def _merge(self, level: List[str]) -> pd.DataFrame:
+        rules = {c: MERGE[c.rsplit("\x1f", 1)[1]] for c in self.finest.columns if "\x1f" in c}
+        if level == self.dims:
+            return self.finest[list(rules)].sort_index()
+        if level:
+            return self.finest.groupby(level=level, sort=True, observed=True).agg(rules)
+        return self.finest.agg(rules).to_frame().T
+
+    def _direct(self, level: List[str], column: str, agg: str):
+        raw = self.raw
+        if raw is None:
+            raise ValueError(f"Aggregation '{agg}' needs the raw rows")
+        if level:
+            return raw.groupby(level, sort=True, observed=True)[column].agg(agg)
+        # grand total: only rows that belong to some group
+        keep = raw[self.dims].notna().all(axis=1) if self.dims else slice(None)
+        return pd.Series([raw.loc[keep, column].agg(agg)])
+
+
+def _default_values(df: pd.DataFrame, dims: List[str]) -> Dict[str, str]:
+    # pivot_table(values=None): every numeric column that isn't a dimension, summed
+    return {c: "sum" for c in df.select_dtypes("number").columns if c not in dims}
+
+
+def pivot(df: pd.DataFrame, rows: List[str], columns: List[str], agg_dict: Dict[str, str],
+          subtotals: bool = False) -> PivotResult:
+    dims = list(dict.fromkeys(rows + columns))
+    agg_dict = dict(agg_dict) if agg_dict else _default_values(df, dims)
+    measures = {c: NEEDS[a] for c, a in agg_dict.items() if a in NEEDS}
+    if dims:
+        finest = partials(df, dims, measures).set_index(dims)
+    else:
+        finest = partials(df.assign(_all=0), ["_all"], measures).drop(columns="_all")
+    raw = df if not is_mergeable(agg_dict) else None
+    return _assemble(_Levels(finest, dims, agg_dict, raw), rows, columns, subtotals)
+
+
+# Pivot from precomputed partials (e.g. a materialized cube) grouped by a superset of
+# rows + columns; only mergeable aggregations are possible here
+def pivot_partials(data: pd.DataFrame, rows: List[str], columns: List[str], agg_dict: Dict[str, str],
+                   subtotals: bool = False) -> PivotResult:
+    if not is_mergeable(agg_dict):
+        raise ValueError("Only sum, count, min, max and mean can be answered from partials")
+    dims = list(dict.fromkeys(rows + columns))
+    needed = [partial_name(c, k) for c, a in agg_dict.items() for k in NEEDS[a]]
+    if GROUP_SIZE in data.columns:
+        needed.append(GROUP_SIZE)
+    rules = {name: MERGE[name.rsplit("\x1f", 1)[1]] for name in dict.fromkeys(needed)}
+    finest = data.groupby(dims, sort=False, dropna=True, observed=True).agg(rules)
+    return _assemble(_Levels(finest, dims, agg_dict, None), rows, columns, subtotals)
+
+
+def _assemble(levels: _Levels, rows: List[str], columns: List[str], subtotals: bool) -> PivotResult:
+    values = sorted(levels.agg_dict)
+    if columns:
+        col_margin = levels.at(columns)[values]
+        grand = levels.at([])[values]
+        if rows:
+            wide = levels.at(rows + columns)[values].unstack(columns)
+            # all-empty data rows are dropped, as pivot_table(dropna=True) does
+            wide = wide.dropna(how="all")
+            row_margin = levels.at(rows)[values].reindex(wide.index)
+        labels = _column_labels(col_margin.index)
+        frames, types = [], []
+        if rows:
+            body = _wide_block(wide, values, labels, row_margin)
+            frames.append(_with_keys(body, rows, wide.index))
+            types += ["data"] * len(body)
+            if subtotals and len(rows) > 1:
+                frames, types = _insert_subtotals(levels, rows, columns, values, labels, frames[0])
+        total = _total_row(col_margin, grand, values, labels)
+        frames.append(_with_total_keys(total, rows))
+        types.append("total")
+    else:
+        if rows:
+            wide = levels.at(rows)[values].dropna(how="all")
+            frames = [_with_keys(wide.reset_index(drop=True), rows, wide.index)]
+            types = ["data"] * len(wide)
+            if subtotals and len(rows) > 1:
+                frames, types = _insert_subtotals(levels, rows, [], values, None, frames[0])
+        else:
+            frames, types = [], []
+        grand = levels.at([])[values]
+        frames.append(_with_total_keys(grand.reset_index(drop=True), rows))
+        types.append("total")
+    frame = pd.concat(frames, ignore_index=True)
+    # columns that are empty everywhere are dropped, as pivot_table(dropna=True) does
+    key_cols = list(rows)
+    value_cols = [c for c in frame.columns if c not in key_cols]
+    frame = frame[key_cols + [c for c in value_cols if frame[c].notna().any()]]
+    return PivotResult(frame, types)
+
+
+def _column_labels(index: pd.Index) -> List[Tuple]:
+    return [k if isinstance(k, tuple) else (k,) for k in index]
+
+
+def _label(x) -> str:
+    # dates parsed at ingestion read as before ("2024-01-31", not "2024-01-31 00:00:00")
+    if isinstance(x, pd.Timestamp) and x == x.normalize():
+        return x.strftime("%Y-%m-%d")
+    return str(x)
+
+
+def _flat(value: str, label: Tuple) -> str:
+    return "_".join([str(value)] + [_label(x) for x in label if x not in ["", None]])
+
+
+def _wide_block(wide: pd.DataFrame, values: List[str], labels: List[Tuple], row_margin: pd.DataFrame) -> pd.DataFrame:
+    out = {}
+    for value in values:
+        for label in labels:
+            key = (value,) + label
+            out[_flat(value, label)] = wide[key].to_numpy() if key in wide.columns else np.nan
+        out[_flat(value, (MARGINS_NAME,))] = row_margin[value].to_numpy()
+    return pd.DataFrame(out)
+
+
+def _total_row(col_margin: pd.DataFrame, grand: pd.DataFrame, values: List[str], labels: List[Tuple]) -> pd.DataFrame:
+    out = {}
+    for value in values:
+        series = col_margin[value]
+        for label, cell in zip(labels, series.to_numpy()):
+            out[_flat(value, label)] = [cell]
+        out[_flat(value, (MARGINS_NAME,))] = [grand[value].iloc[0]]
+    return pd.DataFrame(out)
+
+
+def _with_keys(body: pd.DataFrame, rows: List[str], index: pd.Index) -> pd.DataFrame:
+    keys = index.to_frame(index=False) if isinstance(index, pd.MultiIndex) else pd.DataFrame({rows[0]: index.to_numpy()})
+    keys.columns = rows
+    for name in rows:
+        if pd.api.types.is_datetime64_any_dtype(keys[name]):
+            keys[name] = keys[name].map(_label)
+    return pd.concat([keys.reset_index(drop=True), body.reset_index(drop=True)], axis=1)
+
+
+def _with_total_keys(body: pd.DataFrame, rows: List[str]) -> pd.DataFrame:
+    keys = {r: [MARGINS_NAME if i == 0 else ""] for i, r in enumerate(rows)}
+    return pd.concat([pd.DataFrame(keys), body.reset_index(drop=True)], axis=1)
+
+
+# Subtotal rows after each group of every row level but the last, labelled "Subtotal" at
+# the first rolled-up level
+def _insert_subtotals(levels: _Levels, rows: List[str], columns: List[str], values: List[str],
+                      labels: Optional[List[Tuple]], data: pd.DataFrame):
+    # data rows keep their (sorted) order; a subtotal follows the last row of its group,
+    # deepest groups first: every row is ordered by (data row, rank), rank 0 for data
+    keys = data[rows].to_numpy()
+    changed = keys[1:] != keys[:-1]
+    frames, positions, ranks = [data], [np.arange(len(data))], [np.zeros(len(data), dtype=int)]
+    for depth in range(1, len(rows)):
+        prefix = rows[:depth]
+        if columns:
+            sub = levels.at(prefix + columns)[values].unstack(columns)
+            margin = levels.at(prefix)[values].reindex(sub.index)
+            block = _wide_block(sub, values, labels, margin)
+        else:
+            sub = levels.at(prefix)[values]
+            block = sub.reset_index(drop=True)
+        block = _with_keys(block, prefix, sub.index)
+        for j, name in enumerate(rows[depth:]):
+            block[name] = SUBTOTAL_NAME if j == 0 else ""
+        found = {record: i for i, record in enumerate(block[prefix].itertuples(index=False, name=None))}
+        # last data row of each group at this depth, and its subtotal (if there is one)
+        ends = np.flatnonzero(np.append(changed[:, :depth].any(axis=1), True)) if len(data) else np.arange(0)
+        picks = [found.get(record, -1) for record in data[prefix].iloc[ends].itertuples(index=False, name=None)]
+        picks = np.asarray(picks, dtype=int)
+        frames.append(block.iloc[picks[picks >= 0]][list(data.columns)])
+        positions.append(ends[picks >= 0])
+        ranks.append(np.full(int((picks >= 0).sum()), len(rows) - depth))
+    rank = np.concatenate(ranks)
+    order = np.lexsort((rank, np.concatenate(positions)))
+    frame = pd.concat(frames, ignore_index=True).iloc[order].reset_index(drop=True)
+    types = np.where(rank[order] == 0, "data", "subtotal").tolist()
+    return [frame], types
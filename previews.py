@@ -0,0 +1,291 @@
+# previews.py
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import crud
+import cube
+import dataset_loader
+import filters
+import formula
+import pivot
+
+logger = logging.getLogger(__name__)
+
+# child processes computing previews; a running preview is cancelled by killing its worker
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+# every worker keeps its own dataset cache; together they stay within DATASET_CACHE_MAX_BYTES
+PREVIEW_WORKER_CACHE_BYTES = int(os.getenv("PREVIEW_WORKER_CACHE_BYTES",
+                                           str(dataset_loader.DATASET_CACHE_MAX_BYTES // max(PREVIEW_WORKERS, 1))))
+# finished previews stay visible to status polls this long
+PREVIEW_TASK_TTL = float(os.getenv("PREVIEW_TASK_TTL", "600"))
+
+ACTIVE = ("queued", "running")
+
+
+class PreviewError(ValueError):
+    pass
+
+
+# The pivot of a preview from its spec (everything read from the database up front, see
+# main._preview_spec), so it can run in this process or a worker. Returns the result,
+# the filtered columns and whether a cube answered it.
+def compute(spec: Dict[str, Any],
+            progress: Optional[Callable[[int, str], None]] = None) -> Tuple[pivot.PivotResult, List[str], bool]:
+    progress = progress or (lambda percent, stage: None)
+    rows, columns, agg_dict = spec["rows"], spec["columns"], spec["agg_dict"]
+    saved = spec["saved"]
+    # Answer from a materialized cube when the grouping is a roll-up of a saved analysis
+    if rows:
+        progress(5, "cube")
+        cube_data = cube.find(spec["dataset_id"], spec["sig"], list(dict.fromkeys(rows + columns)), agg_dict)
+        if cube_data is not None:
+            try:
+                result = pivot.pivot_partials(cube_data, rows, columns, agg_dict, spec["subtotals"])
+                filtered_columns = list(dict.fromkeys(p.column for p in filters.compile_filter(saved)))
+                return result, filtered_columns, True
+            except Exception:
+                pass
+
+    progress(10, "loading")
+    plan = formula.plan_fields(spec["formulas"], spec["schema_columns"], spec["requested"])
+    try:
+        # shallow copy: calculated fields are added as new columns without touching the cached frame
+        df = crud.fetch_filtered_dataset_from_s3(spec["bucket"], spec["key"], saved,
+                                                 spec["needed"], spec["dtype_plan"]).copy(deep=False)
+    except ValueError as e:
+        raise PreviewError(str(e))
+    progress(50, "calculated fields")
+    try:
+        for name, values in plan.evaluate(df, spec["dtype_plan"]).items():
+            df[name] = values
+    except formula.FormulaError as e:
+        raise PreviewError(f"Formula Error in {e}")
+
+    # Apply saved filters (list of cols, or dict col -> values/conditions) as one mask
+    progress(60, "filtering")
+    try:
+        df, filtered_columns = filters.apply_saved_filter(df, saved, rows, columns)
+    except filters.FilterError as e:
+        raise PreviewError(f"Filter Error: {e}")
+
+    progress(70, "pivoting")
+    try:
+        result = pivot.pivot(df, rows, columns, agg_dict, spec["subtotals"])
+    except Exception as e:
+        raise PreviewError(f"Pivot Error: {e}")
+    return result, filtered_columns, False
+
+
+# Worker process loop: one spec in, progress messages and one outcome out
+def _serve(conn, cache_bytes: int):
+    dataset_loader.cache.max_bytes = cache_bytes
+    while True:
+        try:
+            spec = conn.recv()
+        except EOFError:
+            return
+        try:
+            outcome = compute(spec, lambda percent, stage: conn.send(("progress", percent, stage)))
+            conn.send(("done", outcome))
+        except Exception as e:
+            conn.send(("error", str(e) or type(e).__name__))
+
+
+class _Worker:
+    # one child process, started on first use and again after it was killed
+    def __init__(self, context):
+        self._context = context
+        self._process = None
+        self._conn = None
+
+    def run(self, spec: Dict[str, Any], progress: Callable[[int, str], None]):
+        if self._process is None or not self._process.is_alive():
+            conn, child = self._context.Pipe()
+            process = self._context.Process(target=_serve, args=(child, PREVIEW_WORKER_CACHE_BYTES),
+                                            name="preview-worker", daemon=True)
+            process.start()
+            child.close()
+            self._process, self._conn = process, conn
+        try:
+            self._conn.send(spec)
+            while True:
+                message = self._conn.recv()
+                if message[0] == "progress":
+                    progress(message[1], message[2])
+                elif message[0] == "done":
+                    return message[1]
+                else:
+                    raise PreviewError(message[1])
+        except (EOFError, OSError):
+            # killed (cancelled) or crashed: the next run starts a fresh process
+            self.kill()
+            raise
+
+    # only signals the process; run() notices and cleans up
+    def terminate(self):
+        if self._process is not None:
+            self._process.terminate()
+
+    def kill(self):
+        process, self._process = self._process, None
+        if process is not None:
+            process.terminate()
+            process.join()
+
+
+class PreviewTask:
+    def __init__(self, spec: Dict[str, Any], key: Optional[Tuple], finish: Callable[..., Dict[str, Any]]):
+        self.id = uuid.uuid4().hex
+        self.spec = spec
+        self.key = key
+        self.finish = finish
+        self.status = "queued"
+        self.progress = 0
+        self.stage = "queued"
+        self.error: Optional[str] = None
+        # what finish() returned (result id, counts) once the preview succeeded
+        self.outcome: Dict[str, Any] = {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.worker: Optional[_Worker] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"preview_id": self.id, "status": self.status, "progress": self.progress, "stage": self.stage,
+                "error": self.error, **self.outcome}
+
+
+# Bounded pool of preview workers fed from one queue. A preview submitted for the same
+# (session, analysis) as an unfinished one cancels it: queued ones are skipped, running
+# ones have their worker process killed. Task state lives in this process only.
+class PreviewRunner:
+    def __init__(self, workers: int):
+        self.workers = workers
+        # fresh interpreters rather than forks of the threaded API process; preloading this
+        # module makes starting one cheap
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload([__name__])
+        self._queue: "queue.Queue[Optional[PreviewTask]]" = queue.Queue()
+        self._tasks: Dict[str, PreviewTask] = {}
+        self._latest: Dict[Tuple, PreviewTask] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._slots: List[_Worker] = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                worker = _Worker(self._context)
+                thread = threading.Thread(target=self._serve, args=(worker,), name=f"preview-{i}", daemon=True)
+                self._slots.append(worker)
+                self._threads.append(thread)
+                thread.start()
+
+    def stop(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            slots, self._slots = self._slots, []
+            for task in self._tasks.values():
+                self._cancel(task)
+        for _ in threads:
+            self._queue.put(None)
+        for worker in slots:
+            worker.terminate()
+        for thread in threads:
+            thread.join()
+        for worker in slots:
+            worker.kill()
+
+    def submit(self, spec: Dict[str, Any], session_id: Optional[str],
+               finish: Callable[..., Dict[str, Any]]) -> PreviewTask:
+        self.start()
+        key = (session_id, spec["analysis_id"]) if session_id else None
+        task = PreviewTask(spec, key, finish)
+        with self._lock:
+            self._prune()
+            if key is not None:
+                previous = self._latest.get(key)
+                if previous is not None:
+                    self._cancel(previous)
+                self._latest[key] = task
+            self._tasks[task.id] = task
+        self._queue.put(task)
+        return task
+
+    def get(self, preview_id: str) -> Optional[PreviewTask]:
+        with self._lock:
+            return self._tasks.get(preview_id)
+
+    def cancel(self, preview_id: str) -> Optional[PreviewTask]:
+        with self._lock:
+            task = self._tasks.get(preview_id)
+            if task is not None:
+                self._cancel(task)
+            return task
+
+    # caller holds the lock
+    def _cancel(self, task: PreviewTask):
+        if task.status not in ACTIVE:
+            return
+        if task.status == "running" and task.worker is not None:
+            task.worker.terminate()
+        task.status = task.stage = "cancelled"
+        task.finished_at = time.time()
+
+    def _prune(self):
+        cutoff = time.time() - PREVIEW_TASK_TTL
+        for task_id, task in list(self._tasks.items()):
+            if task.finished_at is not None and task.finished_at < cutoff:
+                del self._tasks[task_id]
+                if task.key is not None and self._latest.get(task.key) is task:
+                    del self._latest[task.key]
+
+    def _serve(self, worker: _Worker):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            with self._lock:
+                if task.status != "queued":
+                    continue
+                task.status = task.stage = "running"
+                task.worker = worker
+            try:
+                result, filtered_columns, from_cube = worker.run(task.spec, lambda p, s: self._report(task, p, s))
+                if task.status != "running":
+                    continue
+                outcome = task.finish(result, filtered_columns, from_cube)
+            except Exception as e:
+                if not isinstance(e, (PreviewError, EOFError, OSError)):
+                    logger.exception("preview %s failed", task.id)
+                self._done(task, "failed", error=str(e) or "Preview worker exited")
+            else:
+                self._done(task, "succeeded", outcome=outcome)
+
+    def _report(self, task: PreviewTask, percent: int, stage: str):
+        with self._lock:
+            if task.status == "running":
+                task.progress, task.stage = percent, stage
+
+    def _done(self, task: PreviewTask, status: str, error: Optional[str] = None,
+              outcome: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            task.worker = None
+            # a cancelled task keeps its status, whatever its worker managed to send back
+            if task.status != "running":
+                return
+            task.status = task.stage = status
+            task.error = error
+            task.outcome = outcome or {}
+            task.progress = 100 if status == "succeeded" else task.progress
+            task.finished_at = time.time()
+
+
+runner = PreviewRunner(PREVIEW_WORKERS)
@@ -0,0 +1,87 @@
+# results.py
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import filters
+from dataset_loader import DataFrameCache
+from pivot import PivotResult
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# row type of each stored row, kept alongside the cells (can't clash with a pivot column)
+ROW_TYPE = "\x1frow_type"
+# largest page a client can ask for
+PAGE_SIZE_MAX = 1000
+
+# Pivot results kept by id, so the preview grid can fetch one page at a time (sorted and
+# filtered here) instead of the browser receiving every row. Bounded by memory like the
+# dataset cache; an evicted id has to be previewed again.
+cache = DataFrameCache(RESULT_CACHE_MAX_BYTES)
+
+
+# the result's cells plus its row types, as stored and paged
+def frame(result: PivotResult) -> pd.DataFrame:
+    out = result.frame.copy(deep=False)
+    out[ROW_TYPE] = result.row_types
+    return out
+
+
+def put(stored: pd.DataFrame) -> str:
+    result_id = uuid.uuid4().hex
+    cache.put((result_id,), stored)
+    return result_id
+
+
+def get(result_id: str) -> Optional[pd.DataFrame]:
+    return cache.get((result_id,))
+
+
+def _sort_keys(sort: List[str], columns: List[str]) -> Tuple[List[str], List[bool]]:
+    by, ascending = [], []
+    for item in sort:
+        column, _, direction = item.rpartition(":")
+        if not column:
+            column, direction = direction, "asc"
+        if column not in columns:
+            raise filters.FilterError(f"Unknown sort column '{column}'")
+        if direction not in ("asc", "desc"):
+            raise filters.FilterError(f"Unknown sort direction '{direction}'")
+        by.append(column)
+        ascending.append(direction == "asc")
+    return by, ascending
+
+
+# One page of a stored result, as (cells, page info): sort items are "column[:asc|desc]", the filter is a saved
+# filter dict (see filters.py). The grand total stays last; subtotal rows only make sense
+# next to their complete, unsorted group, so they are dropped while sorting or filtering.
+def page(frame: pd.DataFrame, page: int, page_size: int, sort: Optional[List[str]] = None,
+         saved_filter: Any = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    columns = [c for c in frame.columns if c != ROW_TYPE]
+    preds = filters.compile_filter(saved_filter)
+    by, ascending = _sort_keys(sort or [], columns)
+    if preds or by:
+        unknown = [p.column for p in preds if p.column not in columns]
+        if unknown:
+            raise filters.FilterError(f"Unknown filter column '{unknown[0]}'")
+        row_types = frame[ROW_TYPE].to_numpy()
+        body = frame[row_types == "data"]
+        if preds:
+            body = body[filters.filter_mask(body, preds)]
+        if by:
+            body = body.sort_values(by, ascending=ascending, kind="stable", na_position="last")
+        frame = pd.concat([body, frame[row_types == "total"]])
+    count = len(frame)
+    page_count = max((count + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), page_count)
+    start = (page - 1) * page_size
+    rows = frame.iloc[start:start + page_size]
+    return rows[columns], {
+        "columns": columns,
+        "page": page,
+        "page_size": page_size,
+        "page_count": page_count,
+        "count": count,
+        "row_types": rows[ROW_TYPE].tolist(),
+    }
@@ -12,11 +12,40 @@ class DatasetMetadataCreate(BaseModel):
 class DatasetMetadataResponse(DatasetMetadataCreate):
     id: int
     latest_file: Optional[str] = None
+    num_rows: Optional[int] = None
+    num_columns: Optional[int] = None
+    column_schema: Optional[List[Dict[str, str]]] = None
+    dtype_plan: Optional[Dict[str, Dict[str, Any]]] = None
     created_at: datetime
     updated_at: datetime
     class Config:
         from_attributes = True
 
+# Dataset registration returns at once; ingestion runs as a background job
+class DatasetRegistrationResponse(DatasetMetadataResponse):
+    job_id: int
+
+# Ingestion jobs
+class DatasetRefreshRequest(BaseModel):
+    delay_seconds: float = 0
+    # run again this many seconds after each refresh finishes
+    every_seconds: Optional[float] = None
+
+class IngestJobResponse(BaseModel):
+    id: int
+    kind: str
+    dataset_id: int
+    status: str
+    progress: int
+    payload: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    run_after: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 # Analysis
 class AnalysisCreate(BaseModel):
     dataset_id: int
@@ -46,6 +75,9 @@ class CalculatedFieldOut(CalculatedFieldBase):
     class Config:
         from_attributes = True
 
+class CalculatedFieldBatchCreate(BaseModel):
+    fields: List[CalculatedFieldCreate]
+
 # Values config for pivot
 class ValueConfig(BaseModel):
     column: str
@@ -58,6 +90,26 @@ class AnalysisPreviewRequest(BaseModel):
     rows: Optional[List[str]] = []
     columns: Optional[List[str]] = []
     values: Optional[List[ValueConfig]] = []
+    # add a subtotal row after each group of every row level but the last
+    subtotals: bool = False
+    # return only the first page of the result (fetch the rest by result_id)
+    page_size: Optional[int] = None
+
+class AnalysisPreviewTaskRequest(AnalysisPreviewRequest):
+    # a newer task with the same session_id and analysis_id cancels this one
+    session_id: Optional[str] = None
+
+class PreviewTaskResponse(BaseModel):
+    preview_id: str
+    status: str
+    progress: int
+    stage: str
+    error: Optional[str] = None
+    # once succeeded
+    result_id: Optional[str] = None
+    count: Optional[int] = None
+    calculated_fields_used: Optional[List[str]] = None
+    filtered_columns: Optional[List[str]] = None
 
 # Filters
 class FilterSaveRequest(BaseModel):
@@ -98,9 +150,15 @@ class SheetResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SheetBatchCreate(BaseModel):
+    names: List[str]
+
 class SheetAnalysisMapIn(BaseModel):
     analysis_id: int
 
+class SheetAnalysisMapBatchIn(BaseModel):
+    analysis_ids: List[int]
+
 class SheetAnalysisMapOut(BaseModel):
     id: int
     sheet_id: int
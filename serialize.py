@@ -0,0 +1,80 @@
+# serialize.py
+import json
+from typing import Any, Dict, Optional
+
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+from fastapi.responses import Response
+
+# Media types a client can ask for (Accept) on endpoints returning a frame:
+#   ARROW    an Arrow IPC stream of the frame; the rest of the payload is JSON in the
+#            schema metadata under b"meta"
+#   COLUMNS  {..., "columns": [names], "data": [[one list per column]]}
+# Anything else gets the payload as before, with the rows as a list of records.
+ARROW = "application/vnd.apache.arrow.stream"
+COLUMNS = "application/vnd.dash-reports.columns+json"
+META_KEY = b"meta"
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in (ARROW, COLUMNS):
+            return media_type
+    return None
+
+
+# What orjson can't encode itself: Timestamps, NaT/NA and numpy scalars
+def _default(value: Any) -> Any:
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(payload: Any) -> bytes:
+    # NaN and inf come out as null
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+# numeric and bool columns go to orjson as arrays, without a Python object per cell
+def _column(series: pd.Series) -> Any:
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "iufb":
+        return np.ascontiguousarray(series.to_numpy())
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def to_arrow(frame: pd.DataFrame, meta: Optional[Dict[str, Any]] = None) -> bytes:
+    frame = frame.rename(columns=str)
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed-type object columns (Excel): sent as text
+        mixed = {c: frame[c].map(lambda v: None if pd.isna(v) else str(v))
+                 for c in frame.columns if frame[c].dtype == object}
+        table = pa.Table.from_pandas(frame.assign(**mixed), preserve_index=False)
+    table = table.replace_schema_metadata({META_KEY: json.dumps(meta or {}, default=str)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# `payload` is the JSON body without the rows; the frame's rows go under `records_key`
+# (records), "data" (columns) or into the Arrow stream
+def frame_response(frame: pd.DataFrame, payload: Dict[str, Any], accept: Optional[str],
+                   records_key: str) -> Response:
+    media_type = negotiate(accept)
+    if media_type == ARROW:
+        return Response(to_arrow(frame, payload), media_type=ARROW)
+    if media_type == COLUMNS:
+        body = {**payload, "columns": [str(c) for c in frame.columns],
+                "data": [_column(frame.iloc[:, i]) for i in range(frame.shape[1])]}
+        return Response(dumps(body), media_type=COLUMNS)
+    body = {**payload, records_key: frame.to_dict(orient="records")}
+    return Response(dumps(body), media_type="application/json")
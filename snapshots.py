@@ -0,0 +1,117 @@
+# snapshots.py
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+# record batch size inside a snapshot; slices never need more than two batches per page
+SNAPSHOT_BATCH_ROWS = 65536
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+# One directory per source object, one uncompressed Arrow IPC file per object version.
+# Uncompressed IPC can be memory-mapped without copying, so every uvicorn worker
+# reading the same snapshot shares the OS page cache instead of holding its own copy.
+def _object_dir(bucket: str, key: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, _digest(f"{bucket}/{key}"))
+
+
+def snapshot_path(bucket: str, key: str, version: str) -> str:
+    return os.path.join(_object_dir(bucket, key), f"{_digest(version)[:16]}.arrow")
+
+
+def write_snapshot(bucket: str, key: str, version: str, df: pd.DataFrame) -> Optional[str]:
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed-type object columns (common in Excel sheets) can't be typed; keep parsing those
+        return None
+    writer = SnapshotWriter(bucket, key, version, table.schema)
+    try:
+        writer.write(table)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+# Snapshot written batch by batch, e.g. while a file is streamed in. Goes to a temp file
+# that commit() renames into place, so concurrent readers never see a partial snapshot.
+class SnapshotWriter:
+    def __init__(self, bucket: str, key: str, version: str, schema: pa.Schema):
+        self.path = snapshot_path(bucket, key, version)
+        self.directory = os.path.dirname(self.path)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        self._sink = pa.OSFile(self.tmp_path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, schema)
+
+    def write(self, data):
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+        self._writer.write_table(data, max_chunksize=SNAPSHOT_BATCH_ROWS)
+
+    def _close(self):
+        try:
+            self._writer.close()
+        finally:
+            self._sink.close()
+
+    def commit(self) -> str:
+        try:
+            self._close()
+            os.replace(self.tmp_path, self.path)
+        except Exception:
+            self.abort()
+            raise
+        _prune(self.directory, keep=os.path.basename(self.path))
+        return self.path
+
+    def abort(self):
+        try:
+            self._close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _prune(directory: str, keep: str):
+    for name in os.listdir(directory):
+        if name != keep and name.endswith(".arrow"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def open_snapshot(bucket: str, key: str, version: str) -> Optional[pa.Table]:
+    path = snapshot_path(bucket, key, version)
+    if not os.path.exists(path):
+        return None
+    source = pa.memory_map(path, "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+# With `columns`, only those columns' pages of the mapped file are touched
+def read_snapshot(bucket: str, key: str, version: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    table = open_snapshot(bucket, key, version)
+    if table is None:
+        return None
+    if columns is not None:
+        table = table.select([c for c in table.column_names if c in set(columns)])
+    return table.to_pandas()
+
+
+# Drop every snapshot of an object, e.g. when a dataset's latest_file moves on
+def invalidate(bucket: str, key: str):
+    shutil.rmtree(_object_dir(bucket, key), ignore_errors=True)
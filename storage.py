@@ -0,0 +1,269 @@
+# storage.py
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote_plus
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# local directory used instead of S3 (one sub-directory per bucket); for development and tests
+S3_FAKE_ROOT = os.getenv("S3_FAKE_ROOT") or None
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+# objects at least this big are fetched as concurrent ranged GETs of S3_PART_BYTES
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(16 * 1024 * 1024)))
+S3_PART_BYTES = int(os.getenv("S3_PART_BYTES", str(8 * 1024 * 1024)))
+S3_PART_CONCURRENCY = int(os.getenv("S3_PART_CONCURRENCY", "8"))
+
+
+# Streaming body over a file object, like botocore's StreamingBody
+class _Body:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._stream.read(-1 if amt is None else amt)
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+
+# Filesystem-backed stand-in for the subset of the S3 client API this service uses:
+# ROOT/<bucket>/<key>. Errors are raised as botocore ClientErrors like the real client.
+class FilesystemS3:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _stat(self, bucket: str, key: str, operation: str):
+        path = self._path(bucket, key)
+        if not os.path.isfile(path):
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": f"{bucket}/{key}"}}, operation)
+        return path, os.stat(path)
+
+    @staticmethod
+    def _meta(st) -> Dict[str, Any]:
+        tag = hashlib.md5(f"{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()
+        return {
+            "ContentLength": st.st_size,
+            "ETag": f'"{tag}"',
+            "LastModified": datetime.fromtimestamp(st.st_mtime, tz=timezone.utc),
+        }
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        _, st = self._stat(Bucket, Key, "HeadObject")
+        return self._meta(st)
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        path, st = self._stat(Bucket, Key, "GetObject")
+        meta = self._meta(st)
+        if not Range:
+            meta["Body"] = _Body(open(path, "rb"))
+            return meta
+        with open(path, "rb") as f:
+            start, _, end = Range.replace("bytes=", "").partition("-")
+            start = int(start)
+            end = min(int(end) if end else st.st_size - 1, st.st_size - 1)
+            f.seek(start)
+            data = f.read(max(end - start + 1, 0))
+        meta["ContentRange"] = f"bytes {start}-{end}/{st.st_size}"
+        meta["ContentLength"] = len(data)
+        meta["Body"] = _Body(BytesIO(data))
+        return meta
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **kwargs) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(Body if isinstance(Body, (bytes, bytearray)) else Body.read())
+        return {"ETag": self._meta(os.stat(path))["ETag"]}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", ContinuationToken: Optional[str] = None,
+                        MaxKeys: int = 1000, **kwargs) -> Dict[str, Any]:
+        base = os.path.join(self.root, Bucket)
+        if not os.path.isdir(base):
+            raise ClientError({"Error": {"Code": "NoSuchBucket", "Message": Bucket}}, "ListObjectsV2")
+        keys = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), base).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    keys.append(key)
+        keys.sort()
+        if ContinuationToken:
+            keys = [k for k in keys if k > ContinuationToken]
+        page = keys[:MaxKeys]
+        resp: Dict[str, Any] = {"KeyCount": len(page), "IsTruncated": len(keys) > MaxKeys, "Prefix": Prefix}
+        if page:
+            resp["Contents"] = []
+            for key in page:
+                meta = self._meta(os.stat(self._path(Bucket, key)))
+                resp["Contents"].append({"Key": key, "Size": meta["ContentLength"],
+                                         "ETag": meta["ETag"], "LastModified": meta["LastModified"]})
+        if resp["IsTruncated"]:
+            resp["NextContinuationToken"] = page[-1]
+        return resp
+
+
+def create_client():
+    if S3_FAKE_ROOT:
+        return FilesystemS3(S3_FAKE_ROOT)
+    # one client per process: credentials are resolved and TLS connections pooled once
+    return boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_REGION"),
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
+
+
+# boto3 clients are thread-safe, so every endpoint and worker thread shares this one
+client = create_client()
+
+# ranged part fetches of large downloads
+_part_executor = ThreadPoolExecutor(max_workers=S3_PART_CONCURRENCY, thread_name_prefix="s3-part")
+
+
+def _get_range(s3, bucket: str, key: str, start: int, end: int) -> bytes:
+    obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    return obj["Body"].read()
+
+
+# Whole object as bytes; large objects are fetched as concurrent ranged GETs
+def download(s3, bucket: str, key: str, size: Optional[int] = None) -> bytes:
+    if size is None:
+        size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if size < S3_MULTIPART_THRESHOLD:
+        return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    ranges = [(start, min(start + S3_PART_BYTES, size)) for start in range(0, size, S3_PART_BYTES)]
+    parts = _part_executor.map(lambda r: _get_range(s3, bucket, key, r[0], r[1]), ranges)
+    return b"".join(parts)
+
+
+def list_objects(s3, bucket: str, prefix: str):
+    # every page of the listing, not just the first 1000 keys
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        yield from resp.get("Contents", [])
+        if not resp.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+
+# Newest object per (bucket, prefix), listed at most once per LATEST_FILE_TTL seconds.
+# S3 event notifications (see notify) keep entries current between listings, so with
+# notifications configured the TTL can be raised and hot paths never list.
+LATEST_FILE_TTL = float(os.getenv("LATEST_FILE_TTL", "60"))
+
+
+class LatestFileResolver:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, s3, bucket: str, prefix: str, refresh: bool = False) -> str:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((bucket, prefix))
+        if entry and not refresh and entry["expires"] > now:
+            return entry["key"]
+        latest = None
+        for obj in list_objects(s3, bucket, prefix):
+            if latest is None or obj["LastModified"] > latest["LastModified"]:
+                latest = obj
+        if latest is None:
+            with self._lock:
+                self._entries.pop((bucket, prefix), None)
+            raise Exception("No files found in S3 prefix")
+        with self._lock:
+            self._entries[(bucket, prefix)] = {
+                "key": latest["Key"],
+                "last_modified": latest["LastModified"],
+                "expires": now + self.ttl,
+            }
+        return latest["Key"]
+
+    # An object was created or removed: update every cached prefix it falls under.
+    # Returns the affected prefixes.
+    def notify(self, bucket: str, key: str, created: bool, event_time: Optional[datetime] = None):
+        affected = []
+        with self._lock:
+            for (b, prefix), entry in list(self._entries.items()):
+                if b != bucket or not key.startswith(prefix):
+                    continue
+                affected.append(prefix)
+                if not created:
+                    if entry["key"] == key:
+                        del self._entries[(b, prefix)]
+                    continue
+                # notifications can arrive out of order; keep the newest
+                event_time = event_time or datetime.now(timezone.utc)
+                if event_time >= entry["last_modified"]:
+                    entry.update(key=key, last_modified=event_time,
+                                 expires=time.monotonic() + self.ttl)
+        return affected
+
+
+latest_files = LatestFileResolver(LATEST_FILE_TTL)
+
+
+def _event_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+# (bucket, key, created, event_time) for each object in an S3 event notification:
+# S3 "Records" payloads (directly or wrapped in an SNS envelope) and EventBridge events
+def parse_s3_events(payload: Dict[str, Any]) -> List[tuple]:
+    if isinstance(payload.get("Message"), str):
+        try:
+            payload = json.loads(payload["Message"])
+        except ValueError:
+            return []
+    events = []
+    for record in payload.get("Records", []):
+        s3 = record.get("s3", {})
+        bucket = s3.get("bucket", {}).get("name")
+        key = s3.get("object", {}).get("key")
+        name = record.get("eventName", "")
+        if bucket and key and name.startswith(("ObjectCreated", "ObjectRemoved")):
+            events.append((bucket, unquote_plus(key), name.startswith("ObjectCreated"),
+                           _event_time(record.get("eventTime"))))
+    detail = payload.get("detail")
+    if isinstance(detail, dict) and payload.get("detail-type") in ("Object Created", "Object Deleted"):
+        bucket = detail.get("bucket", {}).get("name")
+        key = detail.get("object", {}).get("key")
+        if bucket and key:
+            events.append((bucket, key, payload["detail-type"] == "Object Created", _event_time(payload.get("time"))))
+    return events
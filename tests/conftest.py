@@ -0,0 +1,45 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# db.py and storage.py open their engine and S3 client on import
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+# the app's modules live at the top level of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Session on a fresh in-memory database; session.queries counts the statements it runs
+@pytest.fixture
+def db():
+    # after the path and environment above are set up; models registers every table
+    from models import Base
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    session.queries = 0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        session.queries += 1
+
+    yield session
+    session.close()
+    engine.dispose()
+
+
+# FilesystemS3 bucket "bkt" and snapshots under the test's temp directory
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    import snapshots
+    import storage
+
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    return storage.FilesystemS3(str(tmp_path / "s3"))
@@ -0,0 +1,98 @@
+# tests/test_dataset_cache.py
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_loader
+from dataset_loader import DataFrameCache
+
+
+def _frame(n: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"x": np.arange(n, dtype="int64")})
+
+
+def _size(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def test_evicts_least_recently_used_first():
+    a, b, c = _frame(), _frame(), _frame()
+    cache = DataFrameCache(_size(a) * 2 + _size(a) // 2)
+    cache.put(("a",), a)
+    cache.put(("b",), b)
+    # a is now more recent than b
+    assert cache.get(("a",)) is a
+    cache.put(("c",), c)
+
+    assert ("b",) not in cache
+    assert cache.get(("a",)) is a and cache.get(("c",)) is c
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["size_bytes"] == _size(a) + _size(c) <= stats["max_bytes"]
+
+
+def test_bounded_by_bytes_not_entries():
+    small = [_frame(10) for _ in range(5)]
+    big = _frame(1000)
+    cache = DataFrameCache(_size(big) + sum(_size(f) for f in small[:2]))
+    for i, frame in enumerate(small):
+        cache.put(("small", i), frame)
+    assert cache.stats()["entries"] == 5
+    cache.put(("big",), big)
+
+    # only the two most recent small frames still fit next to the big one
+    assert [("small", i) in cache for i in range(5)] == [False, False, False, True, True]
+    assert ("big",) in cache
+    assert cache.stats()["size_bytes"] <= cache.max_bytes
+
+
+def test_frame_over_budget_is_not_cached():
+    kept = _frame(10)
+    cache = DataFrameCache(_size(_frame(100)))
+    cache.put(("kept",), kept)
+    cache.put(("huge",), _frame(1000))
+
+    assert ("huge",) not in cache
+    assert cache.get(("kept",)) is kept
+    assert cache.stats()["evictions"] == 0
+
+
+def test_replacing_a_key_does_not_double_count():
+    cache = DataFrameCache(_size(_frame()) * 2)
+    cache.put(("a",), _frame())
+    replacement = _frame()
+    cache.put(("a",), replacement)
+    cache.put(("b",), _frame())
+
+    assert cache.get(("a",)) is replacement and ("b",) in cache
+    assert cache.stats()["size_bytes"] == _size(replacement) * 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_counts_hits_and_misses():
+    cache = DataFrameCache(_size(_frame()))
+    assert cache.get(("a",)) is None
+    cache.put(("a",), _frame())
+    cache.get(("a",))
+    cache.get(("a",))
+    # membership checks leave the counters alone
+    assert ("a",) in cache
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+    assert cache.stats()["hit_ratio"] == pytest.approx(2 / 3, abs=1e-4)
+
+
+# an evicted dataset is read back from its snapshot with the same contents
+def test_load_dataset_after_eviction(s3, monkeypatch):
+    first = pd.DataFrame({"qty": range(500)})
+    second = pd.DataFrame({"qty": range(500, 1000)})
+    s3.put_object(Bucket="bkt", Key="a.csv", Body=first.to_csv(index=False).encode())
+    s3.put_object(Bucket="bkt", Key="b.csv", Body=second.to_csv(index=False).encode())
+    cache = DataFrameCache(_size(first) + _size(first) // 2)
+    monkeypatch.setattr(dataset_loader, "cache", cache)
+
+    pd.testing.assert_frame_equal(dataset_loader.load_dataset(s3, "bkt", "a.csv"), first)
+    pd.testing.assert_frame_equal(dataset_loader.load_dataset(s3, "bkt", "b.csv"), second)
+    assert cache.stats()["entries"] == 1 and cache.stats()["evictions"] == 1
+
+    pd.testing.assert_frame_equal(dataset_loader.load_dataset(s3, "bkt", "a.csv"), first)
+    assert cache.stats()["hits"] == 0
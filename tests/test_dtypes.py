@@ -0,0 +1,99 @@
+# tests/test_dtypes.py
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_loader
+import dtypes
+import exports
+import filters
+import formula
+import pivot
+
+
+def _raw() -> pd.DataFrame:
+    return pd.DataFrame({
+        "first": ["a", "b", "a", "b", None, "a", "c", "a"],
+        "joined": ["01/15/2024", "02/01/2024", "01/15/2024", "03/10/2024", None, "01/15/2024", "02/01/2024",
+                   "03/10/2024"],
+        "qty": [1, 2, 3, 4, 5, 6, 7, 8],
+        "price": [1.5, 2.0, None, 4.0, 5.0, 6.25, 7.0, 8.0],
+    })
+
+
+def _planned():
+    raw = _raw()
+    plan = dtypes.profile(raw)
+    assert [plan[c]["dtype"] for c in raw.columns] == ["category", "datetime", "int8", "float64"]
+    return raw, plan, dtypes.apply_plan(raw, plan)
+
+
+SAVED = [
+    {"first": ["a", "c"]},
+    {"first": {"not_in": ["a"]}},
+    {"first": {"eq": "b"}},
+    {"first": {"ne": "b"}},
+    {"first": {"prefix": "A", "ignore_case": True}},
+    {"first": {"null": True}},
+    {"joined": ["01/15/2024"]},
+    {"joined": {"null": False}},
+    {"joined": {"gte": "2024-02-01", "as": "date"}},
+    {"joined": {"between": ["2024-01-20", "2024-02-28"], "as": "date"}},
+    {"qty": {"gt": 3}},
+    {"qty": {"in": [2, 8]}},
+    {"qty": {"between": ["2", "5"], "as": "number"}},
+    {"price": {"lte": 4}},
+    {"first": ["a"], "qty": {"gte": 3}, "joined": {"lt": "2024-03-01", "as": "date"}},
+]
+
+
+@pytest.mark.parametrize("saved", SAVED)
+def test_filters_match_the_same_rows(saved):
+    raw, plan, planned = _planned()
+    preds = filters.compile_filter(saved)
+    expected = filters.filter_mask(raw, preds)
+    assert expected.any()
+    np.testing.assert_array_equal(filters.filter_mask(planned, preds), expected)
+
+
+@pytest.mark.parametrize("text", ['first + "-" + joined', "qty * price", 'ifelse(first == "a", qty, 0)',
+                                  "month(joined) + qty", 'contains(joined, "2024")'])
+def test_formulas_give_the_same_values(text):
+    raw, plan, planned = _planned()
+    fields = formula.plan_fields({"f": text}, raw.columns)
+    pd.testing.assert_series_equal(fields.evaluate(planned, plan)["f"], fields.evaluate(raw)["f"], check_dtype=False)
+
+
+@pytest.mark.parametrize("rows", [["first"], ["first", "qty"]])
+def test_pivots_group_the_same(rows):
+    raw, plan, planned = _planned()
+    expected = pivot.pivot(raw, rows, [], {"price": "sum", "qty": "count"}, True)
+    got = pivot.pivot(planned, rows, [], {"price": "sum", "qty": "count"}, True)
+    pd.testing.assert_frame_equal(got.frame.astype({r: str for r in rows}),
+                                  expected.frame.astype({r: str for r in rows}), check_dtype=False)
+    assert got.row_types == expected.row_types
+
+
+# the rows an export writes don't depend on the plan, only which rows the filter keeps
+@pytest.mark.parametrize("key", ["csv/data.csv", "pq/data.parquet"])
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+@pytest.mark.parametrize("saved", [None, SAVED[0], SAVED[8], SAVED[-1]])
+def test_exports_write_the_same_rows(s3, key, fmt, saved):
+    raw = _raw().assign(at=pd.Timestamp("2024-01-15 10:30:00") + pd.to_timedelta(np.arange(8), "h"))
+    if key.endswith(".csv"):
+        s3.put_object(Bucket="bkt", Key=key, Body=raw.to_csv(index=False).encode())
+    else:
+        buf = io.BytesIO()
+        raw.to_parquet(buf, index=False)
+        s3.put_object(Bucket="bkt", Key=key, Body=buf.getvalue())
+    plan = dataset_loader.ingest_dataset(s3, "bkt", key)["dtype_plan"]
+    table = dataset_loader.snapshot_table(s3, "bkt", key)
+
+    planned = b"".join(exports.stream(table, fmt, saved, plan))
+    unplanned = b"".join(exports.stream(table, fmt, saved, None))
+    read = pd.read_csv if fmt == "csv" else pd.read_parquet
+    pd.testing.assert_frame_equal(read(io.BytesIO(planned)), read(io.BytesIO(unplanned)))
+    expected = raw[filters.filter_mask(raw, filters.compile_filter(saved))] if saved else raw
+    assert read(io.BytesIO(planned))["qty"].tolist() == expected["qty"].tolist()
@@ -0,0 +1,47 @@
+# tests/test_exports.py
+import io
+
+import pandas as pd
+import pytest
+
+import dataset_loader
+import exports
+import filters
+
+
+def _export(s3, key: str, fmt: str, saved_filter=None) -> bytes:
+    table = dataset_loader.snapshot_table(s3, "bkt", key)
+    return b"".join(exports.stream(table, fmt, saved_filter))
+
+
+def test_export_without_snapshot(s3):
+    # a mixed-type column can't be snapshotted; the export still gets every row
+    buf = io.BytesIO()
+    pd.DataFrame({"id": [1, 2, 3], "mixed": [1, "x", 2.5]}).to_excel(buf, index=False)
+    s3.put_object(Bucket="bkt", Key="xl/data.xlsx", Body=buf.getvalue())
+
+    got = pd.read_csv(io.BytesIO(_export(s3, "xl/data.xlsx", "csv")))
+    assert got["id"].tolist() == [1, 2, 3]
+    assert got["mixed"].astype(str).tolist() == ["1", "x", "2.5"]
+
+    got = pd.read_parquet(io.BytesIO(_export(s3, "xl/data.xlsx", "parquet", {"mixed": ["x"]})))
+    assert got["id"].tolist() == [2]
+
+
+def test_export_from_snapshot(s3):
+    df = pd.DataFrame({"region": ["N", "S", "N"], "sales": [1.5, 2.0, None]})
+    s3.put_object(Bucket="bkt", Key="csv/data.csv", Body=df.to_csv(index=False).encode())
+
+    got = pd.read_csv(io.BytesIO(_export(s3, "csv/data.csv", "csv", {"region": ["N"]})))
+    assert got["sales"].tolist()[0] == 1.5
+    assert got["region"].tolist() == ["N", "N"]
+
+
+# the error comes from stream() itself, before the response (and its status) starts
+def test_bad_filter_fails_before_streaming(s3):
+    df = pd.DataFrame({"day": ["2024-01-01", "2024-01-02"], "qty": [1, 2]})
+    s3.put_object(Bucket="bkt", Key="csv/data.csv", Body=df.to_csv(index=False).encode())
+    table = dataset_loader.snapshot_table(s3, "bkt", "csv/data.csv")
+    plan = dataset_loader.ingest_dataset(s3, "bkt", "csv/data.csv")["dtype_plan"]
+    with pytest.raises(filters.FilterError):
+        exports.stream(table, "csv", {"day": {"gt": "notadate"}}, plan)
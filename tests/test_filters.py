@@ -0,0 +1,87 @@
+# tests/test_filters.py
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import dtypes
+import filters
+
+ROWS_PER_GROUP = 4
+
+
+def _metadata(df: pd.DataFrame):
+    sink = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink, row_group_size=ROWS_PER_GROUP)
+    return pq.ParquetFile(io.BytesIO(sink.getvalue())).metadata
+
+
+# groups the mask matches rows in, evaluated group by group on the frame previews see
+def _matching_groups(df: pd.DataFrame, preds, dtype_plan=None):
+    groups = []
+    for i, start in enumerate(range(0, len(df), ROWS_PER_GROUP)):
+        part = dtypes.apply_plan(df.iloc[start:start + ROWS_PER_GROUP].reset_index(drop=True), dtype_plan)
+        if filters.filter_mask(part, preds).any():
+            groups.append(i)
+    return groups
+
+
+def _dates():
+    days = pd.date_range("2023-12-25", periods=16, freq="D")
+    return pd.DataFrame({"d": days.strftime("%m/%d/%Y"), "n": [str(i * 10) for i in range(16)]})
+
+
+@pytest.mark.parametrize("saved, dtype_plan", [
+    ({"d": {"gte": "2024-01-01", "as": "date"}}, None),
+    ({"d": {"between": ["2024-01-02", "2024-01-04"], "as": "date"}}, None),
+    ({"d": {"gte": "2024-01-01"}}, {"d": {"dtype": "datetime", "format": "%m/%d/%Y"}}),
+    ({"d": {"in": ["2024-01-05"]}}, {"d": {"dtype": "datetime", "format": "%m/%d/%Y"}}),
+    ({"d": {"null": True}}, {"d": {"dtype": "datetime", "format": "%Y-%m-%d"}}),
+    ({"n": {"gt": "20", "as": "number"}}, None),
+    ({"n": {"lt": 100, "as": "number"}}, None),
+])
+def test_pruning_keeps_every_matching_group(saved, dtype_plan):
+    df = _dates()
+    preds = filters.compile_filter(saved)
+    matching = _matching_groups(df, preds, dtype_plan)
+    assert matching
+    kept = filters.prune_row_groups(_metadata(df), preds, dtype_plan)
+    assert set(matching) <= set(kept)
+
+
+@pytest.mark.parametrize("saved", [
+    {"x": {"gte": 9}},
+    {"x": {"lt": 3}},
+    {"x": {"in": [5, 14]}},
+    {"x": {"between": [6, 7]}},
+    {"s": {"prefix": "b"}},
+    {"s": {"eq": "c9"}},
+])
+def test_pruning_skips_groups_without_matches(saved):
+    df = pd.DataFrame({"x": range(16), "s": [f"{'abcd'[i // 4]}{i}" for i in range(16)]})
+    preds = filters.compile_filter(saved)
+    kept = filters.prune_row_groups(_metadata(df), preds)
+    assert kept == _matching_groups(df, preds)
+
+
+@pytest.mark.parametrize("saved", [
+    {"d": {"gt": "notadate"}},
+    {"d": {"in": ["notadate"]}},
+    {"d": {"between": ["2024-01-01", "soon"]}},
+])
+def test_bad_values_raise_filter_error(saved):
+    df = pd.DataFrame({"d": pd.to_datetime(["2024-01-01", "2024-02-01"]), "n": [1, 2]})
+    with pytest.raises(filters.FilterError):
+        filters.filter_mask(df, filters.compile_filter(saved))
+
+
+@pytest.mark.parametrize("saved", [
+    {"d": {"gt": "notadate", "as": "date"}},
+    {"n": {"in": [1, "two"], "as": "number"}},
+    {"n": {"between": ["x", 3], "as": "number"}},
+])
+def test_typed_values_checked_when_compiled(saved):
+    with pytest.raises(filters.FilterError):
+        filters.compile_filter(saved)
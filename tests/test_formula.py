@@ -0,0 +1,170 @@
+# tests/test_formula.py
+import pandas as pd
+import pytest
+
+import crud
+import dtypes
+import formula
+import schemas
+from models import Analysis, DatasetMetadata
+
+
+def _people() -> pd.DataFrame:
+    return pd.DataFrame({
+        "first": ["a", "b", "a", "b", None, "a"],
+        "last": ["x", "y", "x", "y", "x", "y"],
+        "joined": ["01/15/2024", "02/01/2024", "01/15/2024", "03/10/2024", "02/01/2024", "01/15/2024"],
+        "qty": [1, 2, 3, 4, 5, 6],
+    })
+
+
+# calculated fields give the same values on the frame loaded with the dtype plan
+@pytest.mark.parametrize("text", [
+    'first + " " + last',
+    'concat(first, "-", joined)',
+    'upper(first) + substr(joined, 1, 2)',
+    'ifelse(first == "a", qty * 1000, qty)',
+    'joined + "!"',
+    'year(joined) * 100 + month(joined)',
+])
+def test_fields_ignore_dtype_plan(text):
+    raw = _people()
+    plan = dtypes.profile(raw)
+    assert plan["first"]["dtype"] == "category" and plan["joined"]["dtype"] == "datetime"
+    planned = dtypes.apply_plan(raw, plan)
+
+    fields = formula.plan_fields({"f": text}, raw.columns)
+    expected = fields.evaluate(raw)["f"]
+    got = fields.evaluate(planned, plan)["f"]
+    pd.testing.assert_series_equal(got, expected, check_dtype=False)
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({"qty": [1.0, None, 4.0], "price": [2.0, 3.0, None], "name": [" ab", "Cd ", None]})
+
+
+@pytest.mark.parametrize("text, message", [
+    ("qty.real", "Unsupported syntax: Attribute"),
+    ("qty.__class__", "Unsupported syntax: Attribute"),
+    ("name[0]", "Unsupported syntax: Subscript"),
+    ("lambda: 1", "Unsupported syntax: Lambda"),
+    ("(lambda: qty)()", "Unknown function"),
+    ("open('x')", "Unknown function: open"),
+    ("__import__('os')", "Unknown function: __import__"),
+    ("np.system(1)", "Unknown function: np.system"),
+    ("[x for x in qty]", "Unsupported syntax: ListComp"),
+    ("round(qty, digits=1)", "Keyword arguments are not supported"),
+    ("ifelse(qty, 1)", "ifelse() takes 3-3 arguments"),
+    ("missing + 1", "Unknown column 'missing'"),
+    ("qty +", "Invalid formula"),
+])
+def test_rejected_syntax(text, message):
+    with pytest.raises(formula.FormulaError, match=message.replace("(", r"\(").replace(")", r"\)")):
+        formula.compile_formula(text, _frame().columns)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ifelse(qty > 2, qty, 0)", [0.0, 0.0, 4.0]),
+    ("qty if qty > 2 else -1", [-1.0, -1.0, 4.0]),
+    ("np.where(price > 2, 1, 2)", [2, 1, 2]),
+    ("coalesce(qty, price, 0)", [1.0, 3.0, 4.0]),
+    ("fillna(qty, 0) * 2", [2.0, 0.0, 8.0]),
+    ("nullif(qty, 4)", [1.0, None, None]),
+    ("isnull(qty)", [False, True, False]),
+    ("notnull(price) & (qty > 0)", [True, False, False]),
+    ("qty * price", [2.0, None, None]),
+    ("upper(strip(name))", ["AB", "CD", None]),
+    ("lower(trim(name))", ["ab", "cd", None]),
+    ("len(name)", [3, 3, None]),
+    ("substr(strip(name), 2, 1)", ["b", "d", None]),
+    ("replace(name, 'a', 'x')", [" xb", "Cd ", None]),
+    ("contains(name, 'C')", [False, True, None]),
+    ("concat('n:', strip(name))", ["n:ab", "n:Cd", None]),
+    ("`qty` + 1", [2.0, None, 5.0]),
+])
+def test_functions(text, expected):
+    got = formula.compile_formula(text, _frame().columns).evaluate(_frame())
+    assert [None if pd.isna(v) else v for v in got] == expected
+
+
+def test_plan_orders_dependencies():
+    fields = {"total": "net + tax", "tax": "net * 0.2", "net": "qty * price", "unused": "qty"}
+    plan = formula.plan_fields(fields, _frame().columns)
+    assert plan.names.index("net") < plan.names.index("tax") < plan.names.index("total")
+    assert formula.plan_fields(fields, _frame().columns, ["total"]).names == ["net", "tax", "total"]
+    assert plan.evaluate(_frame())["total"].tolist()[0] == pytest.approx(2.4)
+
+
+def test_plan_detects_cycles():
+    with pytest.raises(formula.FormulaError, match="Circular reference between calculated fields: a -> b -> a"):
+        formula.plan_fields({"a": "b + 1", "b": "a * 2"}, _frame().columns)
+
+
+def test_field_shadowing_a_column_reads_the_column():
+    plan = formula.plan_fields({"qty": "qty * 10"}, _frame().columns)
+    assert plan.evaluate(_frame())["qty"].tolist()[0] == 10.0
+
+
+def test_shared_subexpressions_run_once(monkeypatch):
+    calls = []
+
+    def sqrt(x):
+        calls.append(1)
+        return x ** 0.5
+    monkeypatch.setitem(formula.FUNCTIONS, "sqrt", (sqrt, 1, 1))
+    # text not seen by earlier tests, so it is compiled with the counting sqrt
+    fields = {"a": "sqrt(qty + 0.125) + 1", "b": "sqrt(qty + 0.125) * 2", "c": "a + b + sqrt(qty+0.125)"}
+    formula.plan_fields(fields, _frame().columns).evaluate(_frame())
+    assert len(calls) == 1
+
+
+def _analysis(db, fields=()):
+    dataset = DatasetMetadata(dataset_name="d", s3_bucket="bkt", s3_key="d/", latest_file="d/data.csv",
+                              column_schema=[{"name": "qty", "dtype": "float64"}, {"name": "price", "dtype": "float64"}])
+    db.add(dataset)
+    db.commit()
+    analysis = Analysis(dataset_id=dataset.id, analysis_name="a", analysis_type="pivot", config={})
+    db.add(analysis)
+    db.commit()
+    for name, text in fields:
+        crud.create_calculated_field(db, schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name=name,
+                                                                       formula=text))
+    return analysis
+
+
+@pytest.mark.parametrize("text, message", [
+    ("qty.real", "Unsupported syntax"),
+    ("nope * 2", "Unknown column 'nope'"),
+    ("sum(qty)", "Unknown function: sum"),
+])
+def test_field_validated_when_created(db, text, message):
+    analysis = _analysis(db, [("tax", "qty * 0.2")])
+    payload = schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="f", formula=text)
+    with pytest.raises(formula.FormulaError, match=message):
+        crud.create_calculated_field(db, payload)
+    assert [f.field_name for f in crud.get_calculated_fields_by_analysis(db, analysis.id)] == ["tax"]
+
+
+def test_batch_validated_when_created(db):
+    analysis = _analysis(db, [("tax", "qty * 0.2")])
+    payloads = [schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="a", formula="b + tax"),
+                schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="b", formula="a * 2")]
+    with pytest.raises(formula.FormulaError, match="Circular reference"):
+        crud.create_calculated_fields(db, payloads)
+    db.rollback()
+    assert [f.field_name for f in crud.get_calculated_fields_by_analysis(db, analysis.id)] == ["tax"]
+
+
+# a new field can't take the name of one the analysis already has, alone or in a batch
+def test_existing_field_names_rejected(db):
+    analysis = _analysis(db, [("tax", "qty * 0.2")])
+    with pytest.raises(ValueError, match="'tax' already exists"):
+        crud.create_calculated_field(db, schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="tax",
+                                                                       formula="qty * 0.5"))
+    payloads = [schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="net", formula="qty - tax"),
+                schemas.CalculatedFieldCreate(analysis_id=analysis.id, field_name="tax", formula="qty * 0.5")]
+    with pytest.raises(ValueError, match="'tax' already exists"):
+        crud.create_calculated_fields(db, payloads)
+    db.rollback()
+    fields = crud.get_calculated_fields_by_analysis(db, analysis.id)
+    assert [(f.field_name, f.formula) for f in fields] == [("tax", "qty * 0.2")]
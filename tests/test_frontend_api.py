@@ -0,0 +1,147 @@
+# tests/test_frontend_api.py
+import importlib.util
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+FRONTEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend", "dataset.py")
+
+
+# frontend/dataset.py is a script, not a package module; its Dash disk cache goes to a temp dir
+@pytest.fixture(scope="module")
+def frontend(tmp_path_factory):
+    previous = os.environ.get("DASH_CACHE_DIR")
+    os.environ["DASH_CACHE_DIR"] = str(tmp_path_factory.mktemp("dash-cache"))
+    try:
+        spec = importlib.util.spec_from_file_location("frontend_dataset", FRONTEND)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if previous is None:
+            os.environ.pop("DASH_CACHE_DIR")
+        else:
+            os.environ["DASH_CACHE_DIR"] = previous
+    return module
+
+
+class _Backend(ThreadingHTTPServer):
+    # counts the GETs it answers; each takes `delay` seconds, paths under /fail/ answer 500
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.gets = []
+        self.delay = 0.0
+        self.version = 0
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.gets.append(self.path)
+        time.sleep(self.server.delay)
+        self._reply(500 if self.path.startswith("/fail/") else 200,
+                    {"path": self.path, "version": self.server.version})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.version += 1
+        self._reply(200, {"version": self.server.version})
+
+    def _reply(self, status: int, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def backend(frontend, monkeypatch):
+    server = _Backend()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(frontend, "API_BASE", server.base)
+    monkeypatch.setattr(frontend, "API_CACHE_SECONDS", 60)
+    frontend.invalidate_api_cache()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_gets_coalesce(frontend, backend):
+    backend.delay = 0.3
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: frontend.api_get("/datasets/"), range(8)))
+
+    assert backend.gets == ["/datasets/"]
+    assert results == [({"path": "/datasets/", "version": 0}, None)] * 8
+
+
+def test_get_is_cached_until_it_expires(frontend, backend, monkeypatch):
+    monkeypatch.setattr(frontend, "API_CACHE_SECONDS", 0.3)
+    frontend.api_get("/reports/1")
+    frontend.api_get("/reports/1")
+    assert len(backend.gets) == 1
+    time.sleep(0.4)
+    frontend.api_get("/reports/1")
+    assert len(backend.gets) == 2
+
+
+def test_params_are_part_of_the_key(frontend, backend):
+    frontend.api_get("/datasets/1/data", {"page": 1, "limit": 50})
+    frontend.api_get("/datasets/1/data", {"limit": 50, "page": 1})
+    frontend.api_get("/datasets/1/data", {"page": 2, "limit": 50})
+    frontend.api_get("/datasets/1/data", {"cols": ["a", "b"]})
+    frontend.api_get("/datasets/1/data", {"cols": ["a", "b"]})
+    assert len(backend.gets) == 3
+
+
+def test_errors_are_not_cached(frontend, backend):
+    payload, err = frontend.api_get("/fail/1")
+    assert payload is None and "500" in err
+    frontend.api_get("/fail/1")
+    assert len(backend.gets) == 2
+
+
+def test_uncached_get_always_calls(frontend, backend):
+    frontend.api_get("/jobs/1", cache=False)
+    frontend.api_get("/jobs/1", cache=False)
+    assert len(backend.gets) == 2
+
+
+def test_write_invalidates_cached_gets(frontend, backend):
+    assert frontend.api_get("/reports/1")[0]["version"] == 0
+    frontend.api_post("/reports/1/sheets", {"name": "s"})
+    assert frontend.api_get("/reports/1")[0]["version"] == 1
+    assert len(backend.gets) == 2
+
+    # posts that don't change anything can leave the cache alone
+    frontend.api_post("/previews", {}, invalidate=False)
+    assert frontend.api_get("/reports/1")[0]["version"] == 1
+    assert len(backend.gets) == 2
+
+
+# a GET that was in flight while a write happened may hold the old state; it isn't cached
+def test_get_racing_a_write_is_not_cached(frontend, backend):
+    backend.delay = 0.3
+    with ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(frontend.api_get, "/reports/1")
+        time.sleep(0.1)
+        frontend.invalidate_api_cache()
+        pending.result()
+    backend.delay = 0.0
+    frontend.api_get("/reports/1")
+    assert len(backend.gets) == 2
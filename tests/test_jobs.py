@@ -0,0 +1,52 @@
+# tests/test_jobs.py
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import jobs
+from models import Base, DatasetMetadata, IngestJob
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    # a file database: the dispatcher and the job threads each use their own connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(bind=engine, expire_on_commit=False))
+    monkeypatch.setattr(jobs, "JOB_POLL_SECONDS", 0.02)
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+    # two slots, so a re-queued job could be claimed again while its first run goes on
+    runner = jobs.JobRunner(2)
+    yield runner
+    runner.stop()
+    engine.dispose()
+
+
+# a job that reports no progress for longer than JOB_STALE_SECONDS still runs only once
+def test_silent_job_is_not_requeued(runner, monkeypatch):
+    runs = []
+
+    def run_job(db, job):
+        runs.append(job.id)
+        time.sleep(1.0)
+    monkeypatch.setattr(jobs, "run_job", run_job)
+
+    db = jobs.SessionLocal()
+    dataset = DatasetMetadata(dataset_name="d", s3_bucket="bkt", s3_key="d/")
+    db.add(dataset)
+    db.commit()
+    job_id = crud.create_ingest_job(db, "register", dataset.id).id
+    runner.wake()
+    for _ in range(300):
+        db.expire_all()
+        if db.get(IngestJob, job_id).status == "succeeded":
+            break
+        time.sleep(0.01)
+    db.expire_all()
+    assert db.get(IngestJob, job_id).status == "succeeded"
+    assert runs == [job_id]
+    db.close()
@@ -0,0 +1,162 @@
+# tests/test_latest_files.py
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import crud
+import storage
+from models import DatasetMetadata
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class _Counting(storage.FilesystemS3):
+    # FilesystemS3 that counts listing requests
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.lists = 0
+
+    def list_objects_v2(self, **kwargs):
+        self.lists += 1
+        return super().list_objects_v2(**kwargs)
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return _Counting(str(tmp_path))
+
+
+def _put(s3, key: str, minutes: int):
+    s3.put_object(Bucket="bkt", Key=key, Body=b"qty\n1\n")
+    stamp = (BASE + timedelta(minutes=minutes)).timestamp()
+    os.utime(s3._path("bkt", key), (stamp, stamp))
+
+
+def test_resolves_newest_object_not_last_key(s3):
+    _put(s3, "sales/b.csv", 0)
+    _put(s3, "sales/a.csv", 5)
+    _put(s3, "other/z.csv", 10)
+    assert storage.LatestFileResolver(60).resolve(s3, "bkt", "sales/") == "sales/a.csv"
+
+
+def test_lists_once_per_ttl(s3):
+    resolver = storage.LatestFileResolver(0.5)
+    _put(s3, "sales/jan.csv", 0)
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/jan.csv"
+    _put(s3, "sales/feb.csv", 1)
+
+    # within the TTL the cached answer stands, without listing
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/jan.csv"
+    assert s3.lists == 1
+    # refresh lists regardless
+    assert resolver.resolve(s3, "bkt", "sales/", refresh=True) == "sales/feb.csv"
+    assert s3.lists == 2
+
+    _put(s3, "sales/mar.csv", 2)
+    time.sleep(0.6)
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/mar.csv"
+    assert s3.lists == 3
+
+
+def test_empty_prefix_raises_and_forgets(s3):
+    resolver = storage.LatestFileResolver(0)
+    _put(s3, "sales/jan.csv", 0)
+    resolver.resolve(s3, "bkt", "sales/")
+    os.remove(s3._path("bkt", "sales/jan.csv"))
+    with pytest.raises(Exception, match="No files found"):
+        resolver.resolve(s3, "bkt", "sales/")
+    assert resolver.notify("bkt", "sales/feb.csv", True) == []
+
+
+def test_created_event_updates_without_listing(s3):
+    resolver = storage.LatestFileResolver(3600)
+    _put(s3, "sales/jan.csv", 0)
+    _put(s3, "sales/2024/jan.csv", 0)
+    resolver.resolve(s3, "bkt", "sales/")
+    resolver.resolve(s3, "bkt", "sales/2024/")
+
+    affected = resolver.notify("bkt", "sales/2024/feb.csv", True, BASE + timedelta(minutes=1))
+    assert sorted(affected) == ["sales/", "sales/2024/"]
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/2024/feb.csv"
+    assert resolver.resolve(s3, "bkt", "sales/2024/") == "sales/2024/feb.csv"
+    # other buckets and prefixes are left alone
+    assert resolver.notify("other", "sales/mar.csv", True) == []
+    assert resolver.notify("bkt", "returns/mar.csv", True) == []
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/2024/feb.csv"
+    assert s3.lists == 2
+
+
+def test_late_event_for_an_older_object_is_ignored(s3):
+    resolver = storage.LatestFileResolver(3600)
+    _put(s3, "sales/jan.csv", 0)
+    resolver.resolve(s3, "bkt", "sales/")
+    resolver.notify("bkt", "sales/mar.csv", True, BASE + timedelta(minutes=2))
+    resolver.notify("bkt", "sales/feb.csv", True, BASE + timedelta(minutes=1))
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/mar.csv"
+
+
+def test_removing_the_latest_object_relists(s3):
+    resolver = storage.LatestFileResolver(3600)
+    _put(s3, "sales/jan.csv", 0)
+    _put(s3, "sales/feb.csv", 1)
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/feb.csv"
+
+    # removing some other object keeps the cached answer
+    os.remove(s3._path("bkt", "sales/jan.csv"))
+    resolver.notify("bkt", "sales/jan.csv", False)
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/feb.csv"
+    assert s3.lists == 1
+
+    _put(s3, "sales/jan.csv", 0)
+    os.remove(s3._path("bkt", "sales/feb.csv"))
+    resolver.notify("bkt", "sales/feb.csv", False)
+    assert resolver.resolve(s3, "bkt", "sales/") == "sales/jan.csv"
+    assert s3.lists == 2
+
+
+def test_parse_s3_events():
+    records = {"Records": [
+        {"eventName": "ObjectCreated:Put", "eventTime": "2024-01-01T00:01:00.000Z",
+         "s3": {"bucket": {"name": "bkt"}, "object": {"key": "sales/jan+2024%2C+final.csv"}}},
+        {"eventName": "ObjectRemoved:Delete", "s3": {"bucket": {"name": "bkt"}, "object": {"key": "sales/old.csv"}}},
+        {"eventName": "ObjectRestore:Completed", "s3": {"bucket": {"name": "bkt"}, "object": {"key": "x.csv"}}},
+    ]}
+    expected = [("bkt", "sales/jan 2024, final.csv", True, BASE + timedelta(minutes=1)),
+                ("bkt", "sales/old.csv", False, None)]
+    assert storage.parse_s3_events(records) == expected
+    assert storage.parse_s3_events({"Type": "Notification", "Message": json.dumps(records)}) == expected
+    assert storage.parse_s3_events({"Message": "not json"}) == []
+
+    bridge = {"detail-type": "Object Deleted", "time": "2024-01-01T00:01:00Z",
+              "detail": {"bucket": {"name": "bkt"}, "object": {"key": "sales/old.csv"}}}
+    assert storage.parse_s3_events(bridge) == [("bkt", "sales/old.csv", False, BASE + timedelta(minutes=1))]
+
+
+# an event re-points the dataset and drops what was derived from the old file
+def test_apply_s3_event_repoints_datasets(s3, db, monkeypatch):
+    monkeypatch.setattr(crud, "s3_client", s3)
+    monkeypatch.setattr(storage, "latest_files", storage.LatestFileResolver(3600))
+    _put(s3, "sales/jan.csv", 0)
+    sales = DatasetMetadata(dataset_name="sales", s3_bucket="bkt", s3_key="sales/")
+    returns = DatasetMetadata(dataset_name="returns", s3_bucket="bkt", s3_key="returns/")
+    db.add_all([sales, returns])
+    db.commit()
+    crud.refresh_latest_file(db, sales)
+    sales.dtype_plan = {"qty": {"dtype": "int8"}}
+    db.commit()
+
+    _put(s3, "sales/feb.csv", 1)
+    updated = crud.apply_s3_event(db, "bkt", "sales/feb.csv", True, BASE + timedelta(minutes=1))
+    assert updated == [sales]
+    assert sales.latest_file == "sales/feb.csv" and sales.dtype_plan is None
+    assert returns.latest_file is None
+    assert s3.lists == 1
+
+    # the last file going away keeps the last known one
+    for key in ("sales/jan.csv", "sales/feb.csv"):
+        os.remove(s3._path("bkt", key))
+        assert crud.apply_s3_event(db, "bkt", key, False) == []
+    assert sales.latest_file == "sales/feb.csv"
@@ -0,0 +1,39 @@
+# tests/test_pagination.py
+import io
+
+import pandas as pd
+import pytest
+
+import dataset_loader
+import pagination
+import snapshots
+
+
+def _frame(n: int = 50) -> pd.DataFrame:
+    return pd.DataFrame({
+        "day": pd.date_range("2024-01-01", periods=n, freq="D").strftime("%m/%d/%Y"),
+        "region": ["North", "South"] * (n // 2),
+        "qty": range(n),
+    })
+
+
+# pages read straight from the file look like pages read from the snapshot
+@pytest.mark.parametrize("key", ["csv/data.csv", "pq/data.parquet"])
+def test_pages_apply_dtype_plan(s3, key):
+    df = _frame()
+    if key.endswith(".csv"):
+        s3.put_object(Bucket="bkt", Key=key, Body=df.to_csv(index=False).encode())
+    else:
+        buf = io.BytesIO()
+        df.to_parquet(buf, index=False, row_group_size=10)
+        s3.put_object(Bucket="bkt", Key=key, Body=buf.getvalue())
+    plan = dataset_loader.ingest_dataset(s3, "bkt", key)["dtype_plan"]
+    assert plan["day"]["dtype"] == "datetime"
+
+    from_snapshot, total, row_index = pagination.read_page(s3, "bkt", key, 15, 10, None, plan)
+    snapshots.invalidate("bkt", key)
+    from_file, file_total, _ = pagination.read_page(s3, "bkt", key, 15, 10, row_index, plan)
+
+    assert total == file_total == len(df)
+    assert from_file["day"].iloc[0] == pd.Timestamp("2024-01-16")
+    pd.testing.assert_frame_equal(from_file.reset_index(drop=True), from_snapshot.reset_index(drop=True))
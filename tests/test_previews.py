@@ -0,0 +1,70 @@
+# tests/test_previews.py
+import time
+
+import pandas as pd
+import pytest
+
+import previews
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    # workers are fresh interpreters: they find the data through the environment
+    monkeypatch.setenv("S3_FAKE_ROOT", str(tmp_path / "s3"))
+    monkeypatch.setenv("SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    (tmp_path / "s3" / "bkt").mkdir(parents=True)
+    pd.DataFrame({"region": ["N", "S", "N"], "qty": [1, 2, 3]}).to_csv(tmp_path / "s3" / "bkt" / "data.csv", index=False)
+    runner = previews.PreviewRunner(1)
+    yield runner
+    runner.stop()
+
+
+def _spec(formulas=None):
+    formulas = formulas or {}
+    return {"dataset_id": 1, "analysis_id": 1, "rows": ["region"], "columns": [],
+            "agg_dict": {"qty": "sum", **{name: "sum" for name in formulas}}, "subtotals": False,
+            "bucket": "bkt", "key": "data.csv", "saved": None, "dtype_plan": None, "sig": "",
+            "formulas": formulas, "schema_columns": ["region", "qty"],
+            "requested": ["region", "qty", *formulas], "needed": ["region", "qty"]}
+
+
+def _wait(task, statuses, seconds=30):
+    deadline = time.monotonic() + seconds
+    while task.status not in statuses and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return task.status
+
+
+def _finish(result, filtered_columns, from_cube):
+    return {"count": len(result.frame)}
+
+
+def test_cancel_kills_worker_and_pool_recovers(runner):
+    # a formula that computes for minutes stands in for any long preview
+    slow = runner.submit(_spec({"huge": "qty + 3 ** 200000000"}), "s1", _finish)
+    assert _wait(slow, ("running",)) == "running"
+    while slow.stage != "calculated fields":
+        time.sleep(0.02)
+    worker = runner._slots[0]
+    process = worker._process
+    assert process.is_alive()
+
+    runner.cancel(slow.id)
+    assert slow.status == "cancelled"
+    process.join(10)
+    assert not process.is_alive()
+
+    # the same slot picks up the next preview in a new process
+    task = runner.submit(_spec(), "s1", _finish)
+    assert _wait(task, ("succeeded", "failed", "cancelled")) == "succeeded"
+    assert task.outcome == {"count": 3}
+    assert slow.status == "cancelled"
+    assert worker._process is not process and worker._process.is_alive()
+
+
+def test_newer_preview_of_same_session_cancels_running_one(runner):
+    slow = runner.submit(_spec({"huge": "qty + 3 ** 200000000"}), "s1", _finish)
+    assert _wait(slow, ("running",)) == "running"
+    task = runner.submit(_spec(), "s1", _finish)
+    assert slow.status == "cancelled"
+    assert _wait(task, ("succeeded", "failed")) == "succeeded"
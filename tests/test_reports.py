@@ -0,0 +1,44 @@
+# tests/test_reports.py
+import pytest
+
+import crud
+import schemas
+from models import Analysis, DatasetMetadata
+
+
+def _report(db, sheets: int, analyses: int) -> int:
+    dataset = DatasetMetadata(dataset_name="sales", s3_bucket="bkt", s3_key="sales/",
+                              latest_file="sales/data.csv", column_schema=[{"name": "qty", "dtype": "int64"}])
+    db.add(dataset)
+    db.commit()
+    items = [Analysis(dataset_id=dataset.id, analysis_name=f"a{i}", analysis_type="pivot", config={})
+             for i in range(analyses)]
+    db.add_all(items)
+    db.commit()
+    report = crud.create_report(db, f"report-{sheets}-{analyses}")
+
+    db.queries = 0
+    created = crud.create_sheets(db, report.id, [f"s{i}" for i in range(sheets)])
+    for sheet in created:
+        crud.add_analyses_to_sheet(db, sheet["id"], [a.id for a in items])
+    crud.create_calculated_fields(db, [schemas.CalculatedFieldCreate(analysis_id=a.id, field_name="double",
+                                                                      formula="[qty] * 2") for a in items])
+    # one INSERT for the sheets, one per sheet for its analyses, four for the fields
+    assert db.queries == 1 + sheets + 4
+    return report.id
+
+
+@pytest.mark.parametrize("sheets, analyses", [(1, 1), (3, 5), (20, 30)])
+def test_report_tree_query_count(db, sheets, analyses):
+    report_id = _report(db, sheets, analyses)
+    db.expire_all()
+
+    db.queries = 0
+    tree = crud.get_report_tree(db, report_id)
+    assert db.queries == 1
+    assert len(tree["sheets"]) == sheets
+    assert all(len(sheet["analyses"]) == analyses for sheet in tree["sheets"])
+
+
+def test_report_tree_missing(db):
+    assert crud.get_report_tree(db, 1) is None
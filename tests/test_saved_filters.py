@@ -0,0 +1,27 @@
+# tests/test_saved_filters.py
+import pytest
+
+import crud
+from models import Analysis, DatasetMetadata, FilterSelection
+
+
+@pytest.fixture
+def analysis(db):
+    dataset = DatasetMetadata(dataset_name="sales", s3_bucket="bkt", s3_key="sales/")
+    db.add(dataset)
+    db.commit()
+    analysis = Analysis(dataset_id=dataset.id, analysis_name="a", analysis_type="pivot", config={})
+    db.add(analysis)
+    db.commit()
+    return analysis
+
+
+# the upsert and the select-then-write path used on other dialects
+@pytest.mark.parametrize("save", [crud.save_filter, crud._save_filter_locked])
+def test_save_filter_keeps_one_row(db, analysis, save):
+    first = save(db, analysis.dataset_id, analysis.id, {"region": ["N"]})
+    second = save(db, analysis.dataset_id, analysis.id, {"region": {"in": ["S"]}})
+    assert second["id"] == first["id"]
+    assert second["selected_columns"] == {"region": {"in": ["S"]}}
+    assert db.query(FilterSelection).count() == 1
+    assert crud.get_saved_filter(db, analysis.dataset_id, analysis.id) == {"region": {"in": ["S"]}}
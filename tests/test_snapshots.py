@@ -0,0 +1,90 @@
+# tests/test_snapshots.py
+import os
+
+import pandas as pd
+import pytest
+
+import crud
+import dataset_loader
+import snapshots
+import storage
+from dataset_loader import DataFrameCache
+from models import DatasetMetadata
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = DataFrameCache(dataset_loader.DATASET_CACHE_MAX_BYTES)
+    monkeypatch.setattr(dataset_loader, "cache", cache)
+    return cache
+
+
+def _put(s3, key: str, df: pd.DataFrame, mtime_ns: int):
+    s3.put_object(Bucket="bkt", Key=key, Body=df.to_csv(index=False).encode())
+    # FilesystemS3 derives the ETag from size and mtime
+    os.utime(s3._path("bkt", key), ns=(mtime_ns, mtime_ns))
+
+
+def _snapshots(key: str):
+    directory = os.path.dirname(snapshots.snapshot_path("bkt", key, ""))
+    return sorted(name for name in os.listdir(directory) if name.endswith(".arrow"))
+
+
+# a rewrite of the same size is still a new version: neither the cache nor the old snapshot is served
+@pytest.mark.parametrize("columns", [None, ["qty"]])
+def test_rewritten_file_is_read_again(s3, cache, columns):
+    old = pd.DataFrame({"region": ["North", "South"], "qty": [1, 2]})
+    new = pd.DataFrame({"region": ["North", "South"], "qty": [3, 4]})
+    _put(s3, "data.csv", old, 1_700_000_000_000_000_000)
+    dataset_loader.ingest_dataset(s3, "bkt", "data.csv")
+    assert dataset_loader.load_dataset(s3, "bkt", "data.csv", columns)["qty"].tolist() == [1, 2]
+    old_snapshot = _snapshots("data.csv")
+
+    _put(s3, "data.csv", new, 1_700_000_000_000_000_001)
+    assert s3.head_object(Bucket="bkt", Key="data.csv")["ContentLength"] == len(old.to_csv(index=False))
+    assert dataset_loader.load_dataset(s3, "bkt", "data.csv", columns)["qty"].tolist() == [3, 4]
+    assert dataset_loader.snapshot_table(s3, "bkt", "data.csv").column("qty").to_pylist() == [3, 4]
+
+    # the new version's snapshot replaced the old one
+    assert len(_snapshots("data.csv")) == 1 and _snapshots("data.csv") != old_snapshot
+
+
+def test_ingest_profiles_the_new_version(s3):
+    _put(s3, "data.csv", pd.DataFrame({"day": ["01/15/2024", "02/01/2024"]}), 1_700_000_000_000_000_000)
+    assert dataset_loader.ingest_dataset(s3, "bkt", "data.csv")["dtype_plan"]["day"]["dtype"] == "datetime"
+
+    _put(s3, "data.csv", pd.DataFrame({"day": ["first", "second", "third"]}), 1_700_000_000_000_000_001)
+    info = dataset_loader.ingest_dataset(s3, "bkt", "data.csv")
+    assert info["num_rows"] == 3
+    assert info["dtype_plan"]["day"]["dtype"] != "datetime"
+
+
+def test_invalidate_drops_every_version(s3):
+    _put(s3, "data.csv", pd.DataFrame({"qty": [1, 2]}), 1_700_000_000_000_000_000)
+    dataset_loader.ingest_dataset(s3, "bkt", "data.csv")
+    version = dataset_loader.object_version(s3, "bkt", "data.csv")
+    assert snapshots.open_snapshot("bkt", "data.csv", version) is not None
+
+    snapshots.invalidate("bkt", "data.csv")
+    assert snapshots.open_snapshot("bkt", "data.csv", version) is None
+    # invalidating again, or an object that never had one, is a no-op
+    snapshots.invalidate("bkt", "data.csv")
+    snapshots.invalidate("bkt", "missing.csv")
+
+
+# once a newer file lands under the dataset prefix, the replaced file's snapshot goes
+def test_moving_latest_file_drops_its_snapshot(s3, db, monkeypatch):
+    monkeypatch.setattr(crud, "s3_client", s3)
+    monkeypatch.setattr(storage, "latest_files", storage.LatestFileResolver(0))
+    _put(s3, "sales/jan.csv", pd.DataFrame({"qty": [1, 2]}), 1_700_000_000_000_000_000)
+    metadata = DatasetMetadata(dataset_name="sales", s3_bucket="bkt", s3_key="sales/")
+    db.add(metadata)
+    db.commit()
+    assert crud.refresh_latest_file(db, metadata) == "sales/jan.csv"
+    dataset_loader.ingest_dataset(s3, "bkt", "sales/jan.csv")
+    jan = dataset_loader.object_version(s3, "bkt", "sales/jan.csv")
+
+    _put(s3, "sales/feb.csv", pd.DataFrame({"qty": [3, 4]}), 1_700_000_000_000_000_001)
+    assert crud.refresh_latest_file(db, metadata) == "sales/feb.csv"
+    assert snapshots.open_snapshot("bkt", "sales/jan.csv", jan) is None
+    assert metadata.latest_file == "sales/feb.csv" and metadata.dtype_plan is None